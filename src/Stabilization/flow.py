@@ -0,0 +1,160 @@
+"""Module for propagating bounding boxes with sparse optical flow"""
+
+import cv2
+import numpy as np
+from src.stabilisierung.keyframe import KeyframeScheduler
+
+
+class BoxFlow():
+    """Moves bounding boxes from one frame to the next with Lucas-Kanade flow.
+
+    Corners are picked inside of every box and followed into the next
+    frame. The box is moved by the median displacement of the points that
+    were followed reliably, so a few points on the background do not drag
+    the box along.
+    """
+
+    def __init__(self, max_points=30, quality_level=0.01, min_points=5,  # pylint: disable=R0913
+                 min_inliers=0.5, max_error=1.0, win_size=(15, 15), max_level=2):
+        """Initialize the flow settings.
+
+        Args:
+            max_points(int): maximum number of corners followed per box
+            quality_level(float): minimum corner quality, relative to the best
+                corner of the box
+            min_points(int): boxes with fewer reliable points can not be moved
+            min_inliers(float): fraction of the corners of a box that has to be
+                followed reliably, else the box can not be moved
+            max_error(float): maximum forward-backward error in pixels of a
+                reliable point. Every point is followed back into the first
+                frame and has to land next to where it started.
+            win_size(tuple): search window of the Lucas-Kanade flow
+            max_level(int): number of pyramid levels of the Lucas-Kanade flow
+        Return:
+            None
+        """
+
+        self.max_points = max_points
+        self.quality_level = quality_level
+        self.min_points = min_points
+        self.min_inliers = min_inliers
+        self.max_error = max_error
+        self.lk_params = {'winSize': win_size, 'maxLevel': max_level,
+                          'criteria': (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT,
+                                       10, 0.03)}
+
+    def corners(self, gray, box):
+        """Finds good points to follow inside of a box.
+
+        Args:
+            gray: gray frame
+            box: bounding box [x_up, y_up, x_down, y_down]
+        Return:
+            points(numpy array: nx1x2): float32 points, None if there are none
+        """
+
+        height, width = gray.shape[:2]
+        x_up, y_up = max(0, int(box[0])), max(0, int(box[1]))
+        x_down, y_down = min(width, int(box[2])), min(height, int(box[3]))
+        if x_down - x_up < 2 or y_down - y_up < 2:
+            return None
+        points = cv2.goodFeaturesToTrack(gray[y_up:y_down, x_up:x_down], self.max_points,
+                                         qualityLevel=self.quality_level, minDistance=3)
+        if points is None:
+            return None
+        return points + np.array([x_up, y_up], dtype=np.float32)
+
+    def propagate(self, prev_gray, gray, boxes):
+        """Moves the boxes of the previous frame into the current frame.
+
+        Args:
+            prev_gray: gray previous frame, on which the boxes were found
+            gray: gray current frame
+            boxes: bounding boxes [x_up, y_up, x_down, y_down] of the previous frame
+        Return:
+            moved(list): moved bounding box of every box, None for the boxes that
+                could not be followed reliably
+        """
+
+        points = [self.corners(prev_gray, box) for box in boxes]
+        found = [box_points for box_points in points if box_points is not None]
+        if not found:
+            return [None] * len(boxes)
+        # the points of all boxes are followed in one call, forward and back
+        start = np.concatenate(found)
+        end, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, start, None,
+                                                  **self.lk_params)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, prev_gray, end, None,
+                                                        **self.lk_params)
+        reliable = (status.ravel() == 1) & (back_status.ravel() == 1) & \
+            (np.linalg.norm((back - start).reshape(-1, 2), axis=1) <= self.max_error)
+
+        moved = []
+        offset = 0
+        for box, box_points in zip(boxes, points):
+            if box_points is None:
+                moved.append(None)
+                continue
+            count = len(box_points)
+            good = reliable[offset:offset + count]
+            shift = (end - start).reshape(-1, 2)[offset:offset + count][good]
+            offset += count
+            if good.sum() < max(self.min_points, self.min_inliers * count):
+                moved.append(None)
+                continue
+            d_x, d_y = np.median(shift, axis=0)
+            moved.append([int(round(box[0] + d_x)), int(round(box[1] + d_y)),
+                          int(round(box[2] + d_x)), int(round(box[3] + d_y))])
+        return moved
+
+
+class FlowKeyframes():
+    """Runs the detection on keyframes and moves the boxes with optical flow between.
+
+    The boxes of the last frame are moved into the next frame and handed to
+    the Tracker like detections. The detection runs again on the next
+    keyframe, or right away if too many boxes could not be followed.
+    """
+
+    def __init__(self, interval=5, max_lost=0, flow=None):
+        """Initialize the keyframe schedule.
+
+        Args:
+            interval(int): the detection runs every interval frames
+            max_lost(int): number of boxes that may get lost by the flow on a
+                frame; if more are lost, the frame is detected instead
+            flow(BoxFlow): optical flow settings, None uses the defaults
+        Return:
+            None
+        """
+
+        self.scheduler = KeyframeScheduler(interval)
+        self.max_lost = max_lost
+        self.flow = BoxFlow() if flow is None else flow
+        self.prev_gray = None
+        self.boxes = []  # boxes of the last frame
+        self.detections = 0  # number of frames the detection ran on
+
+    def update(self, gray, detect):
+        """Returns the bounding boxes of the current frame.
+
+        Args:
+            gray: gray current frame
+            detect: function without arguments that detects the boxes
+                [x_up, y_up, x_down, y_down] on the current frame
+        Return:
+            boxes(list): detected boxes on keyframes, else the moved boxes
+        """
+
+        boxes = None
+        if not self.scheduler.advance() and self.prev_gray is not None:
+            moved = self.flow.propagate(self.prev_gray, gray, self.boxes)
+            if sum(box is None for box in moved) <= self.max_lost:
+                boxes = [box for box in moved if box is not None]
+        if boxes is None:
+            # keyframe, or the flow lost too many boxes
+            boxes = list(detect())
+            self.detections += 1
+        self.prev_gray = gray
+        self.boxes = boxes
+        return boxes
@@ -0,0 +1,97 @@
+"""Module for keyframe scheduling of the detection"""
+
+import numpy as np
+from src.stabilisierung.motion import merge_regions
+
+
+class KeyframeScheduler():
+    """Schedules full frame detections and local re-detections.
+
+    Every interval-th frame is a keyframe, on which the whole frame is scanned.
+    On the frames in between only padded windows around the Kalman predictions
+    of the tracks are scanned.
+    """
+
+    def __init__(self, interval=5, padding=40):
+        """Initialize the scheduler.
+
+        Args:
+            interval(int): a full frame detection runs every interval frames
+            padding(int): pixels added around the predicted bounding boxes
+        Return:
+            None
+        """
+
+        self.interval = interval
+        self.padding = padding
+        self.frame_count = 0
+        self.force_full = True  # the first frame is always a keyframe
+        self.keyframe = True
+        self.expected = 0  # number of tracks the windows were made for
+
+    @staticmethod
+    def active_tracks(tracker):
+        """Returns the tracks of a tracker that are still followed.
+
+        Args:
+            tracker: Tracker class object
+        Return:
+            list of Track objects, that were not skipped for too long
+        """
+
+        return [track for track in tracker.tracks
+                if track.skipped_frames <= tracker.max_frames_to_skip]
+
+    def advance(self):
+        """Advances the schedule by one frame.
+
+        Return:
+            True if the frame is a keyframe
+        """
+
+        self.keyframe = self.force_full or self.frame_count % self.interval == 0
+        self.frame_count += 1
+        if self.keyframe:
+            self.force_full = False
+        return self.keyframe
+
+    def plan(self, tracker, shape):
+        """Decides which part of the next frame is scanned.
+
+        Args:
+            tracker: Tracker class object, that predicts the bounding boxes
+                [x_up, y_up, x_down, y_down] of the tracked objects.
+            shape: shape of the frame
+        Return:
+            None for a keyframe (whole frame), else a list of windows
+            [x, y, width, height] around the predicted bounding boxes.
+        """
+
+        if self.advance():
+            return None
+
+        height, width = shape[:2]
+        windows = []
+        tracks = self.active_tracks(tracker)
+        for track in tracks:
+            x_up, y_up, x_down, y_down = np.array(track.prediction, dtype=int).flatten()
+            x_up = min(max(0, x_up - self.padding), width)
+            y_up = min(max(0, y_up - self.padding), height)
+            x_down = min(max(0, x_down + self.padding), width)
+            y_down = min(max(0, y_down + self.padding), height)
+            if x_down > x_up and y_down > y_up:
+                windows.append([x_up, y_up, x_down - x_up, y_down - y_up])
+        self.expected = len(tracks)
+        return merge_regions(windows)
+
+    def observe(self, detections):
+        """Forces a full frame scan on the next frame, if a track got lost.
+
+        Args:
+            detections: bounding boxes detected on the current frame
+        Return:
+            None
+        """
+
+        if not self.keyframe and len(detections) < self.expected:
+            self.force_full = True
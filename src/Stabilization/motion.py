@@ -0,0 +1,115 @@
+"""Module for motion gating, which finds the changed regions of a frame"""
+
+import cv2
+import numpy as np
+from src.preprocessing.frame_context import FrameContext
+
+
+def merge_regions(regions):
+    """Merges overlapping regions until no region overlaps another.
+
+    Args:
+        regions(list): regions [x, y, width, height]
+    Return:
+        merged(list): regions [x, y, width, height] without overlaps
+    """
+
+    merged = [list(region) for region in regions]
+    changed = True
+    while changed:
+        changed = False
+        for i, first in enumerate(merged):
+            for j in range(i + 1, len(merged)):
+                second = merged[j]
+                if first[0] < second[0] + second[2] and second[0] < first[0] + first[2] \
+                        and first[1] < second[1] + second[3] and second[1] < first[1] + first[3]:
+                    x_up = min(first[0], second[0])
+                    y_up = min(first[1], second[1])
+                    x_down = max(first[0] + first[2], second[0] + second[2])
+                    y_down = max(first[1] + first[3], second[1] + second[3])
+                    merged[i] = [x_up, y_up, x_down - x_up, y_down - y_up]
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+    return merged
+
+
+class MotionGate():
+    """Finds the regions of a frame that changed against a running background.
+
+    The background model works on a downscaled gray frame, so it costs a
+    fraction of a detection. Only the returned dirty regions have to be
+    scanned by the detectors, since a fixed camera sees mostly static pixels.
+    """
+
+    def __init__(self, scale=0.25, threshold=25, learning_rate=0.05,  # pylint: disable=R0913
+                 padding=32, min_area=4):
+        """Initialize the background model.
+
+        Args:
+            scale(float): factor by which the frames are downscaled
+            threshold(int): gray value difference that counts as motion
+            learning_rate(float): how fast the background adapts to the frames
+            padding(int): pixels added around every dirty region (full resolution),
+                so objects that move only partially are still found completely
+            min_area(int): changed areas smaller than it (downscaled pixels) are
+                ignored as noise
+        Return:
+            None
+        """
+
+        self.scale = scale
+        self.threshold = threshold
+        self.learning_rate = learning_rate
+        self.padding = padding
+        self.min_area = min_area
+        self.background = None
+        self.skipped_fractions = []  # fraction of every frame that was skipped
+
+    def update(self, frame, context=None):
+        """Updates the background and returns the dirty regions of a frame.
+
+        Args:
+            frame: Current frame as an array
+            context: FrameContext of the frame, whose gray frame is shared
+                with the detectors. None creates a new one.
+        Return:
+            regions(list): dirty regions [x, y, width, height] in full frame
+                coordinates. The whole frame is dirty for the first frame.
+        """
+
+        height, width = frame.shape[:2]
+        if context is None:
+            context = FrameContext(frame)
+        small = context.resized(round(width * self.scale), round(height * self.scale), gray=True)
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+
+        if self.background is None:
+            self.background = small.astype(np.float32)
+            self.skipped_fractions.append(0.0)
+            return [[0, 0, width, height]]
+
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+        cv2.accumulateWeighted(small, self.background, self.learning_rate)
+        _, mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        mask = cv2.dilate(mask, None, iterations=2)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        regions = []
+        for contour in contours:
+            if cv2.contourArea(contour) < self.min_area:
+                continue
+            x_small, y_small, wide, high = cv2.boundingRect(contour)
+            # back to full frame coordinates, padded and clipped to the frame
+            x_up = max(0, int(x_small / self.scale) - self.padding)
+            y_up = max(0, int(y_small / self.scale) - self.padding)
+            x_down = min(width, int((x_small + wide) / self.scale) + self.padding)
+            y_down = min(height, int((y_small + high) / self.scale) + self.padding)
+            regions.append([x_up, y_up, x_down - x_up, y_down - y_up])
+        regions = merge_regions(regions)
+
+        dirty = sum(wide * high for _, _, wide, high in regions)
+        self.skipped_fractions.append(1 - dirty / (width * height))
+        return regions
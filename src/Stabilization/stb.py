@@ -1,17 +1,28 @@
 """Module for stabilization of boundry boxes"""
 
+from functools import partial
 import os
 from os.path import isfile, join
 from pathlib import Path
 import cv2
 import numpy as np
 from src.stabilisierung.tracker import Tracker
-from src.detect_pedestrians.pedestrianrec import generate_pedestrian_boxes
-from src.detect_platings.detect_platings import detect_image
+from src.stabilisierung.motion import MotionGate
+from src.stabilisierung.keyframe import KeyframeScheduler
+from src.stabilisierung.flow import BoxFlow, FlowKeyframes
+from src.detect_pedestrians.pedestrianrec import PedestrianDetector, generate_pedestrian_boxes
+from src.detect_pedestrians.adaptive import AdaptiveResolution
+from src.detect_platings.detect_platings import PlateDetector, default_detector
+from src.detect_platings.backends import DEFAULT_BACKEND
 from src.ocr.ocr import reset_plates
+from src.ocr.confidence import CONFIDENCE_WINDOW
+from src.ocr.ocr_worker import OCRWorker
+from src.ocr.plate_store import PlateStore
+from src.preprocessing.frame_context import FrameContext
 
 
-def pedestrians(frame, tracker):
+def pedestrians(frame, tracker, regions=None, context=None,  # pylint: disable=R0913
+                detector=None, boxes=None):
     """Function for pedestrians.
 
     This function uses 'generate_pedestrian_boxes' function to detect pedestrians
@@ -23,6 +34,14 @@ def pedestrians(frame, tracker):
             their bounding boxes will be drawn.
         tracker: Tracker class object, in which the detected pedestrian-
             object-coordinates are kept and tracked.
+        regions: Regions [x, y, width, height] of the frame to which the
+            detection is limited. If None, the whole frame is scanned.
+        context: FrameContext of the frame, shared with the other stages.
+        detector: PedestrianDetector to use. If None, the shared default
+            detector is used.
+        boxes: Boxes [x_up, y_up, x_down, y_down] already detected on the
+            frame, e.g. by PedestrianDetector.detect_many. If given, the
+            frame is only tracked and drawn on.
     Return:
         frame: One frame with bounding boxes of detected and tracked
             objects(pedestrians). The inner areas of bounding boxes are
@@ -32,7 +51,12 @@ def pedestrians(frame, tracker):
     # Detect and return coordinates of the boundary boxes in the frame
     # Return of function for a frame:
     # array_of_bboxes_in_a_frame = [[x_up, y_up, x_down, y_down], [],... []]
-    list_pedestrians = generate_pedestrian_boxes(frame)
+    if boxes is not None:
+        list_pedestrians = boxes
+    elif detector is not None:
+        list_pedestrians = detector.detect(frame, regions, context)
+    else:
+        list_pedestrians = generate_pedestrian_boxes(frame, regions, context)
 
     # If boundary boxes are detected, track them.
     if len(list_pedestrians) > 0:
@@ -52,10 +76,11 @@ def pedestrians(frame, tracker):
     return frame
 
 
-def platings(frame, tracker):
+def platings(frame, tracker, detector=None, ocr_worker=None,  # pylint: disable=R0913
+             regions=None, scheduler=None, context=None):
     """Function for license plates.
 
-    This function uses 'detect_image' function to detect license plates on a
+    This function uses a PlateDetector object to detect license plates on a
     frame and update their coordinates using a Tracker object and Track
     objects. It also draws bounding boxes around the objects and blur them.
 
@@ -64,6 +89,16 @@ def platings(frame, tracker):
             their bounding boxes will be drawn.
         tracker: Tracker class object, in which the detected license plates
             coordinates are kept and tracked.
+        detector: PlateDetector class object, which is reused for every
+            frame. If None, the shared default detector is used.
+        ocr_worker: OCRWorker class object, to which the detected plates
+            are submitted for reading. If None, the plates are not read.
+        regions: Regions [x, y, width, height] of the frame to which the
+            detection is limited. If None, the whole frame is scanned.
+        scheduler: KeyframeScheduler class object. If given, only keyframes
+            are scanned with the regions, the other frames are scanned
+            in windows around the predictions of the tracker.
+        context: FrameContext of the frame, shared with the other stages.
     Return:
         frame: One frame with bounding boxes of detected and tracked
             objects(license plates). The inner areas of bounding boxes
@@ -73,7 +108,16 @@ def platings(frame, tracker):
     # Detect and return coordinates of the boundary boxes in the frame
     # return of function for a frame:
     # array_of_bboxes_in_a_frame = [[x_up, y_up, width, height], [],... []]
-    list_plates = detect_image(frame)
+    if detector is None:
+        detector = default_detector()
+    if scheduler is not None:
+        windows = scheduler.plan(tracker, frame.shape)
+        if windows is not None:
+            regions = windows
+    list_plates = detector.detect(frame, regions, context)
+    if scheduler is not None:
+        scheduler.observe(list_plates)
+    boxes = [list(pos) for pos in list_plates]
     for pos in list_plates:
         pos[2] = pos[0] + pos[2]
         pos[3] = pos[1] + pos[3]
@@ -83,6 +127,11 @@ def platings(frame, tracker):
 
         # Track objects using Tracker and Kalman filter
         tracker.update(list_plates)
+        # The plates have to be submitted before they get blurred,
+        # the reads of a track are voted on
+        if ocr_worker is not None:
+            ocr_worker.submit(frame, boxes, context,
+                              [tracker.matches.get(i) for i in range(len(boxes))])
 
         for track in tracker.tracks:
             track_pos = np.array(track.correction, dtype=int).flatten()
@@ -97,6 +146,9 @@ def platings(frame, tracker):
 
     # If there is no detection
     else:
+        if ocr_worker is not None:
+            # nothing to read, but the frame counts for the confidence window
+            ocr_worker.submit(frame, [], context)
         list_plates = []
         for track in tracker.tracks:
             track.kalman.r_matrix = 0
@@ -118,12 +170,168 @@ def platings(frame, tracker):
     return frame
 
 
-def execute():
-    """Main function."""
+class PedestrianSettings():
+    """Settings of the pedestrian detection of execute, builds its detector and flow."""
+
+    def __init__(self, processes=1, keyframe_interval=1, budget=None,  # pylint: disable=R0913
+                 max_lost=0, flow_settings=None):
+        """Checks that the settings can be combined.
+
+        Args:
+            processes: Number of processes the pedestrian detection is spread
+                over. With more than one, the pedestrians of several frames are
+                detected at once, before anything is drawn on them.
+            keyframe_interval: Pedestrians are detected every keyframe_interval
+                frames, in between their boxes are moved with optical flow. 1
+                detects on every frame. Can not be combined with several
+                processes: if a frame is detected depends on the flow of the
+                frame before, so the frames of a chunk can not be detected in
+                advance.
+            budget: Time budget per frame in seconds for the pedestrian
+                detection. If given, the resolution of the detection adapts to
+                it. Can not be combined with several processes.
+            max_lost: Number of pedestrian boxes the optical flow may lose on a
+                frame between keyframes, if more are lost the frame is detected
+                instead.
+            flow_settings: Keyword arguments of the BoxFlow that moves the
+                pedestrian boxes between keyframes, e.g. {'min_points': 5,
+                'min_inliers': 0.5, 'max_error': 1.0}. None uses the defaults.
+
+        Raises:
+            ValueError: If budget or keyframe_interval is combined with several
+                processes.
+        """
+
+        if budget is not None and processes > 1:
+            raise ValueError('The adaptive resolution works on single frames only')
+        if keyframe_interval > 1 and processes > 1:
+            raise ValueError('The pedestrian keyframes are chosen frame by frame, '
+                             'use a single pedestrian process')
+        self.processes = processes
+        self.keyframe_interval = keyframe_interval
+        self.budget = budget
+        self.max_lost = max_lost
+        self.flow_settings = flow_settings
+        # with several processes the pedestrians of a chunk of frames are detected at once
+        self.chunk_size = 4 * processes if processes > 1 else 1
+
+    def detector(self):
+        """Returns the detector, the HOG descriptor is built once, and once in every process"""
+
+        return PedestrianDetector(processes=self.processes) if self.budget is None \
+            else AdaptiveResolution(self.budget)
+
+    def flow(self):
+        """Returns the FlowKeyframes between the detections, None if every frame is detected"""
+
+        if self.keyframe_interval <= 1:
+            return None
+        return FlowKeyframes(self.keyframe_interval, self.max_lost,
+                             BoxFlow(**(self.flow_settings or {})))
+
+
+class Pipeline():  # pylint: disable=R0902
+    """Stages of execute, that detect, track and blur the plates and pedestrians of frames.
+
+    The stages are built once for the whole video, the license plates are
+    read in the background and saved to the index of a PlateStore.
+    """
+
+    def __init__(self, motion_gating=False, keyframe_interval=1,  # pylint: disable=R0913
+                 keyframe_padding=40, calibration=None, plate_backend=DEFAULT_BACKEND,
+                 pedestrian=None, confidence_window=CONFIDENCE_WINDOW):
+        """Builds the stages, see execute for the arguments."""
+
+        self.pedestrian = PedestrianSettings() if pedestrian is None else pedestrian
+        # dist_thresh, max_frames_to_skip
+        self.pedestrians_tracker = Tracker(150, 30)
+        self.platings_tracker = Tracker(150, 30)
+        # the cascade is loaded once for the whole video
+        self.plate_detector = PlateDetector(plate_backend, calibration=calibration)
+        self.pedestrian_detector = self.pedestrian.detector()
+        self.pedestrian_flow = self.pedestrian.flow()
+        # the plates are read in the background while the next frames are detected,
+        # and the confident ones are saved to the index behind the reading
+        self.plate_store = PlateStore()
+        self.ocr_worker = OCRWorker(results=self.plate_store, window=confidence_window)
+        self.motion_gate = MotionGate() if motion_gating else None
+        self.scheduler = KeyframeScheduler(keyframe_interval, keyframe_padding) \
+            if keyframe_interval > 1 else None
+        self.count = 0  # number of processed frames
+
+    def process(self, images):
+        """Detects, tracks and draws the plates and pedestrians of a chunk of frames.
+
+        Args:
+            images: frames of the chunk, at most pedestrian.chunk_size
+        Return:
+            list of the frames with the blurred and drawn boxes
+        """
+
+        # every transform of a frame is computed at most once
+        contexts = [FrameContext(image) for image in images]
+        # The dirty regions are found before anything is drawn on the frames
+        regions = [self.motion_gate.update(image, context) if self.motion_gate else None
+                   for image, context in zip(images, contexts)]
+        boxes = self.pedestrian_detector.detect_many(images, regions) \
+            if self.pedestrian.processes > 1 else [None] * len(images)
+        frames = []
+        for image, context, frame_regions, frame_boxes in zip(images, contexts, regions, boxes):
+            if self.pedestrian_flow is not None:
+                # the flow follows the frame before the plates are drawn on it
+                frame_boxes = self.pedestrian_flow.update(context.gray, partial(
+                    self.pedestrian_detector.detect, image, frame_regions, context))
+            image = platings(image, self.platings_tracker, self.plate_detector,
+                             self.ocr_worker, frame_regions, self.scheduler, context)
+            frames.append(pedestrians(image, self.pedestrians_tracker, frame_regions, context,
+                                      self.pedestrian_detector, frame_boxes))
+        self.count += len(frames)
+        return frames
+
+    def close(self):
+        """Waits for the plates that are still being read and prints the statistics"""
+
+        self.pedestrian_detector.close()
+        self.ocr_worker.close()
+        self.plate_store.close()
+        if self.pedestrian.budget is not None:
+            print(f'Pedestrian detection levels: {np.bincount(self.pedestrian_detector.levels)}')
+        if self.pedestrian_flow:
+            print(f'Pedestrians detected on {self.pedestrian_flow.detections} '
+                  f'of {self.count} frames')
+        if self.motion_gate:
+            fractions = self.motion_gate.skipped_fractions
+            print(f'Motion gating skipped {np.mean(fractions) if fractions else 0:.0%} '
+                  'of the frame area')
+
+
+def execute(motion_gating=False, keyframe_interval=1, keyframe_padding=40,  # pylint: disable=R0913
+            calibration=None, plate_backend=DEFAULT_BACKEND, pedestrian=None,
+            confidence_window=CONFIDENCE_WINDOW):
+    """Main function.
+
+    Args:
+        motion_gating: If True, the detectors only scan the regions of a
+            frame that changed, which suits fixed cameras.
+        keyframe_interval: License plates are searched on the whole frame
+            every keyframe_interval frames, in between only around the
+            tracked plates. 1 scans every frame completely.
+        keyframe_padding: Pixels added around the tracked plates for the
+            detection between keyframes.
+        calibration: PerspectiveCalibration of the camera. If given, plates
+            are only searched at the sizes plausible for their image row.
+        plate_backend: Name of the license plate detector backend, e.g.
+            'haar', or 'lbp' once its cascade is trained with train_lbp.py.
+        pedestrian: PedestrianSettings of the pedestrian detection, e.g. its
+            processes, keyframes or time budget. None detects every frame in
+            this process.
+        confidence_window: Number of frames the reads of a plate string are
+            counted until it is confirmed, see OCRWorker. None counts every
+            read of the video.
+    """
 
-    # dist_thresh, max_frames_to_skip
-    pedestrians_tracker = Tracker(150, 30)
-    platings_tracker = Tracker(150, 30)
+    pipeline = Pipeline(motion_gating, keyframe_interval, keyframe_padding, calibration,
+                        plate_backend, pedestrian, confidence_window)
 
     pfad_in = Path(__file__).parent / 'input_frames'
     pfad_out = Path(__file__).parent / 'output_frames'
@@ -131,14 +339,11 @@ def execute():
     files = [f for f in os.listdir(pfad_in) if isfile(join(pfad_in, f))]
     files.sort(key=lambda x: int(x[5:-4]))
 
-    count = 0
-
-    for fil in files:
-
-        image = cv2.imread(str(pfad_in / fil))
-        image = platings(image, platings_tracker)
-        image_out = pedestrians(image, pedestrians_tracker)
-        cv2.imwrite(str(pfad_out / f'frame{count}.jpg'), image_out)
-        count += 1
+    for start in range(0, len(files), pipeline.pedestrian.chunk_size):
+        images = [cv2.imread(str(pfad_in / fil))
+                  for fil in files[start:start + pipeline.pedestrian.chunk_size]]
+        for count, image_out in enumerate(pipeline.process(images), start):
+            cv2.imwrite(str(pfad_out / f'frame{count}.jpg'), image_out)
+    pipeline.close()
     # Reset detected plates, so program can be run again
     reset_plates()
@@ -3,11 +3,17 @@
 from copy import deepcopy
 import os
 from pathlib import Path
+from mock import MagicMock, patch
 import numpy as np
 import pytest
 from cv2 import cv2
-from src.stabilisierung.stb import platings, pedestrians
+from src.stabilisierung.stb import PedestrianSettings, platings, pedestrians
 from src.stabilisierung.tracker import Tracker
+from src.stabilisierung.motion import MotionGate, merge_regions
+from src.stabilisierung.keyframe import KeyframeScheduler
+from src.stabilisierung.flow import FlowKeyframes
+from src.detect_platings.detect_platings import PlateDetector
+from src.ocr.ocr_worker import OCRWorker
 
 
 img_list_1 = []
@@ -24,6 +30,7 @@ for image in files:
 
 pos1 = [172, 251, 435, 339]
 pos2 = [162, 244, 434, 335]
+detector = PlateDetector()
 
 
 @pytest.mark.parametrize("img", img_list_1)
@@ -66,9 +73,9 @@ def test_single_image_platings(img):
     tracker_1 = Tracker(160, 3)
     tracker_2 = Tracker(160, 3)
     for _ in range(10):
-        img_copy_1 = platings(img_copy_1, tracker_1)
+        img_copy_1 = platings(img_copy_1, tracker_1, detector)
     for _ in range(30):
-        img_copy_2 = platings(img_copy_2, tracker_2)
+        img_copy_2 = platings(img_copy_2, tracker_2, detector)
     assert np.any(img_copy_1 == img_copy_2)
 
 
@@ -85,7 +92,7 @@ def test_image1_bbox():
     img = deepcopy(img_list_2[0])
     tracker = Tracker(160, 3)
     for _ in range(15):
-        img = platings(img, tracker)
+        img = platings(img, tracker, detector)
     for track in tracker.tracks:
         track_pos = np.array(track.correction, dtype=int).flatten()
         assert np.all(pos1 == track_pos)
@@ -104,7 +111,158 @@ def test_image2_bbox():
     img = deepcopy(img_list_2[1])
     tracker = Tracker(160, 3)
     for _ in range(15):
-        img = platings(img, tracker)
+        img = platings(img, tracker, detector)
     for track in tracker.tracks:
         track_pos = np.array(track.correction, dtype=int).flatten()
         assert np.all(pos2 == track_pos)
+
+
+def test_motion_gate():
+    """Test for the motion gating.
+
+    The first frame is dirty as a whole. A static frame afterwards is skipped
+    completely, while a changed patch is returned as a padded region in full
+    frame coordinates.
+    """
+
+    img = deepcopy(img_list_2[0])
+    gate = MotionGate(padding=8)
+    height, width = img.shape[:2]
+    assert gate.update(img) == [[0, 0, width, height]]
+    assert gate.update(img) == []
+    changed = deepcopy(img)
+    changed[100:160, 200:280] = 255 - changed[100:160, 200:280]
+    regions = gate.update(changed)
+    assert len(regions) == 1
+    x_up, y_up, wide, high = regions[0]
+    assert x_up <= 200 and y_up <= 100
+    assert x_up + wide >= 280 and y_up + high >= 160
+    assert gate.skipped_fractions[:2] == [0.0, 1.0]
+    assert 0.5 < gate.skipped_fractions[2] < 1.0
+
+
+def test_merge_regions():
+    """Test that overlapping regions are merged into one."""
+
+    regions = [[0, 0, 10, 10], [5, 5, 10, 10], [14, 0, 5, 5], [40, 40, 5, 5]]
+    assert merge_regions(regions) == [[0, 0, 19, 15], [40, 40, 5, 5]]
+
+
+def test_keyframe_scheduler():
+    """Test for the keyframe scheduling.
+
+    Every third frame is a keyframe. In between only a padded window around
+    the tracked plate is returned. If the plate is not found in its window,
+    the next frame is forced to be a keyframe.
+    """
+
+    tracker = Tracker(160, 3)
+    tracker.update([pos1])
+    scheduler = KeyframeScheduler(interval=3, padding=10)
+    shape = img_list_2[0].shape
+    assert scheduler.plan(tracker, shape) is None
+    scheduler.observe([pos1])
+    windows = scheduler.plan(tracker, shape)
+    assert len(windows) == 1
+    x_up, y_up, wide, high = windows[0]
+    assert x_up <= pos1[0] - 9 and y_up <= pos1[1] - 9
+    assert x_up + wide >= pos1[2] + 9 and y_up + high >= pos1[3] + 9
+    scheduler.observe([pos1])
+    assert scheduler.plan(tracker, shape) is not None
+    scheduler.observe([])
+    assert scheduler.plan(tracker, shape) is None
+
+
+def test_image1_keyframes():
+    """Test that the keyframe scheduling keeps the plate of the first
+    image in license plates list (img_list_2) tracked and blurred.
+    """
+
+    img = deepcopy(img_list_2[0])
+    tracker = Tracker(160, 3)
+    scheduler = KeyframeScheduler(interval=4)
+    for _ in range(8):
+        img = platings(img, tracker, detector, scheduler=scheduler)
+    assert len(KeyframeScheduler.active_tracks(tracker)) == 1
+    track_pos = np.array(tracker.tracks[0].correction, dtype=int).flatten()
+    assert np.all(np.abs(track_pos - pos1) < 20)
+
+
+def test_flow_keyframes():
+    """Test for the keyframe detection with optical flow.
+
+    The plate box of the first image is moved along with the image, the
+    detection only runs on the keyframes. On a blank frame the box gets
+    lost, so that frame is detected instead.
+    """
+
+    gray = cv2.cvtColor(img_list_2[0], cv2.COLOR_BGR2GRAY)
+    keyframes = FlowKeyframes(interval=3)
+    detections = []
+
+    def detect():
+        detections.append(len(detections))
+        return [pos1]
+
+    assert keyframes.update(gray, detect) == [pos1]
+    for shift in (1, 2):
+        moved = keyframes.update(np.roll(gray, (shift * 2, shift * 3), axis=(0, 1)), detect)
+        assert np.all(np.abs(np.array(moved[0]) - pos1 - [shift * 3, shift * 2] * 2) <= 1)
+    assert len(detections) == 1
+    keyframes.update(gray, detect)
+    assert len(detections) == 2
+    assert keyframes.update(np.zeros_like(gray), detect) == [pos1]
+    assert len(detections) == 3
+
+
+def test_execute_settings():
+    """Test if the pedestrian settings that need single frames reject several processes"""
+    with pytest.raises(ValueError):
+        PedestrianSettings(processes=2, budget=0.05)
+    with pytest.raises(ValueError):
+        PedestrianSettings(processes=2, keyframe_interval=5)
+    settings = PedestrianSettings(processes=2)
+    assert settings.chunk_size == 8
+    assert settings.flow() is None
+
+
+def test_tracker_matches():
+    """Test if the tracker records the track id of every detection"""
+    tracker = Tracker(150, 30)
+    tracker.update([[10, 10, 50, 30], [200, 200, 240, 220]])
+    first = dict(tracker.matches)
+    assert sorted(first.values()) == [0, 1]
+    # the detections moved a little and come in the other order
+    tracker.update([[203, 201, 243, 221], [12, 11, 52, 31]])
+    assert tracker.matches == {0: first[1], 1: first[0]}
+    # a new detection starts a new track
+    tracker.update([[14, 12, 54, 32], [206, 202, 246, 222], [400, 50, 440, 70]])
+    assert tracker.matches == {0: first[0], 1: first[1], 2: 2}
+
+
+def test_tracker_far_detection():
+    """Test if a detection further away than dist_thresh starts a new track, whose
+    plate is read though the plate of the old track was confirmed"""
+    tracker = Tracker(150, 2)
+    for _ in range(5):
+        tracker.update([[100, 100, 200, 130]])
+    tracker.update([[1500, 900, 1600, 930]])
+    assert tracker.matches == {0: 1} and len(tracker.tracks) == 2
+    # the old track is removed once it was missed more than max_frames_to_skip times
+    for _ in range(2):
+        tracker.update([[1500, 900, 1600, 930]])
+    assert [track.track_id_count for track in tracker.tracks] == [1]
+
+    img = img_list_2[0]
+    box = [[0, 0, 100, 30]]
+    worker = OCRWorker(workers=1, results=MagicMock())
+    worker.votes.vote(0, 'MKE1104', img, 1.0)
+    worker.votes.vote(0, 'MKE1104', img, 1.0)
+    worker.votes.vote(0, 'MKE1104', img, 1.0)
+    assert worker.votes.confirmed(0)
+    with patch('src.ocr.ocr.find_characters', return_value=[False, [], img]) as find:
+        worker.submit(img, box, track_ids=[0])
+        worker.submit(img, box, track_ids=[tracker.matches[0]])
+        worker.drain()
+        worker.close()
+    assert worker.skipped == 1 and find.call_count == 1
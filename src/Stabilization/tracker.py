@@ -62,6 +62,8 @@ class Tracker():  # pylint: disable=R0903
         self.max_frames_to_skip = max_frames_to_skip
         self.tracks = []
         self.track_id_count = 0
+        # track id every detection of the last update was assigned to, by detection index
+        self.matches = {}
 
     def update(self, detections):  # pylint: disable=R0912
         """Update tracks-vector using following steps:
@@ -75,6 +77,7 @@ class Tracker():  # pylint: disable=R0903
             - Look for unassigned detects.
             - Start new tracks.
             - Update KalmanFilter state and boundary boxes.
+            - Record the track id of every detection in self.matches.
         Args:
             detections: detected positions of boundary boxes to be tracked
                         on a frame
@@ -82,6 +85,7 @@ class Tracker():  # pylint: disable=R0903
             None
         """
 
+        self.matches = {}
         # Create tracks if no tracks-vector found.
         if not self.tracks:
             for detection in detections:
@@ -111,28 +115,25 @@ class Tracker():  # pylint: disable=R0903
 
         # Find current tracks with no assignment.
         for i, value in enumerate(assignment):
-            if value != -1:
-                # Check for cost distance threshold.
-                # If cost is very high, then unassign the track.
-                if cost[i][value] > self.dist_thresh:
-                    value = -1
-            else:
+            # Check for cost distance threshold.
+            # If cost is very high, then unassign the track.
+            if value != -1 and cost[i][value] > self.dist_thresh:
+                assignment[i] = -1
+            if assignment[i] == -1:
                 self.tracks[i].skipped_frames += 1
 
         # If tracks are not detected for long time, remove them.
-        for i, track in enumerate(self.tracks):
-            if track.skipped_frames > self.max_frames_to_skip:
-                try:
-                    del track
-                    del assignment[i]
-                except IndexError:
-                    pass
+        keep = [i for i, track in enumerate(self.tracks)
+                if track.skipped_frames <= self.max_frames_to_skip]
+        self.tracks = [self.tracks[i] for i in keep]
+        assignment = [assignment[i] for i in keep]
 
         # Look for unassigned detects.
         # If there is any, start new tracks.
         for i, detection in enumerate(detections):
             if i not in assignment:
                 track = Track(detection, self.track_id_count)
+                self.matches[i] = track.track_id_count
                 self.track_id_count += 1
                 self.tracks.append(track)
                 track.predict()
@@ -143,3 +144,4 @@ class Tracker():  # pylint: disable=R0903
                 self.tracks[i].skipped_frames = 0
                 self.tracks[i].predict()
                 self.tracks[i].correct(detections[value])
+                self.matches[value] = self.tracks[i].track_id_count
@@ -0,0 +1,70 @@
+"""Helpers shared by the benchmarks of the plate and the pedestrian detector"""
+
+import ast
+
+
+def iou(box_a, box_b):
+    """Intersection over union of two boxes.
+
+    Args:
+        box_a (list): x, y, width, height
+        box_b (list): x, y, width, height
+
+    Returns:
+        float: overlap between 0 and 1
+    """
+    width = min(box_a[0] + box_a[2], box_b[0] + box_b[2]) - max(box_a[0], box_b[0])
+    height = min(box_a[1] + box_a[3], box_b[1] + box_b[3]) - max(box_a[1], box_b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    return intersection / (box_a[2] * box_a[3] + box_b[2] * box_b[3] - intersection)
+
+
+def count_matches(found, expected, threshold=0.5):
+    """Count the detections that match an expected box.
+
+    Every expected box is matched to at most one detection, the pairs
+    with the largest overlap are matched first.
+
+    Args:
+        found (list): detected boxes
+        expected (list): expected boxes, e.g. of the baseline run
+        threshold (float): minimum intersection over union of a match
+
+    Returns:
+        int: number of matched detections
+    """
+    pairs = sorted(((iou(det, ann), i, j) for i, det in enumerate(found)
+                    for j, ann in enumerate(expected)), reverse=True)
+    used_found, used_expected = set(), set()
+    for overlap, i, j in pairs:
+        if overlap < threshold:
+            break
+        if i not in used_found and j not in used_expected:
+            used_found.add(i)
+            used_expected.add(j)
+    return len(used_found)
+
+
+def parse_grid(assignments):
+    """Collect the detector settings given on the command line, e.g. by --set.
+
+    Args:
+        assignments (list): strings "name=value", a name given several times
+            is benchmarked with each of its values. Values are python literals,
+            e.g. min_size=(60,20).
+
+    Returns:
+        dict: values for each setting
+    """
+    grid = {}
+    for assignment in assignments:
+        name, value = assignment.split('=', 1)
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            # plain strings like backend=lbp
+            pass
+        grid.setdefault(name, []).append(value)
+    return grid
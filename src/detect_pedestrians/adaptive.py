@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+""" Module for pedestrian detection, that adapts its resolution to a time budget per frame"""
+
+import time
+from src.detect_pedestrians.pedestrianrec import PedestrianDetector
+
+# settings of PedestrianDetector, from the most accurate and slowest to the fastest level
+LADDER = [
+    {'width': 480, 'win_stride': (4, 4), 'scale': 1.05},
+    {'width': 400, 'win_stride': (4, 4), 'scale': 1.05},
+    {'width': 400, 'win_stride': (8, 8), 'scale': 1.05},
+    {'width': 320, 'win_stride': (8, 8), 'scale': 1.1},
+    {'width': 256, 'win_stride': (8, 8), 'scale': 1.2},
+]
+
+
+class AdaptiveResolution():
+    """
+    Pedestrian detector, that picks the most accurate level of a ladder of settings,
+    whose detection still fits into the time budget of a frame.
+    The measured time of every frame is smoothed per level. The detector steps to a
+    faster level as soon as the current one is over budget, and back to a more accurate
+    one after it stayed well within the budget for a few frames. A level that is not used
+    is not measured, so the more accurate level is tried again every probe_interval calm
+    frames, else a single slow frame would keep its estimate too high for good.
+    """
+
+    def __init__(self, budget, ladder=None, smoothing=0.3, headroom=0.8,  # pylint: disable=R0913
+                 patience=5, probe_interval=50):
+        """
+        Builds a detector for every level.
+        Args:
+            budget: time budget per frame in seconds
+            ladder: list of PedestrianDetector settings, from the slowest to the fastest,
+            None uses LADDER
+            smoothing: weight of the newest timing in the moving average of a level
+            headroom: a more accurate level is only tried, if it is expected to need at
+            most this fraction of the budget
+            patience: number of frames the expectation has to hold before it is tried
+            probe_interval: number of frames well within the budget, after which the more
+            accurate level is measured again, even if its estimate is too high
+        """
+
+        self.budget = budget
+        self.ladder = LADDER if ladder is None else ladder
+        self.smoothing = smoothing
+        self.headroom = headroom
+        self.patience = patience
+        self.probe_interval = probe_interval
+        self.detectors = [PedestrianDetector(**settings) for settings in self.ladder]
+        # smoothed seconds per frame of every level, None until measured
+        self.estimates = [None] * len(self.ladder)
+        self.level = 0
+        self.calm_frames = 0
+        self.stale_frames = 0  # frames well within the budget since the last step
+        self.levels = []  # level every frame was detected with
+
+    def calibrate(self, frames):
+        """
+        Measures every level on sample frames and starts with the most accurate
+        level within the budget.
+        Args:
+            frames: sample frames of the video
+        """
+
+        for level, detector in enumerate(self.detectors):
+            start = time.perf_counter()
+            for frame in frames:
+                detector.detect(frame)
+            self.estimates[level] = (time.perf_counter() - start) / len(frames)
+        within = [level for level, seconds in enumerate(self.estimates) if seconds <= self.budget]
+        self.level = within[0] if within else len(self.ladder) - 1
+        self.calm_frames = self.stale_frames = 0
+
+    def detect(self, image, regions=None, context=None):
+        """
+        Detects pedestrians at the current level, see PedestrianDetector.detect, and
+        adapts the level to the measured time.
+        """
+
+        self.levels.append(self.level)
+        start = time.perf_counter()
+        boxes = self.detectors[self.level].detect(image, regions, context)
+        self.observe(time.perf_counter() - start)
+        return boxes
+
+    def observe(self, seconds):
+        """
+        Updates the estimate of the current level with the time of a frame and picks
+        the level of the next frame.
+        Args:
+            seconds: time the detection of the frame took
+        """
+
+        level = self.level
+        estimate = self.estimates[level]
+        estimate = seconds if estimate is None else \
+            self.smoothing * seconds + (1 - self.smoothing) * estimate
+        self.estimates[level] = estimate
+
+        if estimate > self.budget:
+            self.calm_frames = self.stale_frames = 0
+            self.level = min(level + 1, len(self.ladder) - 1)
+            return
+        if level == 0:
+            return
+        # without a measurement the more accurate level is expected to cost the same,
+        # so the headroom decides
+        expected = self.estimates[level - 1] or estimate
+        self.calm_frames = self.calm_frames + 1 if expected <= self.headroom * self.budget else 0
+        self.stale_frames = self.stale_frames + 1 if estimate <= self.headroom * self.budget \
+            else 0
+        if self.stale_frames >= self.probe_interval:
+            # the estimate dates from before the last step, the next frame measures it again
+            self.estimates[level - 1] = None
+        elif self.calm_frames < self.patience:
+            return
+        self.calm_frames = self.stale_frames = 0
+        self.level = level - 1
+
+    def settings(self):
+        """Returns the settings of the current level"""
+
+        return self.ladder[self.level]
+
+    def close(self):
+        """Stops the processes of the detectors"""
+
+        for detector in self.detectors:
+            detector.close()
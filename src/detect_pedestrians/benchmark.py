@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""
+Compares the keyframe pedestrian detection with optical flow against detecting every frame.
+
+Run with: python -m src.detect_pedestrians.benchmark [--interval 5] [--max-lost 0]
+"""
+
+import argparse
+from functools import partial
+import os
+from pathlib import Path
+import time
+import cv2
+import numpy as np
+from src.detect_pedestrians.pedestrianrec import PedestrianDetector
+from src.benchmark_utils import count_matches, iou
+from src.stabilisierung.flow import BoxFlow, FlowKeyframes
+
+PATH_VIDEO = Path(__file__).parent.parent / 'gui' / 'Tests' / 'test2' / 'test.mp4'
+PATH_IMAGES = Path(__file__).parent / 'test_imgs'
+
+
+def read_video(path=PATH_VIDEO):
+    """
+    Reads all frames of a video.
+    Args:
+        path: path of the video
+    Returns:
+        list of the frames
+    """
+
+    capture = cv2.VideoCapture(str(path))
+    frames = []
+    success, frame = capture.read()
+    while success:
+        frames.append(frame)
+        success, frame = capture.read()
+    capture.release()
+    return frames
+
+
+def pan(image, length=20, step=(3, 1), margin=60):
+    """
+    Makes a sequence from a still image, by moving a crop window over it like a
+    slowly panning camera.
+    Args:
+        image: still image
+        length: number of frames
+        step: pixels (x, y) the window moves per frame
+        margin: pixels the window is smaller than the image on every axis
+    Returns:
+        list of the frames
+    """
+
+    height, width = image.shape[:2]
+    frames = []
+    for index in range(length):
+        x_up = min(index * step[0], margin)
+        y_up = min(index * step[1], margin)
+        frames.append(image[y_up:y_up + height - margin, x_up:x_up + width - margin].copy())
+    return frames
+
+
+def sequences():
+    """
+    Returns the bundled test sequences: the gui test video and a panned sequence of
+    every pedestrian test image.
+    """
+
+    result = {'test.mp4': read_video()}
+    for name in sorted(os.listdir(PATH_IMAGES)):
+        if name.endswith('.bmp'):
+            result[name] = pan(cv2.imread(str(PATH_IMAGES / name)))
+    return result
+
+
+def to_xywh(boxes):
+    """Converts boxes [x_up, y_up, x_down, y_down] to [x, y, width, height]"""
+
+    return [[box[0], box[1], box[2] - box[0], box[3] - box[1]] for box in boxes]
+
+
+def compare(frames, detector, interval=5, max_lost=0, flow=None):
+    """
+    Runs the detection on every frame and in keyframe mode and compares the boxes.
+    Args:
+        frames: frames of one sequence
+        detector: PedestrianDetector
+        interval, max_lost, flow: settings of FlowKeyframes
+    Returns:
+        dict with the time per frame of both modes, the number of detections in keyframe
+        mode, and the precision, recall and mean intersection over union of the keyframe
+        boxes, taking the boxes detected on every frame as ground truth
+    """
+
+    start = time.perf_counter()
+    full = [to_xywh(detector.detect(frame)) for frame in frames]
+    full_time = (time.perf_counter() - start) / len(frames)
+
+    keyframes = FlowKeyframes(interval, max_lost, flow)
+    start = time.perf_counter()
+    keyed = [to_xywh(keyframes.update(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY),
+                                      partial(detector.detect, frame))) for frame in frames]
+    keyed_time = (time.perf_counter() - start) / len(frames)
+
+    matches = sum(count_matches(found, expected) for found, expected in zip(keyed, full))
+    found_count = sum(len(found) for found in keyed)
+    expected_count = sum(len(expected) for expected in full)
+    overlaps = [max((iou(box, other) for other in found), default=0.0)
+                for found, expected in zip(keyed, full) for box in expected]
+    return {'full_ms': full_time * 1000, 'keyframe_ms': keyed_time * 1000,
+            'detections': keyframes.detections, 'frames': len(frames),
+            'precision': matches / found_count if found_count else 1.0,
+            'recall': matches / expected_count if expected_count else 1.0,
+            'mean_iou': float(np.mean(overlaps)) if overlaps else 1.0}
+
+
+def main():
+    """Prints the comparison for every bundled sequence"""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--interval', type=int, default=5, help='frames per keyframe')
+    parser.add_argument('--max-lost', type=int, default=0,
+                        help='boxes the flow may lose before the frame is detected')
+    parser.add_argument('--max-error', type=float, default=1.0,
+                        help='forward-backward error of a reliable flow point in pixels')
+    args = parser.parse_args()
+    detector = PedestrianDetector()
+    flow = BoxFlow(max_error=args.max_error)
+    print(f'{"sequence":15} {"full ms":>8} {"key ms":>8} {"detected":>9} {"precision":>9} '
+          f'{"recall":>7} {"IoU":>5}')
+    for name, frames in sequences().items():
+        result = compare(frames, detector, args.interval, args.max_lost, flow)
+        print(f'{name:15} {result["full_ms"]:8.1f} {result["keyframe_ms"]:8.1f} '
+              f'{result["detections"]:4d}/{result["frames"]:<4d} {result["precision"]:9.2f} '
+              f'{result["recall"]:7.2f} {result["mean_iou"]:5.2f}')
+
+
+if __name__ == '__main__':
+    main()
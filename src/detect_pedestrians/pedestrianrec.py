@@ -2,8 +2,11 @@
 
 """ Module for extraction of boundary boxes for pedestrians from an image"""
 
-from collections import namedtuple
+from functools import lru_cache
+import multiprocessing
 import cv2
+import numpy as np
+from src.preprocessing.frame_context import FrameContext
 
 
 def overlap_between(test_box, bigger_box):
@@ -35,12 +38,74 @@ def overlap_between(test_box, bigger_box):
     return overlap_ratio
 
 
-def non_maximum_suppression(boxes):
+def overlaps_with(corners, box, criterion='overlap'):
+    """
+    Calculates the overlaps of many boxes with one box in one pass.
+    Args:
+        corners: numpy array (n, 4) with the top left and bottom right corners of n boxes
+        box: top left and bottom right corners of the box they are compared with
+        criterion: 'overlap' divides the overlapping area by the area of each of the n
+        boxes, like overlap_between(corners[i], box); 'iou' divides it by the area of
+        the union of both boxes
+    Returns:
+        numpy array (n) of the overlaps
+    """
+
+    x_overlap = np.minimum(corners[:, 2], box[2]) - np.maximum(corners[:, 0], box[0])
+    y_overlap = np.minimum(corners[:, 3], box[3]) - np.maximum(corners[:, 1], box[1])
+    overlap_area = np.maximum(0, x_overlap) * np.maximum(0, y_overlap)
+    areas = (corners[:, 2] - corners[:, 0]) * (corners[:, 3] - corners[:, 1])
+    if criterion == 'overlap':
+        return overlap_area / areas
+    if criterion == 'iou':
+        box_area = (box[2] - box[0]) * (box[3] - box[1])
+        return overlap_area / (areas + box_area - overlap_area)
+    raise ValueError(f'Unknown criterion {criterion}, choose overlap or iou')
+
+
+def suppression_indices(corners, weights=None, overlap_threshold=0.5, criterion='overlap'):
+    """
+    Returns the indices of the boxes that are kept by the non maximum suppression.
+    Args:
+        corners: numpy array (n, 4) with the top left and bottom right corners of n boxes
+        weights: confidences of the boxes, e.g. the weights returned by
+        HOGDescriptor.detectMultiScale. None ranks the boxes by their width.
+        overlap_threshold: boxes overlapping a higher ranked box by more than it are
+        discarded
+        criterion: 'overlap' or 'iou', see overlaps_with
+    Returns:
+        list of the indices of the kept boxes, the highest ranked first
+    Notes:
+        Only the overlaps with the kept boxes are calculated, each against all
+        remaining boxes at once, which is far less than the full overlap matrix
+        for thousands of clustered candidates.
+    """
+
+    corners = np.asarray(corners, dtype=float).reshape(-1, 4)
+    ranking = -(corners[:, 2] - corners[:, 0]) if weights is None \
+        else -np.asarray(weights, dtype=float).ravel()
+    # stable, so boxes of the same rank keep their order, like sorted does
+    order = np.argsort(ranking, kind='stable')
+    corners = corners[order]
+    keep = []
+    while len(order) > 0:
+        keep.append(int(order[0]))
+        # the remaining boxes are kept if they are not overlapped too much by the kept one
+        remaining = overlaps_with(corners[1:], corners[0], criterion) <= overlap_threshold
+        order, corners = order[1:][remaining], corners[1:][remaining]
+    return keep
+
+
+def non_maximum_suppression(boxes, weights=None, overlap_threshold=0.5, criterion='overlap'):
     """
     Returns new list without redundant boxes.
     Args:
         boxes: List of boundary_box namedtuples, containing pixel coordinates of
         top left and bottom right corners
+        weights: confidences of the boxes, which rank them instead of their width
+        overlap_threshold: boxes overlapping a higher ranked box by more than it are
+        discarded
+        criterion: 'overlap' (see overlap_between) or 'iou'
     Notes:
         In order for a box to be discarded, it must, at the presently chosen threshold,
         be at least 50% overlapping with another; a threshold that is too high will
@@ -48,54 +113,208 @@ def non_maximum_suppression(boxes):
         boxes for pedestrians close to each other to be removed.
     """
 
-    boxes = sorted(boxes, key=lambda box: box[2]-box[0], reverse=True)
-    nms_boxes = []
-    overlap_threshold = 0.5
-
-    for box in boxes:
-        if not any([overlap_between(box, nms_box) > overlap_threshold for nms_box in nms_boxes]):
-            nms_boxes.append(box)
-
-    return nms_boxes
+    if len(boxes) == 0:
+        return []
+    return [boxes[index] for index in suppression_indices(
+        [tuple(box) for box in boxes], weights, overlap_threshold, criterion)]
 
 
-def generate_pedestrian_boxes(image):
+def detect_in_regions(hog, image, regions):
     """
-    Detects pedestrians and returns list of boundary_boxes for them. Applies
-    non_maximum_suppression to decrease redundancy/false detection.
+    Runs the HOG detection only inside of the given regions of an image.
     Args:
-        image: image file loaded with cv2.imread()
+        hog: HOGDescriptor with the people detector set
+        image: image in which the regions lie
+        regions: list of regions [x, y, width, height] in image coordinates
     Notes:
-        If the image is wider than 400 pixels, it is resized to reduce run-time.
-        Manipulating winStride and scale affects run time and detection accuracy.
+        Regions smaller than the detection window (64x128) are enlarged around their
+        center, since the detector could not find a pedestrian in them otherwise.
+        The returned boxes [x, y, width, height] are in image coordinates, the weights
+        are the confidences of the boxes.
     """
 
-    hog = cv2.HOGDescriptor()
-    hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
-
-    min_width = 400
-    new_width = min(min_width, image.shape[1])
-    scale_factor = min_width/image.shape[1]
-    new_height = round(image.shape[0] * scale_factor)
-
-    image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
-
-    (boxes, _) = hog.detectMultiScale(image, winStride=(4, 4), padding=(8, 8),
-                                      scale=1.05)
-
-    if len(boxes) > 0:
-        for row in boxes:
-            row[2] = row[0] + row[2]
-            row[3] = row[1] + row[3]
-
-        Box = namedtuple('Box', 'x_tl y_tl x_br y_br')
-        boxes = [Box._make(row) for row in boxes]
-
-        boxes = non_maximum_suppression(boxes)
+    win_width, win_height = hog.winSize
+    height, width = image.shape[:2]
+    boxes, weights = [], []
+    for (x_up, y_up, wide, high) in regions:
+        x_up -= max(0, win_width - wide) // 2
+        y_up -= max(0, win_height - high) // 2
+        wide, high = max(wide, win_width), max(high, win_height)
+        x_down = min(width, max(0, x_up) + wide)
+        y_down = min(height, max(0, y_up) + high)
+        x_up, y_up = max(0, x_down - wide), max(0, y_down - high)
+        if x_down - x_up < win_width or y_down - y_up < win_height:
+            continue
+        (found, found_weights) = hog.detectMultiScale(image[y_up:y_down, x_up:x_down],
+                                                      winStride=(4, 4), padding=(8, 8),
+                                                      scale=1.05)
+        for (x_box, y_box, w_box, h_box) in found:
+            boxes.append([x_box + x_up, y_box + y_up, w_box, h_box])
+        weights.extend(np.ravel(found_weights))
+    return boxes, weights
+
+
+class PedestrianDetector():  # pylint: disable=R0902
+    """
+    HOG pedestrian detector, whose descriptor and people SVM are loaded once.
+    Frames can be spread over a pool of processes with detect_many, every process
+    builds its own descriptor once when it starts.
+    """
 
-        boxes = [[int(round(element/scale_factor)) for element in row] for row in boxes]
+    def __init__(self, width=400, win_stride=(4, 4), padding=(8, 8),  # pylint: disable=R0913
+                 scale=1.05, processes=1, nms_rank='width', nms_criterion='overlap',
+                 nms_threshold=0.5):
+        """
+        Loads the descriptor and stores the detection settings.
+        Args:
+            width: images wider than width are resized to it before the detection
+            win_stride, padding, scale: settings of HOGDescriptor.detectMultiScale,
+            they affect run time and detection accuracy
+            processes: number of processes detect_many spreads the frames over,
+            1 detects in the calling process
+            nms_rank: 'width' keeps the widest of overlapping boxes, 'weight' the most
+            confident one
+            nms_criterion, nms_threshold: see non_maximum_suppression
+        """
+
+        self.width = width
+        self.win_stride = win_stride
+        self.padding = padding
+        self.scale = scale
+        self.processes = processes
+        self.nms_rank = nms_rank
+        self.nms_criterion = nms_criterion
+        self.nms_threshold = nms_threshold
+        self.hog = cv2.HOGDescriptor()
+        self.hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+        # started with the first detect_many, the descriptor can not be pickled
+        self.pool = None
+
+    def settings(self):
+        """Returns the keyword arguments that build an equal detector in one process"""
+
+        return {'width': self.width, 'win_stride': self.win_stride, 'padding': self.padding,
+                'scale': self.scale, 'nms_rank': self.nms_rank,
+                'nms_criterion': self.nms_criterion, 'nms_threshold': self.nms_threshold}
+
+    def detect(self, image, regions=None, context=None):
+        """
+        Detects pedestrians and returns list of boundary_boxes for them. Applies
+        non_maximum_suppression to decrease redundancy/false detection.
+        Args:
+            image: image file loaded with cv2.imread()
+            regions: list of regions [x, y, width, height] in image coordinates, to which
+            the detection is limited (e.g. dirty regions of a MotionGate). None scans the
+            whole image.
+            context: FrameContext of the image, whose downscaled level is shared with other
+            stages. None creates a new one.
+        Notes:
+            If the image is wider than width, it is resized to reduce run-time.
+        """
+
+        new_width = min(self.width, image.shape[1])
+        scale_factor = self.width/image.shape[1]
+        new_height = round(image.shape[0] * scale_factor)
+        resize_factor = new_width/image.shape[1]
+
+        if context is None:
+            context = FrameContext(image)
+        image = context.resized(new_width, new_height)
+
+        if regions is None:
+            (boxes, weights) = self.hog.detectMultiScale(image, winStride=self.win_stride,
+                                                         padding=self.padding, scale=self.scale)
+        else:
+            regions = [[int(element * resize_factor) for element in region]
+                       for region in regions]
+            (boxes, weights) = detect_in_regions(self.hog, image, regions)
+
+        if len(boxes) > 0:
+            # top left and bottom right corners
+            corners = np.array(boxes, dtype=int).reshape(-1, 4)
+            corners[:, 2:] += corners[:, :2]
+            keep = suppression_indices(corners, weights if self.nms_rank == 'weight' else None,
+                                       self.nms_threshold, self.nms_criterion)
+            boxes = [[int(round(element/scale_factor)) for element in corners[index]]
+                     for index in keep]
+
+        return boxes
+
+    def detect_many(self, frames, regions=None):
+        """
+        Detects pedestrians on several frames, spread over the process pool.
+        Args:
+            frames: list or generator of images
+            regions: list with the regions of each frame (see detect), None scans the
+            whole frames
+        Returns:
+            list of the boundary boxes of each frame, in the order of the frames
+        Notes:
+            The frames are copied to the processes, so they can be drawn on right
+            after detect_many returned. The processes are spawned, not forked, as
+            the pool is started while the pipeline already runs threads (e.g. the
+            OCR worker and TensorFlow), whose locks a fork could copy held.
+        """
+
+        frames = list(frames)
+        if regions is None:
+            regions = [None] * len(frames)
+        if self.processes <= 1:
+            return [self.detect(frame, region) for frame, region in zip(frames, regions)]
+        if self.pool is None:
+            # lives till close, so it can not be opened in a with block
+            self.pool = multiprocessing.get_context('spawn').Pool(  # pylint: disable=R1732
+                self.processes, initializer=_init_worker, initargs=(self.settings(),))
+        # map keeps the order of the frames, whichever process finishes first
+        return self.pool.starmap(_detect_in_worker, zip(frames, regions),
+                                 chunksize=max(1, len(frames) // (4 * self.processes)))
+
+    def close(self):
+        """Stops the processes used by detect_many"""
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+# detector of a pool process, built once by _init_worker
+_WORKER_DETECTOR = None
+
+
+def _init_worker(settings):
+    """Builds the detector of a pool process"""
+
+    global _WORKER_DETECTOR  # pylint: disable=W0603
+    # the processes already use every core, OpenCV should not start threads on top
+    cv2.setNumThreads(1)
+    _WORKER_DETECTOR = PedestrianDetector(**settings)
+
+
+def _detect_in_worker(frame, regions):
+    """Detects pedestrians with the detector of a pool process"""
+
+    return _WORKER_DETECTOR.detect(frame, regions)
+
+
+@lru_cache(maxsize=1)
+def default_pedestrian_detector():
+    """Returns the shared detector with the default settings"""
+
+    return PedestrianDetector()
+
+
+def generate_pedestrian_boxes(image, regions=None, context=None):
+    """
+    Detects pedestrians with the shared default detector, see PedestrianDetector.detect.
+    Args:
+        image: image file loaded with cv2.imread()
+        regions: list of regions [x, y, width, height] in image coordinates, to which
+        the detection is limited. None scans the whole image.
+        context: FrameContext of the image. None creates a new one.
+    """
 
-    return boxes
+    return default_pedestrian_detector().detect(image, regions, context)
 
 
 def show_boxes(img, boundary_boxes, gt_boxes=None):
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+"""
+Sweeps the pedestrian detector settings against the ground truth of test_imgs and reports
+the Pareto-optimal ones in speed, precision and recall.
+
+Run with: python -m src.detect_pedestrians.sweep [--out sweep.json]
+or sweep chosen settings, e.g.:
+python -m src.detect_pedestrians.sweep --set width=320 --set width=400 --set "win_stride=(8, 8)"
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import time
+import cv2
+import numpy as np
+from src.benchmark_utils import parse_grid
+from src.detect_pedestrians.pedestrianrec import PedestrianDetector, overlaps_with
+
+PATH_IMAGES = Path(__file__).parent / 'test_imgs'
+# settings swept by default, every combination is evaluated
+SWEEP_GRID = {
+    'width': [320, 400, 480],
+    'win_stride': [(4, 4), (8, 8)],
+    'padding': [(8, 8), (16, 16)],
+    'scale': [1.05, 1.1, 1.2],
+    'nms_threshold': [0.3, 0.5, 0.7],
+}
+
+
+def load_ground_truth(path=PATH_IMAGES):
+    """
+    Loads the test images with their ground truth boxes.
+    Args:
+        path: folder with the images and a csv file of the same name for each
+    Returns:
+        list of (image, boxes [x_up, y_up, x_down, y_down])
+    """
+
+    samples = []
+    for name in sorted(os.listdir(path)):
+        if not name.endswith('.bmp'):
+            continue
+        with open(str(path / name[:-4]) + '.csv', newline='', encoding='utf-8') as file:
+            boxes = [[int(element) for element in row] for row in csv.reader(file, delimiter=';')]
+        samples.append((cv2.imread(str(path / name)), boxes))
+    return samples
+
+
+def count_true_positives(found, expected, criterion='overlap', threshold=0.7):
+    """
+    Counts the detections that match a ground truth box, every ground truth box is matched
+    to at most one detection, the best matches first.
+    Args:
+        found: detected boxes [x_up, y_up, x_down, y_down]
+        expected: ground truth boxes [x_up, y_up, x_down, y_down]
+        criterion: 'overlap' counts the part of the ground truth box covered by the
+        detection, like test_boundary_boxes; 'iou' the intersection over union
+        threshold: minimum criterion of a match
+    Returns:
+        number of true positives
+    """
+
+    if len(found) == 0 or len(expected) == 0:
+        return 0
+    expected = np.array(expected, dtype=float)
+    scores = np.array([overlaps_with(expected, box, criterion) for box in found])
+    matched = 0
+    while scores.max() > threshold:
+        row, col = divmod(int(scores.argmax()), scores.shape[1])
+        scores[row, :] = 0
+        scores[:, col] = 0
+        matched += 1
+    return matched
+
+
+def evaluate(settings, samples, criterion='overlap', threshold=0.7):
+    """
+    Measures the speed and accuracy of one setting of the detector.
+    Args:
+        settings: keyword arguments of PedestrianDetector
+        samples: list of (image, boxes) as returned by load_ground_truth
+        criterion, threshold: matching rule, see count_true_positives
+    Returns:
+        dict with the settings, milliseconds per image, precision and recall
+    """
+
+    detector = PedestrianDetector(**settings)
+    true_positives = detections = pedestrians = 0
+    start = time.perf_counter()
+    found = [detector.detect(image) for image, _ in samples]
+    seconds = time.perf_counter() - start
+    for boxes, (_, expected) in zip(found, samples):
+        true_positives += count_true_positives(boxes, expected, criterion, threshold)
+        detections += len(boxes)
+        pedestrians += len(expected)
+    return {'settings': settings, 'ms_per_image': seconds * 1000 / len(samples),
+            'precision': true_positives / detections if detections else 1.0,
+            'recall': true_positives / pedestrians if pedestrians else 1.0}
+
+
+# samples and matching rule of a sweep process, set by _init_sweep
+_SWEEP = {}
+
+
+def _init_sweep(samples, criterion, threshold):
+    """Keeps the samples in a sweep process, so they are copied only once per process"""
+
+    # one process per core, OpenCV should not start threads on top
+    cv2.setNumThreads(1)
+    _SWEEP.update(samples=samples, criterion=criterion, threshold=threshold)
+
+
+def _evaluate_in_worker(settings):
+    """Evaluates one setting with the samples of the sweep process"""
+
+    return evaluate(settings, _SWEEP['samples'], _SWEEP['criterion'], _SWEEP['threshold'])
+
+
+def sweep(grid, samples, processes=None, criterion='overlap', threshold=0.7):
+    """
+    Evaluates every combination of the settings, spread over a pool of processes.
+    Args:
+        grid: values to try for each PedestrianDetector setting
+        samples: list of (image, boxes) as returned by load_ground_truth
+        processes: number of processes, None uses every core
+        criterion, threshold: matching rule, see count_true_positives
+    Returns:
+        list of the results of evaluate, in the order of the combinations
+    Notes:
+        Every process times its own settings, so the timings are comparable as long as
+        there are no more processes than cores.
+    """
+
+    names = sorted(grid)
+    combinations = [dict(zip(names, values))
+                    for values in itertools.product(*(grid[name] for name in names))]
+    with multiprocessing.Pool(processes, initializer=_init_sweep,
+                              initargs=(samples, criterion, threshold)) as pool:
+        return pool.map(_evaluate_in_worker, combinations, chunksize=1)
+
+
+def pareto(results):
+    """
+    Returns the results that no other result beats in speed, precision and recall at once.
+    Args:
+        results: list of results of evaluate
+    Returns:
+        list of the Pareto-optimal results, the fastest first
+    """
+
+    def scores(result):
+        return (-result['ms_per_image'], result['precision'], result['recall'])
+
+    def dominates(first, second):
+        return scores(first) != scores(second) and \
+            all(one >= other for one, other in zip(scores(first), scores(second)))
+
+    optimal = [result for result in results
+               if not any(dominates(other, result) for other in results)]
+    return sorted(optimal, key=lambda result: result['ms_per_image'])
+
+
+def print_results(results):
+    """Prints results of evaluate as table"""
+
+    print(f'{"ms/image":>9} {"precision":>9} {"recall":>7}  settings')
+    for result in results:
+        print(f'{result["ms_per_image"]:9.1f} {result["precision"]:9.2f} '
+              f'{result["recall"]:7.2f}  {result["settings"]}')
+
+
+def main():
+    """Prints the Pareto-optimal settings of the sweep and saves every result"""
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='setting to sweep, can be given several times; '
+                             'without any the default grid is swept')
+    parser.add_argument('--processes', type=int, help='number of processes, default every core')
+    parser.add_argument('--criterion', choices=['overlap', 'iou'], default='overlap',
+                        help='matching rule of detections and ground truth')
+    parser.add_argument('--threshold', type=float, default=0.7, help='minimum match')
+    parser.add_argument('--out', help='json file every result and the Pareto front is saved to')
+    args = parser.parse_args()
+    results = sweep(parse_grid(args.set) or SWEEP_GRID, load_ground_truth(),
+                    args.processes, args.criterion, args.threshold)
+    optimal = pareto(results)
+    print_results(optimal)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as file:
+            json.dump({'criterion': args.criterion, 'threshold': args.threshold,
+                       'results': results, 'pareto': optimal}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
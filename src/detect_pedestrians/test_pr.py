@@ -8,8 +8,11 @@ import csv
 from pathlib import Path
 import pytest
 import cv2
+from src.detect_pedestrians.adaptive import AdaptiveResolution, LADDER
+from src.detect_pedestrians.sweep import count_true_positives, evaluate, load_ground_truth, \
+    pareto, sweep
 from src.detect_pedestrians.pedestrianrec import (overlap_between, non_maximum_suppression,
-                                                  generate_pedestrian_boxes)
+                                                  generate_pedestrian_boxes, PedestrianDetector)
 
 Box = namedtuple('Box', 'x_tl y_tl x_br y_br')
 test_boxes = [Box(0, 0, 40, 40), Box(36, 0, 41, 40), Box(39, 0, 44, 40),
@@ -70,6 +73,21 @@ def test_nms(boxes):
     assert sorted(boxes_after_nms) == sorted(boxes.after_nms)
 
 
+def test_nms_options():
+    """
+    Tests ranking the boxes by their weights and suppressing them by intersection over
+    union instead of by the overlap with the smaller box.
+    """
+    boxes = [test_boxes[0], test_boxes[1]]
+    # the narrow box is ranked first and only covers a tenth of the wide one
+    assert non_maximum_suppression(boxes, weights=[0.2, 0.9]) == boxes[::-1]
+    assert non_maximum_suppression(boxes, criterion='iou') == boxes
+    assert non_maximum_suppression(boxes, overlap_threshold=0.9) == boxes
+    assert non_maximum_suppression([]) == []
+    with pytest.raises(ValueError):
+        non_maximum_suppression(boxes, criterion='area')
+
+
 parameter_array = []
 DetectionTest = namedtuple('DetectionTest', 'gt_box detected_boxes')
 for index, row in enumerate(ground_truth_boxes):
@@ -114,3 +132,99 @@ def test_empty_img():
     the image and the relevant ground truth csv file are at the end of the list.
     """
     assert detected_boxes[-1] == ground_truth_boxes[-1]
+
+
+def test_regions():
+    """
+    Tests that detecting inside of a region around every ground truth box still finds the
+    pedestrians, and that an empty list of regions finds nothing.
+    """
+    image, ground_truth = img_list[0], ground_truth_boxes[0]
+    regions = [[box.x_tl - 20, box.y_tl - 20, box.x_br - box.x_tl + 40, box.y_br - box.y_tl + 40]
+               for box in ground_truth]
+    boxes = [Box._make(box) for box in generate_pedestrian_boxes(image, regions)]
+    for truth in ground_truth:
+        assert any(overlap_between(truth, box) > 0.7 for box in boxes)
+    assert generate_pedestrian_boxes(image, []) == []
+
+
+def test_detect_many():
+    """
+    Tests that spreading the frames over two processes returns the same boxes as
+    the single detections, in the order of the frames.
+    """
+    detector = PedestrianDetector(processes=2)
+    frames = img_list[:3] + img_list[-1:]
+    expected = [generate_pedestrian_boxes(img) for img in frames]
+    try:
+        assert detector.detect_many(frames) == expected
+        assert detector.detect_many(reversed(frames)) == expected[::-1]
+    finally:
+        detector.close()
+    assert PedestrianDetector().detect_many(frames) == expected
+
+
+def test_adaptive_resolution():
+    """
+    Tests that the adaptive detector steps to a faster level when a frame is over budget,
+    back to the accurate level once it stays well within it, also after a single slow
+    frame, and records the level of every frame. After a calibration it starts with the
+    most accurate level in budget.
+    """
+    adaptive = AdaptiveResolution(0.1, ladder=LADDER[1:3], patience=2)
+    assert adaptive.detect(img_list[0]) == generate_pedestrian_boxes(img_list[0])
+    adaptive.level = 0
+    adaptive.observe(0.2)
+    assert adaptive.level == 1
+    adaptive.estimates[0] = 0.07
+    adaptive.observe(0.03)
+    assert adaptive.level == 1
+    adaptive.observe(0.03)
+    assert adaptive.level == 0
+    adaptive.detect(img_list[0])
+    assert adaptive.levels[0] == 0 and adaptive.levels[-1] == 0
+    assert adaptive.settings() == LADDER[1 + adaptive.level]
+
+    # a single slow frame does not keep the faster level for good
+    adaptive = AdaptiveResolution(0.1, ladder=LADDER[1:3], patience=2, probe_interval=10)
+    adaptive.observe(0.2)
+    assert adaptive.level == 1
+    for _ in range(10):
+        adaptive.observe(0.03)
+    assert adaptive.level == 0
+    for _ in range(20):
+        adaptive.observe(0.03)
+    assert adaptive.level == 0
+    # a probe of a level that really is too slow steps back right away
+    adaptive.level = 1
+    adaptive.estimates[0] = 0.2
+    for _ in range(10):
+        adaptive.observe(0.03)
+    adaptive.observe(0.2)
+    assert adaptive.level == 1
+
+    adaptive = AdaptiveResolution(1e-6, ladder=LADDER[1:3])
+    adaptive.calibrate(img_list[:1])
+    assert adaptive.level == 1
+    adaptive = AdaptiveResolution(100, ladder=LADDER[1:3])
+    adaptive.calibrate(img_list[:1])
+    assert adaptive.level == 0
+
+
+def test_sweep():
+    """
+    Tests that the sweep evaluates every combination against the ground truth, in their
+    order, and that the Pareto front only drops settings beaten in every respect.
+    """
+    assert count_true_positives([[0, 0, 10, 10], [0, 0, 12, 12]], [[1, 1, 10, 10]]) == 1
+    assert count_true_positives([], [[1, 1, 10, 10]]) == 0
+    samples = load_ground_truth()
+    assert [len(boxes) for _, boxes in samples] == [1, 2, 2, 3, 2, 0]
+    results = sweep({'width': [256, 400], 'win_stride': [(8, 8)]}, samples[:2], processes=2)
+    assert [result['settings']['width'] for result in results] == [256, 400]
+    assert results[1] == {**evaluate(results[1]['settings'], samples[:2]),
+                          'ms_per_image': results[1]['ms_per_image']}
+    slow = {'ms_per_image': 2, 'precision': 0.5, 'recall': 0.5}
+    fast = {'ms_per_image': 1, 'precision': 0.5, 'recall': 0.5}
+    accurate = {'ms_per_image': 3, 'precision': 1, 'recall': 0.5}
+    assert pareto([slow, accurate, fast]) == [fast, accurate]
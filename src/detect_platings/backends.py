@@ -0,0 +1,65 @@
+'''Registry of the detector backends for license plates
+
+A backend is a function that returns a new classifier with the
+interface of cv2.CascadeClassifier.detectMultiScale. The backends are
+selected by name, e.g. PlateDetector(backend='haar').
+'''
+from pathlib import Path
+import cv2
+
+
+BACKENDS = {}
+DEFAULT_BACKEND = 'haar'
+
+
+def register_backend(name, factory):
+    '''Register a detector backend.
+
+    Args:
+        name (str): name under which the backend is selected
+        factory (function): returns a new classifier, raises IOError if
+            the backend is not available
+    '''
+    BACKENDS[name] = factory
+
+
+def register_cascade(name, cascade_path):
+    '''Register a cascade xml file (Haar or LBP features) as backend.
+
+    Args:
+        name (str): name under which the backend is selected
+        cascade_path (path object): Path to the cascade xml file
+    '''
+    def load():
+        classifier = cv2.CascadeClassifier(str(cascade_path))
+        if classifier.empty():
+            raise IOError(f'Cascade {cascade_path} could not be loaded')
+        return classifier
+    register_backend(name, load)
+
+
+def load_backend(name=DEFAULT_BACKEND):
+    '''Create a classifier of a registered backend.
+
+    Args:
+        name (str): name of the backend
+
+    Returns:
+        classifier with a detectMultiScale method
+
+    Raises:
+        KeyError: If no backend is registered under the name
+        IOError: If the backend could not be loaded
+    '''
+    if name not in BACKENDS:
+        raise KeyError(f'Unknown backend {name}, choose from {sorted(BACKENDS)}')
+    return BACKENDS[name]()
+
+
+PATH_LBP = Path(__file__).parent / 'lbpcascade.xml'
+
+register_cascade('haar', Path(__file__).parent / 'haarcascade.xml')
+# trained by train_lbp.py, LBP features are several times faster to evaluate on a CPU.
+# No trained cascade is shipped, so the backend only exists once it has been trained.
+if PATH_LBP.is_file():
+    register_cascade('lbp', PATH_LBP)
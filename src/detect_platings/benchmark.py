@@ -0,0 +1,337 @@
+'''Benchmarks for the license plate detector
+
+Run with: python -m src.detect_platings.benchmark [--backends]
+
+or the benchmark suite, e.g.:
+python -m src.detect_platings.benchmark --suite --set scale_factor=1.05 --set scale_factor=1.1
+    --out run.json --compare baseline.json
+'''
+import argparse
+from datetime import datetime
+import itertools
+import json
+import os
+from pathlib import Path
+import platform
+import sys
+import time
+import cv2
+import numpy as np
+from src.benchmark_utils import count_matches, parse_grid
+from src.detect_platings.backends import BACKENDS, load_backend
+from src.detect_platings.detect_platings import PlateDetector, read_image
+
+
+PATH_IMAGES = Path(__file__).parent / 'Test Bilder'
+# boxes [x, y, width, height] a baseline run of the default detector found on
+# the test images, they are no independent annotation of the plates
+PATH_BASELINE = Path(__file__).parent / 'baseline_boxes.json'
+# number of plates on each test image, the images 11 and 12 show no cars
+EXPECTED_PLATES = [1] * 10 + [0, 0, 2]
+
+
+def expected_plates(name):
+    '''Number of plates on a test image, the images are numbered from 1'''
+    return EXPECTED_PLATES[int(os.path.splitext(name)[0]) - 1]
+
+
+def count_plates(found, expected):
+    '''Score the number of detections of every frame against the counted plates.
+
+    Args:
+        found (list): number of detections on each frame
+        expected (list): number of plates on each frame
+
+    Returns:
+        tuple: recall (found plates of the expected plates, counted per frame)
+            and the number of detections on frames without plates
+    '''
+    recall = sum(min(fnd, exp) for fnd, exp in zip(found, expected)) / sum(expected) \
+        if sum(expected) else 1.0
+    return recall, sum(fnd for fnd, exp in zip(found, expected) if exp == 0)
+
+
+def load_images(path=PATH_IMAGES):
+    '''Load all test images of a folder.
+
+    Args:
+        path (path object): Folder containing the images
+
+    Returns:
+        list: images sorted by their file name
+    '''
+    folder = sorted(os.listdir(path), key=lambda x: int(os.path.splitext(x)[0]))
+    return [cv2.imread(str(path / filename)) for filename in folder]
+
+
+def legacy_detect(img):
+    '''Detect plates the way detect_image did before PlateDetector existed.
+
+    The cascade gets parsed from the xml file for every single frame.
+
+    Args:
+        img: Input image as an array
+
+    Returns:
+        list: boundary boxes of the detected license plates
+    '''
+    blurred, dark = read_image(img)
+    classifier = load_backend('haar')
+    if dark < 65:
+        thresh = cv2.adaptiveThreshold(blurred, 255, 1, 1, 11, 2)
+        platings = classifier.detectMultiScale(thresh, minNeighbors=3)
+    else:
+        platings = classifier.detectMultiScale(blurred, minNeighbors=6)
+    return [[i, j, wide, height] for i, j, wide, height in platings]
+
+
+def time_per_frame(detect, frames, repeat=3):
+    '''Measure the time a detect function needs per frame.
+
+    Args:
+        detect (function): Function that takes a frame and returns boxes
+        frames (list): frames to run the function on
+        repeat (int): how often the measurement is repeated
+
+    Returns:
+        float: best mean time per frame in seconds
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            detect(frame)
+        best = min(best, (time.perf_counter() - start) / len(frames))
+    return best
+
+
+def compare_backends(frames, expected=None):
+    '''Compare the speed and recall of every available backend.
+
+    Args:
+        frames (list): test frames
+        expected (list): number of plates on each frame
+
+    Returns:
+        dict: for each backend name the frames per second, the recall (found
+            plates of the expected plates, counted per frame) and the number
+            of detections on frames without plates. Backends that could not be
+            loaded (e.g. an LBP cascade that was not trained yet) are left out.
+    '''
+    expected = EXPECTED_PLATES if expected is None else expected
+    report = {}
+    for name in sorted(BACKENDS):
+        try:
+            detector = PlateDetector(backend=name)
+        except IOError:
+            continue
+        seconds = time_per_frame(detector.detect, frames, repeat=1)
+        recall, false_detections = count_plates(
+            [len(boxes) for boxes in detector.detect_batch(frames)], expected)
+        report[name] = {'fps': 1 / seconds, 'recall': recall,
+                        'false_detections': false_detections}
+    return report
+
+
+def load_baseline(path=PATH_IMAGES, baseline=PATH_BASELINE):
+    '''Load the test images with the boxes of the baseline run.
+
+    Args:
+        path (path object): Folder containing the images
+        baseline (path object): json file mapping the file names to the
+            boxes the baseline run found on them
+
+    Returns:
+        list: (file name, image, boxes) of every image of the baseline run
+    '''
+    with open(baseline, encoding='utf-8') as file:
+        boxes = json.load(file)
+    return [(name, cv2.imread(str(path / name)), boxes[name]) for name in sorted(
+        boxes, key=lambda x: int(os.path.splitext(x)[0]))]
+
+
+def run_settings(settings, samples, repeat=3, threshold=0.5):
+    '''Benchmark the detector with one set of settings.
+
+    Args:
+        settings (dict): keyword arguments of PlateDetector
+        samples (list): (file name, image, boxes) as returned by load_baseline
+        repeat (int): how often every image is timed
+        threshold (float): minimum intersection over union of a match
+
+    Returns:
+        dict: settings, frames per second, latency percentiles in milliseconds
+            per frame size ("widthxheight"), the share of the baseline boxes
+            found again ("baseline_found") and the share of the detections
+            matching a baseline box ("baseline_matched"). Both measure the
+            agreement with the baseline run, the "recall" and the
+            "false_detections" are counted against EXPECTED_PLATES as in
+            compare_backends.
+    '''
+    detector = PlateDetector(**settings)
+    latencies = {}
+    matches = detections = boxes = 0
+    counts = []
+    for name, frame, expected in samples:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            found = detector.detect(frame)
+            times.append(time.perf_counter() - start)
+        latencies.setdefault(f'{frame.shape[1]}x{frame.shape[0]}', []).extend(times)
+        matches += count_matches(found, expected, threshold)
+        detections += len(found)
+        boxes += len(expected)
+        counts.append((len(found), expected_plates(name)))
+    detector.close()
+    recall, false_detections = count_plates(*zip(*counts))
+    every_time = [lat for times in latencies.values() for lat in times]
+    return {
+        'settings': settings,
+        'fps': len(every_time) / sum(every_time),
+        'latency_ms': {size: {f'p{q}': float(np.percentile(times, q)) * 1000
+                              for q in (50, 95, 99)} for size, times in latencies.items()},
+        # no detections at all do not disagree with the baseline
+        'baseline_found': matches / boxes if boxes else 1.0,
+        'baseline_matched': matches / detections if detections else 1.0,
+        'recall': recall,
+        'false_detections': false_detections}
+
+
+def run_suite(grid, samples, repeat=3, threshold=0.5):
+    '''Benchmark every combination of the given detector settings.
+
+    Args:
+        grid (dict): values to try for each PlateDetector keyword argument,
+            e.g. {'scale_factor': [1.05, 1.1]}. An empty dict benchmarks the
+            default settings.
+        samples (list): (file name, image, boxes) as returned by load_baseline
+        repeat (int): how often every image is timed
+        threshold (float): minimum intersection over union of a match
+
+    Returns:
+        dict: run with the environment and the results of every combination
+    '''
+    names = sorted(grid)
+    results = [run_settings(dict(zip(names, values)), samples, repeat, threshold)
+               for values in itertools.product(*(grid[name] for name in names))]
+    return {'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'repeat': repeat,
+            'threshold': threshold,
+            'results': results}
+
+
+def save_run(run, path):
+    '''Save a run of the benchmark suite as json.
+
+    Args:
+        run (dict): run returned by run_suite
+        path (path object): json file
+    '''
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(run, file, indent=2, default=str)
+
+
+def compare_runs(baseline, run, tolerance=0.1):
+    '''Find the regressions of a run against a baseline run.
+
+    Results are compared if they were run with the same settings.
+
+    Args:
+        baseline (dict): earlier run returned by run_suite or loaded from json
+        run (dict): new run
+        tolerance (float): relative slowdown that is still accepted, timings
+            vary between runs on the same machine
+
+    Returns:
+        list: description of every regression, empty if there is none
+    '''
+    def key(result):
+        return json.dumps(result['settings'], sort_keys=True, default=str)
+
+    earlier = {key(result): result for result in baseline['results']}
+    regressions = []
+    for result in run['results']:
+        old = earlier.get(key(result))
+        if old is None:
+            continue
+        name = key(result)
+        if result['fps'] < old['fps'] * (1 - tolerance):
+            regressions.append(f'{name}: fps {old["fps"]:.2f} -> {result["fps"]:.2f}')
+        for size, latency in result['latency_ms'].items():
+            old_p95 = old['latency_ms'].get(size, {}).get('p95')
+            if old_p95 is not None and latency['p95'] > old_p95 * (1 + tolerance):
+                regressions.append(f'{name}: p95 {size} {old_p95:.1f} ms -> '
+                                   f'{latency["p95"]:.1f} ms')
+        for metric in ('baseline_found', 'baseline_matched', 'recall'):
+            # runs saved before a metric existed are not compared on it
+            if metric in old and result[metric] < old[metric]:
+                regressions.append(f'{name}: {metric} {old[metric]:.2f} -> '
+                                   f'{result[metric]:.2f}')
+        if result['false_detections'] > old.get('false_detections', float('inf')):
+            regressions.append(f'{name}: false_detections {old["false_detections"]} -> '
+                               f'{result["false_detections"]}')
+    return regressions
+
+
+def print_run(run):
+    '''Print the results of a run as table'''
+    for result in run['results']:
+        print(f'{result["settings"]}: {result["fps"]:.2f} fps, '
+              f'recall {result["recall"]:.2f}, '
+              f'false detections {result["false_detections"]}, '
+              f'baseline found {result["baseline_found"]:.2f}, '
+              f'matched {result["baseline_matched"]:.2f}')
+        for size, latency in sorted(result['latency_ms'].items()):
+            print(f'    {size:>10} ' + ' '.join(f'{q} {ms:7.1f} ms' for q, ms in latency.items()))
+
+
+def main():
+    '''Print the per frame cost before and after reusing the cascade,
+    the comparison of the backends or the results of the benchmark suite'''
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', action='store_true', help='compare the backends')
+    parser.add_argument('--suite', action='store_true', help='run the benchmark suite')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='detector setting for the suite, can be given several times')
+    parser.add_argument('--repeat', type=int, default=3, help='timings per image')
+    parser.add_argument('--out', help='json file the suite run is saved to')
+    parser.add_argument('--compare', help='json file of a baseline run')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative slowdown accepted by the comparison')
+    args = parser.parse_args()
+    if args.suite:
+        run = run_suite(parse_grid(args.set), load_baseline(), args.repeat)
+        print_run(run)
+        if args.out:
+            save_run(run, args.out)
+        if args.compare:
+            with open(args.compare, encoding='utf-8') as file:
+                regressions = compare_runs(json.load(file), run, args.tolerance)
+            for regression in regressions:
+                print(f'REGRESSION {regression}')
+            if regressions:
+                sys.exit(1)
+        return
+    frames = load_images()
+    if args.backends:
+        print(f'{"backend":10} {"fps":>8} {"recall":>8} {"false":>6}')
+        for name, result in compare_backends(frames).items():
+            print(f'{name:10} {result["fps"]:8.2f} {result["recall"]:8.2f} '
+                  f'{result["false_detections"]:6d}')
+        return
+    detector = PlateDetector()
+    before = time_per_frame(legacy_detect, frames)
+    after = time_per_frame(detector.detect, frames)
+    print(f'cascade loaded per frame: {before * 1000:.1f} ms/frame')
+    print(f'PlateDetector:            {after * 1000:.1f} ms/frame')
+    print(f'speedup:                  {before / after:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+'''Perspective calibration of the plate size for a fixed camera'''
+import json
+import numpy as np
+
+
+class PerspectiveCalibration():
+    '''Maps the image row of a license plate to its expected size.
+
+    For a fixed camera the width of a plate grows roughly linearly with the
+    image row, because plates further down the image are closer to the camera.
+    The calibration is fitted from a few sample detections of one camera.
+    '''
+
+    def __init__(self, slope, intercept, aspect, tolerance=0.3):
+        '''Store the calibration.
+
+        Args:
+            slope (float): change of the plate width per image row
+            intercept (float): plate width at row 0
+            aspect (float): width / height of the plates
+            tolerance (float): relative deviation from the expected width that
+                is still scanned
+        '''
+        self.slope = slope
+        self.intercept = intercept
+        self.aspect = aspect
+        self.tolerance = tolerance
+
+    @classmethod
+    def fit(cls, boxes, tolerance=0.3):
+        '''Fit the calibration from sample detections.
+
+        Args:
+            boxes (list): sample boundary boxes [x, y, width, height] of one camera
+            tolerance (float): relative deviation from the expected width that
+                is still scanned
+
+        Returns:
+            PerspectiveCalibration: fitted calibration
+
+        Raises:
+            ValueError: If no sample boxes are given
+
+        Notes:
+            With samples on a single row the width is assumed to be the
+            same for every row.
+        '''
+        if len(boxes) == 0:
+            raise ValueError('At least one sample detection is needed')
+        boxes = np.array(boxes, dtype=float).reshape(-1, 4)
+        rows = boxes[:, 1] + boxes[:, 3] / 2
+        widths = boxes[:, 2]
+        aspect = float(np.median(widths / boxes[:, 3]))
+        if np.ptp(rows) == 0:
+            return cls(0.0, float(widths.mean()), aspect, tolerance)
+        slope, intercept = np.polyfit(rows, widths, 1)
+        return cls(float(slope), float(intercept), aspect, tolerance)
+
+    def size_range(self, row):
+        '''Expected plate size range for the center row of a plate.
+
+        Args:
+            row (float): image row of the plate center
+
+        Returns:
+            tuple: min_size and max_size as (width, height), None if no
+                plate is expected on this row
+        '''
+        width = self.slope * row + self.intercept
+        max_width = round(width * (1 + self.tolerance))
+        if max_width < 1:
+            return None
+        min_width = max(1, round(width * (1 - self.tolerance)))
+        return ((min_width, max(1, round(min_width / self.aspect))),
+                (max_width, max(1, round(max_width / self.aspect))))
+
+    def bands(self, height, count=4):
+        '''Split an image into horizontal bands with their plausible plate sizes.
+
+        Args:
+            height (int): image height
+            count (int): number of bands
+
+        Returns:
+            list: (top, bottom, min_size, max_size) of each band. Plates whose
+                center lies between top and bottom are scanned at the sizes
+                between min_size and max_size. Bands without plausible plates
+                are left out.
+        '''
+        bands = []
+        edges = np.linspace(0, height, count + 1).astype(int)
+        for top, bottom in zip(edges[:-1], edges[1:]):
+            ranges = [size for size in (self.size_range(top), self.size_range(bottom))
+                      if size is not None]
+            if not ranges:
+                continue
+            min_size = min(size[0] for size in ranges)
+            max_size = max(size[1] for size in ranges)
+            bands.append((int(top), int(bottom), min_size, max_size))
+        return bands
+
+    def save(self, path):
+        '''Save the calibration of a camera as json.
+
+        Args:
+            path (path object): json file
+        '''
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'slope': self.slope, 'intercept': self.intercept,
+                       'aspect': self.aspect, 'tolerance': self.tolerance}, file)
+
+    @classmethod
+    def load(cls, path):
+        '''Load the calibration of a camera from json.
+
+        Args:
+            path (path object): json file written by save
+
+        Returns:
+            PerspectiveCalibration: loaded calibration
+        '''
+        with open(path, encoding='utf-8') as file:
+            return cls(**json.load(file))
+
+
+def calibrate(detector, frames, tolerance=0.3):
+    '''Fit a calibration from the detections of an uncalibrated detector.
+
+    Args:
+        detector (PlateDetector): detector that scans every scale
+        frames: sample frames of a single camera
+        tolerance (float): relative deviation from the expected width that
+            is still scanned
+
+    Returns:
+        PerspectiveCalibration: fitted calibration
+    '''
+    boxes = [box for frame in frames for box in detector.detect(frame)]
+    return PerspectiveCalibration.fit(boxes, tolerance)
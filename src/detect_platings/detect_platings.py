@@ -1,8 +1,9 @@
 '''Detection Module for detecting platings on cars'''
-from pathlib import Path
-import cv2
-import numpy as np
-from src.ocr.ocr import read_numberplate
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import threading
+from src.detect_platings.backends import DEFAULT_BACKEND, load_backend
+from src.preprocessing.frame_context import FrameContext
 
 
 def read_image(image):
@@ -24,13 +25,242 @@ def read_image(image):
         It is useful for removing noise (removes high frequency)
     '''
 
-    mean = int(np.mean(image))
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    return blur, mean
+    context = FrameContext(image)
+    return context.blurred, context.mean
 
 
-def detect_image(img):
+def clip_regions(regions, shape):
+    '''Clip regions to the frame.
+
+    Args:
+        regions (list): regions [x, y, width, height], which may reach
+            outside of the frame
+        shape (tuple): shape of the frame
+
+    Returns:
+        list: the parts of the regions inside of the frame, regions
+            completely outside of the frame are left out
+
+    Notes:
+        Negative coordinates would otherwise wrap around in the numpy
+        slices and shift the found boxes.
+    '''
+    height, width = shape[:2]
+    clipped = []
+    for x_up, y_up, wide, high in regions:
+        x_down, y_down = min(width, x_up + wide), min(height, y_up + high)
+        x_up, y_up = max(0, x_up), max(0, y_up)
+        if x_down > x_up and y_down > y_up:
+            clipped.append([x_up, y_up, x_down - x_up, y_down - y_up])
+    return clipped
+
+
+class PlateDetector():  # pylint: disable=R0902
+    '''Reusable license plate detector.
+
+    The cascade is parsed once when the detector is created, so every
+    following frame only pays for the detection itself. All detection
+    settings are kept on the instance. The cascade is taken from the
+    backend registry, see src.detect_platings.backends.
+    '''
+
+    def __init__(self, backend=DEFAULT_BACKEND, dark_threshold=65,  # pylint: disable=R0913
+                 dark_neighbors=3, bright_neighbors=6, scale_factor=1.1,
+                 min_size=None, max_size=None, calibration=None, bands=4,
+                 tile_size=None, tile_overlap=None, workers=1):
+        '''Load the cascade and store the detection settings.
+
+        Args:
+            backend (str): name of a registered backend, e.g. 'haar', or 'lbp' once
+                its cascade is trained with train_lbp.py
+            dark_threshold (int): Images with a mean value below it are thresholded
+                before the detection
+            dark_neighbors (int): minNeighbors used for dark images
+            bright_neighbors (int): minNeighbors used for bright images
+            scale_factor (float): How much the image size is reduced at each image scale
+            min_size (tuple): Minimum possible plate size (width, height), None for no limit
+            max_size (tuple): Maximum possible plate size (width, height), None for no limit
+            calibration (PerspectiveCalibration): expected plate size per image row of a
+                fixed camera. If given, the frame is scanned in horizontal bands, each only
+                at its plausible plate sizes, and min_size/max_size are not used.
+            bands (int): number of horizontal bands used with a calibration
+            tile_size (tuple): size (width, height) of the overlapping tiles, into which
+                high resolution frames are split. None scans without tiles.
+            tile_overlap (int): overlap of neighboring tiles in pixels, it should be at
+                least the size of the largest plate. None uses the width of max_size,
+                or 200 pixels without max_size.
+            workers (int): number of threads the tiles and bands are scanned with
+
+        Raises:
+            KeyError: If the backend is not registered
+            IOError: If the cascade could not be loaded
+            ValueError: If the tiles are not larger than their overlap
+        '''
+        self.backend = backend
+        self.classifier = load_backend(backend)
+        self.dark_threshold = dark_threshold
+        self.dark_neighbors = dark_neighbors
+        self.bright_neighbors = bright_neighbors
+        self.scale_factor = scale_factor
+        self.min_size = min_size
+        self.max_size = max_size
+        self.calibration = calibration
+        self.bands = bands
+        self.tile_size = tile_size
+        if tile_overlap is None:
+            tile_overlap = max_size[0] if max_size else 200
+        self.tile_overlap = tile_overlap
+        if tile_size is not None and min(tile_size) <= tile_overlap:
+            raise ValueError(f'Tiles {tile_size} must be larger than their overlap {tile_overlap}')
+        # OpenCV releases the GIL while detecting, so threads scan in parallel.
+        # A classifier must not be used by two threads at once, hence every
+        # thread loads its own copy once.
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(workers, initializer=self._load_thread_classifier) \
+            if workers > 1 else None
+
+    def _load_thread_classifier(self):
+        '''Load the cascade for the current worker thread'''
+        self.local.classifier = load_backend(self.backend)
+
+    def detect(self, img, regions=None, context=None):
+        '''Detect the license plates on a frame.
+
+        Args:
+            img: Input image as an array
+            regions (list): regions [x, y, width, height] to which the detection
+                is limited, e.g. the dirty regions of a MotionGate. They are
+                clipped to the frame. None scans the whole frame.
+            context (FrameContext): preprocessing cache of the frame, that is
+                shared with the other detectors. None creates a new one.
+
+        Returns:
+            list: contains the coordinates [x, y, width, height] of the
+                boundary boxes from the detected license plates, in full
+                frame coordinates.
+
+        Notes:
+            Only the boxes are returned, reading the plates is done by
+            a separate OCR stage, see src.ocr.ocr_worker
+        '''
+        if context is None:
+            context = FrameContext(img)
+        if context.mean < self.dark_threshold:
+            image = context.thresh
+            neighbors = self.dark_neighbors
+        else:
+            image = context.blurred
+            neighbors = self.bright_neighbors
+        if regions is None:
+            regions = [[0, 0, image.shape[1], image.shape[0]]]
+        else:
+            regions = clip_regions(regions, image.shape)
+
+        jobs = [job for region in regions for job in self._jobs(image.shape[0], region)]
+        if self.executor is not None and len(jobs) > 1:
+            results = self.executor.map(lambda job: self._scan(image, job, neighbors), jobs)
+        else:
+            results = [self._scan(image, job, neighbors) for job in jobs]
+        return [box for result in results for box in result]
+
+    def _jobs(self, image_height, region):
+        '''Split a region into the parts that are scanned separately.
+
+        Args:
+            image_height (int): height of the frame
+            region (list): [x, y, width, height] of the region
+
+        Returns:
+            list: jobs (core, scan, min_size, max_size). Only plates whose
+                center lies in the core [x0, y0, x1, y1] are kept. The scan
+                area [x0, y0, x1, y1] adds a margin around the core, so these
+                plates are always scanned completely.
+
+        Notes:
+            With a calibration the region is split into the bands of the
+            calibration and the margin of each band is half its largest plate.
+            With tiles the cores are laid out without gaps, and the scan area
+            adds half the tile overlap on every side. Since every plate center
+            lies in exactly one core, plates on the seams of bands or tiles are
+            found once.
+        '''
+        x_up, y_up, wide, height = region
+        if self.calibration is None:
+            bands = [(y_up, y_up + height, self.min_size or (0, 0), self.max_size or (0, 0))]
+        else:
+            bands = self.calibration.bands(image_height, self.bands)
+        if self.tile_size is None:
+            tile_wide, tile_high, margin = wide, height, 0
+        else:
+            tile_wide = self.tile_size[0] - self.tile_overlap
+            tile_high = self.tile_size[1] - self.tile_overlap
+            margin = self.tile_overlap // 2 + 1
+
+        jobs = []
+        for top, bottom, min_size, max_size in bands:
+            top, bottom = max(top, y_up), min(bottom, y_up + height)
+            margin_y = max(margin, max_size[1] // 2 + 1 if max_size[1] else 0)
+            for tile_top in range(top, bottom, tile_high):
+                tile_bottom = min(bottom, tile_top + tile_high)
+                for tile_left in range(x_up, x_up + wide, tile_wide):
+                    tile_right = min(x_up + wide, tile_left + tile_wide)
+                    scan = [max(x_up, tile_left - margin), max(y_up, tile_top - margin_y),
+                            min(x_up + wide, tile_right + margin),
+                            min(y_up + height, tile_bottom + margin_y)]
+                    jobs.append(([tile_left, tile_top, tile_right, tile_bottom], scan,
+                                 min_size, max_size))
+        return jobs
+
+    def _scan(self, image, job, neighbors):
+        '''Run the cascade on a part of a preprocessed image.
+
+        Args:
+            image: blurred or thresholded gray image
+            job (tuple): core, scan area, min_size and max_size, see _jobs
+            neighbors (int): minNeighbors for the detection
+
+        Returns:
+            list: boundary boxes [x, y, width, height] in image coordinates
+                of the plates whose center lies in the core
+        '''
+        core, scan, min_size, max_size = job
+        classifier = getattr(self.local, 'classifier', self.classifier)
+        platings = classifier.detectMultiScale(
+            image[scan[1]: scan[3], scan[0]: scan[2]], scaleFactor=self.scale_factor,
+            minNeighbors=neighbors, minSize=min_size, maxSize=max_size)
+        position = []
+        for i, j, plate_wide, plate_height in platings:
+            i, j = i + scan[0], j + scan[1]
+            center_x, center_y = i + plate_wide / 2, j + plate_height / 2
+            if core[0] <= center_x < core[2] and core[1] <= center_y < core[3]:
+                position.append([i, j, plate_wide, plate_height])
+        return position
+
+    def close(self):
+        '''Stop the threads used for tiled detection'''
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def detect_batch(self, frames):
+        '''Detect license plates on several frames.
+
+        Args:
+            frames: list or generator of images
+
+        Yields:
+            list: boundary boxes of each frame, in the order of the frames
+        '''
+        for frame in frames:
+            yield self.detect(frame)
+
+
+@lru_cache(maxsize=1)
+def default_detector():
+    '''Returns the shared detector with the default settings'''
+    return PlateDetector()
+
+
+def detect_image(img, regions=None, context=None):
     '''Detect the image and find license plates.
 
     This function performs a detection to find license plates
@@ -38,6 +268,9 @@ def detect_image(img):
 
     Args:
         img: Input image as an array
+        regions (list): regions [x, y, width, height] to which the detection
+            is limited, None scans the whole frame
+        context (FrameContext): preprocessing cache of the frame
 
     Returns:
         list: contains the coordinates of the rectangle boundary boxes
@@ -55,22 +288,8 @@ def detect_image(img):
         then minNeighbors should have values from 5 to 10
         If the license plate has a small size (more realistic in a traffic),
         then the value should be between 2 or 3
-    '''
-    position = []
-
-    blurred, dark = read_image(img)
-    classifier = cv2.CascadeClassifier(
-        str(Path(__file__).parent / 'haarcascade.xml'))
-    if dark < 65:
-        thresh = cv2.adaptiveThreshold(
-            blurred, 255, 1, 1, 11, 2)
-        platings = classifier.detectMultiScale(
-            thresh, minNeighbors=3)
-    else:
-        platings = classifier.detectMultiScale(
-            blurred, minNeighbors=6)
 
-    for i, j, wide, height in platings:
-        position.append([i, j, wide, height])
-        read_numberplate(img, position)
-    return position
+        The cascade is only loaded once and shared between all calls,
+        see PlateDetector
+    '''
+    return default_detector().detect(img, regions, context)
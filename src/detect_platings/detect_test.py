@@ -1,9 +1,17 @@
 '''Testing the Detector module detect_platings'''
 from pathlib import Path
+import json
 import os
 import cv2
 import numpy as np
-from src.detect_platings.detect_platings import read_image, detect_image
+import pytest
+from src.benchmark_utils import count_matches
+from src.detect_platings.detect_platings import read_image, PlateDetector, clip_regions
+from src.detect_platings.calibration import PerspectiveCalibration, calibrate
+from src.detect_platings.backends import BACKENDS, PATH_LBP, load_backend, register_backend, \
+    register_cascade
+from src.detect_platings.benchmark import compare_runs, count_plates, load_baseline, run_suite, \
+    save_run
 
 
 img_list = []
@@ -12,6 +20,7 @@ folder = os.listdir(pfad)
 folder = sorted(folder, key=lambda x: int(os.path.splitext(x)[0]))
 for filename in folder:
     img_list.append(cv2.imread(str(pfad / filename)))
+detector = PlateDetector()
 
 
 def test_read_image():
@@ -50,9 +59,9 @@ def test_detect_image_1():
 
     shape = img_list[0].shape
     approximated_y = shape[0]/2
-    real_y = detect_image(img_list[0])[0][1]
+    real_y = detector.detect(img_list[0])[0][1]
     approximated_x = shape[1]/4
-    real_x = detect_image(img_list[0])[0][0]
+    real_x = detector.detect(img_list[0])[0][0]
     assert approximated_y < real_y
     assert approximated_x < real_x
 
@@ -69,9 +78,9 @@ def test_detect_image_2():
 
     shape = img_list[1].shape
     approximated_y = shape[0]/2
-    real_y = detect_image(img_list[1])[0][1]
+    real_y = detector.detect(img_list[1])[0][1]
     approximated_x = shape[1]/4
-    real_x = detect_image(img_list[1])[0][0]
+    real_x = detector.detect(img_list[1])[0][0]
     assert approximated_y < real_y
     assert approximated_x < real_x
 
@@ -92,9 +101,9 @@ def test_detect_image_3():
 
     shape = img_list[2].shape
     approximated_y = shape[0]/2
-    real_y = detect_image(img_list[2])[0][1]
+    real_y = detector.detect(img_list[2])[0][1]
     approximated_x = shape[1]/4
-    real_x = detect_image(img_list[2])[0][0]
+    real_x = detector.detect(img_list[2])[0][0]
     assert approximated_y < real_y
     assert approximated_x < real_x
 
@@ -117,9 +126,9 @@ def test_detect_image_4():
 
     shape = img_list[3].shape
     approximated_y = shape[0]/2
-    real_y = detect_image(img_list[3])[0][1]
+    real_y = detector.detect(img_list[3])[0][1]
     approximated_x = shape[1]/4
-    real_x = detect_image(img_list[3])[0][0]
+    real_x = detector.detect(img_list[3])[0][0]
     assert approximated_y < real_y
     assert approximated_x < real_x
 
@@ -136,9 +145,9 @@ def test_detect_image_5():
 
     shape = img_list[4].shape
     approximated_y = shape[0]/2
-    real_y = detect_image(img_list[4])[0][1]
+    real_y = detector.detect(img_list[4])[0][1]
     approximated_x = shape[1]/4
-    real_x = detect_image(img_list[4])[0][0]
+    real_x = detector.detect(img_list[4])[0][0]
     assert approximated_y < real_y
     assert approximated_x < real_x
 
@@ -160,9 +169,9 @@ def test_detect_image_6():
 
     shape = img_list[5].shape
     approximated_y = shape[0]/2
-    real_y = detect_image(img_list[5])[0][1]
+    real_y = detector.detect(img_list[5])[0][1]
     approximated_x = shape[1]/10
-    real_x = detect_image(img_list[5])[0][0]
+    real_x = detector.detect(img_list[5])[0][0]
     assert approximated_y < real_y
     assert approximated_x < real_x
 
@@ -179,9 +188,9 @@ def test_detect_image_7():
 
     shape = img_list[6].shape
     approximated_y = shape[0]/3
-    real_y = detect_image(img_list[6])[0][1]
+    real_y = detector.detect(img_list[6])[0][1]
     approximated_x = shape[1]/4
-    real_x = detect_image(img_list[6])[0][0]
+    real_x = detector.detect(img_list[6])[0][0]
     assert approximated_y < real_y
     assert approximated_x < real_x
 
@@ -198,9 +207,9 @@ def test_detect_image_8():
 
     shape = img_list[7].shape
     approximated_y = shape[0]/3
-    real_y = detect_image(img_list[7])[0][1]
+    real_y = detector.detect(img_list[7])[0][1]
     approximated_x = shape[1]/4
-    real_x = detect_image(img_list[7])[0][0]
+    real_x = detector.detect(img_list[7])[0][0]
     assert approximated_y < real_y
     assert approximated_x < real_x
 
@@ -217,9 +226,9 @@ def test_detect_image_9():
 
     shape = img_list[8].shape
     approximated_y = shape[0]/2
-    real_y = detect_image(img_list[8])[0][1]
+    real_y = detector.detect(img_list[8])[0][1]
     approximated_x = shape[1]/4
-    real_x = detect_image(img_list[8])[0][0]
+    real_x = detector.detect(img_list[8])[0][0]
     assert approximated_y < real_y
     assert approximated_x < real_x
 
@@ -236,9 +245,9 @@ def test_detect_image_10():
 
     shape = img_list[9].shape
     approximated_y = shape[0]/3
-    real_y = detect_image(img_list[9])[0][1]
+    real_y = detector.detect(img_list[9])[0][1]
     approximated_x = shape[1]/4
-    real_x = detect_image(img_list[9])[0][0]
+    real_x = detector.detect(img_list[9])[0][0]
     assert approximated_y < real_y
     assert approximated_x < real_x
 
@@ -251,8 +260,8 @@ def test_none_plate():
     '''
 
     nothing = []
-    assert nothing == list(detect_image(img_list[10]))
-    assert nothing == list(detect_image(img_list[11]))
+    assert nothing == list(detector.detect(img_list[10]))
+    assert nothing == list(detector.detect(img_list[11]))
 
 
 def test_double_plate():
@@ -264,15 +273,189 @@ def test_double_plate():
 
     shape = img_list[12].shape
     approximated_y1 = shape[0]/3
-    real_y1 = detect_image(img_list[12])[0][1]
+    real_y1 = detector.detect(img_list[12])[0][1]
     approximated_x1 = shape[1]/12
-    real_x1 = detect_image(img_list[12])[0][0]
+    real_x1 = detector.detect(img_list[12])[0][0]
     assert approximated_y1 < real_y1
     assert approximated_x1 < real_x1
 
     approximated_y2 = shape[0]/3
-    real_y2 = detect_image(img_list[12])[1][1]
+    real_y2 = detector.detect(img_list[12])[1][1]
     approximated_x2 = shape[1]/6
-    real_x2 = detect_image(img_list[12])[1][0]
+    real_x2 = detector.detect(img_list[12])[1][0]
     assert approximated_y2 < real_y2
     assert approximated_x2 < real_x2
+
+
+def test_detect_batch():
+    '''Tests the batch detection.
+
+       This function tests if detect_batch returns the same boundary boxes
+       as single detections, in the order of the frames, for a list and
+       for a generator of frames.
+    '''
+
+    single = [detector.detect(img) for img in img_list[:4]]
+    assert list(detector.detect_batch(img_list[:4])) == single
+    assert list(detector.detect_batch(img for img in img_list[:4])) == single
+
+
+def test_detector_settings():
+    '''Tests if the settings are kept on the detector.
+
+       This function tests if a maximum size smaller than every plate
+       suppresses all detections, while the shared detector is unchanged.
+    '''
+
+    small_detector = PlateDetector(max_size=(10, 5))
+    assert small_detector.max_size == (10, 5)
+    assert small_detector.detect(img_list[0]) == []
+    assert detector.max_size is None
+
+
+def test_detect_regions():
+    '''Tests the detection inside of regions.
+
+       This function tests if a region around the plate finds the plate
+       in full frame coordinates, while a region without plate
+       returns nothing.
+
+       Notes:
+            The scales of the cascade depend on the image size, so the box
+            found in the region can differ by a few pixels
+    '''
+
+    full = detector.detect(img_list[0])
+    i, j, wide, height = full[0]
+    region = [i - 40, j - 40, wide + 80, height + 80]
+    found = detector.detect(img_list[0], [region])
+    assert len(found) == 1
+    assert np.all(np.abs(np.array(found[0]) - full[0]) < wide / 10)
+    assert detector.detect(img_list[0], [[0, 0, 100, 100]]) == []
+
+
+def test_clip_regions():
+    '''Tests if regions reaching outside of the frame find the same plates
+       as the part inside of the frame'''
+    width = img_list[0].shape[1]
+    assert clip_regions([[-10, -20, 50, 60], [width - 5, 10, 20, 20],
+                         [width + 5, 0, 10, 10]], img_list[0].shape) == \
+        [[0, 0, 40, 40], [width - 5, 10, 5, 20]]
+    full = detector.detect(img_list[0])
+    i, j, wide, plate_height = full[0]
+    outside = [-i - 40, -j - 40, 2 * i + wide + 80, 2 * j + plate_height + 80]
+    found = detector.detect(img_list[0], [outside])
+    assert found and found == detector.detect(img_list[0],
+                                              clip_regions([outside], img_list[0].shape))
+    assert min(box[0] for box in found) >= 0 and min(box[1] for box in found) >= 0
+    assert detector.detect(img_list[0], [[-100, -100, 50, 50]]) == []
+
+
+def test_calibration_fit(tmp_path):
+    '''Tests the perspective calibration.
+
+       This function tests if the plate width is fitted linearly over the
+       center rows of sample boxes, if the size range follows the fit and
+       if a saved calibration is loaded again.
+    '''
+
+    samples = [[0, 90, 40, 20], [0, 280, 80, 40], [0, 470, 120, 60]]
+    calibration = PerspectiveCalibration.fit(samples, tolerance=0.25)
+    assert abs(calibration.slope - 0.2) < 1e-6
+    assert abs(calibration.aspect - 2) < 1e-6
+    min_size, max_size = calibration.size_range(300)
+    assert min_size == (60, 30)
+    assert max_size == (100, 50)
+    assert calibration.size_range(-200) is None
+    bands = calibration.bands(600, 3)
+    assert [band[:2] for band in bands] == [(0, 200), (200, 400), (400, 600)]
+    calibration.save(tmp_path / 'camera.json')
+    loaded = PerspectiveCalibration.load(tmp_path / 'camera.json')
+    assert loaded.size_range(300) == calibration.size_range(300)
+
+
+def test_calibrated_detection():
+    '''Tests the detection with a calibration.
+
+       This function tests if a detector calibrated on the two plates of
+       the last image still finds both of them exactly once.
+    '''
+
+    calibration = calibrate(detector, [img_list[12]])
+    calibrated = PlateDetector(calibration=calibration, bands=6)
+    found = calibrated.detect(img_list[12])
+    expected = detector.detect(img_list[12])
+    assert len(found) == len(expected) == 2
+    for box in expected:
+        assert any(np.all(np.abs(np.array(box) - other) < box[2] / 10) for other in found)
+
+
+def test_tiled_detection():
+    '''Tests the tiled detection.
+
+       This function tests if splitting the image with two plates into
+       overlapping tiles, that are scanned by two threads, finds every
+       plate exactly once and in the same order for every run.
+    '''
+
+    tiled = PlateDetector(tile_size=(700, 450), tile_overlap=300, workers=2)
+    found = tiled.detect(img_list[12])
+    expected = detector.detect(img_list[12])
+    assert len(found) == len(expected)
+    for box in expected:
+        assert any(np.all(np.abs(np.array(box) - other) < box[2] / 10) for other in found)
+    assert tiled.detect(img_list[12]) == found
+    tiled.close()
+    with pytest.raises(ValueError):
+        PlateDetector(tile_size=(200, 200), tile_overlap=300)
+
+
+def test_backends(tmp_path):
+    '''Tests the selection of the detector backend.
+
+       This function tests if a registered backend is used by the detector,
+       while unknown names and missing cascade files raise an error.
+    '''
+
+    register_backend('test', lambda: detector.classifier)
+    test_detector = PlateDetector(backend='test')
+    assert test_detector.classifier is detector.classifier
+    assert test_detector.detect(img_list[0]) == detector.detect(img_list[0])
+    del BACKENDS['test']
+    with pytest.raises(KeyError):
+        PlateDetector(backend='unknown')
+    register_cascade('missing', tmp_path / 'missing.xml')
+    with pytest.raises(IOError):
+        load_backend('missing')
+    del BACKENDS['missing']
+    # the lbp backend is only offered with a trained cascade
+    assert ('lbp' in BACKENDS) == PATH_LBP.is_file()
+
+
+def test_benchmark_suite(tmp_path):
+    '''Tests the benchmark suite.
+
+       This function tests if the boxes of the baseline run are found again by
+       the default detector, if a run can be saved and compared, and if a slower
+       run or one that disagrees more with the baseline is reported as regression.
+    '''
+
+    assert count_matches([[0, 0, 10, 10], [50, 50, 10, 10]], [[1, 1, 10, 10]]) == 1
+    assert count_matches([[20, 20, 10, 10]], [[0, 0, 10, 10]]) == 0
+    samples = load_baseline()
+    run = run_suite({'scale_factor': [1.1]}, [samples[0], samples[10], samples[12]], repeat=1)
+    result = run['results'][0]
+    assert result['settings'] == {'scale_factor': 1.1}
+    assert result['baseline_found'] == 1.0 and result['baseline_matched'] == 1.0
+    # the images 1, 11 and 13 show one, no and two plates
+    assert result['recall'] == 1.0 and result['false_detections'] == 0
+    assert count_plates([1, 1, 1], [1, 0, 2]) == (2 / 3, 1)
+    assert set(result['latency_ms']) == {'640x480', '1024x576', '1206x602'}
+    save_run(run, tmp_path / 'run.json')
+    with open(tmp_path / 'run.json', encoding='utf-8') as file:
+        baseline = json.load(file)
+    assert not compare_runs(baseline, run)
+    result['fps'] /= 2
+    result['baseline_found'] = 0.5
+    result['false_detections'] += 1
+    assert len(compare_runs(baseline, run)) == 3
@@ -0,0 +1,121 @@
+'''Offline training of an LBP cascade for license plates
+
+The positives are the cropped license plates in ocr/Dataset, the negatives
+are images without any license plate. The trained cascade is copied to
+detect_platings/lbpcascade.xml, the 'lbp' backend is registered once that
+file exists.
+
+Run with: python -m src.detect_platings.train_lbp NEGATIVE_DIR
+
+Notes:
+    opencv_createsamples and opencv_traincascade are part of the OpenCV 3.4
+    apps and have to be on the PATH, the pip packages do not contain them.
+'''
+import argparse
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import cv2
+
+
+PATH_POSITIVES = Path(__file__).parent.parent / 'ocr' / 'Dataset'
+PATH_CASCADE = Path(__file__).parent / 'lbpcascade.xml'
+# same window size as the Haar cascade, plates are about three times wider than high
+WINDOW = (60, 20)
+IMAGE_ENDINGS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def write_positives(path_in, work_dir):
+    '''Write the gray positives and their info file for opencv_createsamples.
+
+    Args:
+        path_in (path object): folder with cropped license plates
+        work_dir (path object): folder the training files are written to
+
+    Returns:
+        int: number of positives
+    '''
+    positive_dir = work_dir / 'positives'
+    positive_dir.mkdir(parents=True, exist_ok=True)
+    lines = []
+    for name in sorted(os.listdir(path_in)):
+        if not name.lower().endswith(IMAGE_ENDINGS):
+            continue
+        img = cv2.imread(str(path_in / name), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            continue
+        out_name = f'{len(lines)}.png'
+        cv2.imwrite(str(positive_dir / out_name), img)
+        # the whole crop is the plate
+        lines.append(f'positives/{out_name} 1 0 0 {img.shape[1]} {img.shape[0]}')
+    (work_dir / 'positives.info').write_text('\n'.join(lines) + '\n')
+    return len(lines)
+
+
+def write_negatives(path_in, work_dir):
+    '''Write the background file listing the negative images.
+
+    Args:
+        path_in (path object): folder with images without license plates
+        work_dir (path object): folder the training files are written to
+
+    Returns:
+        int: number of negatives
+    '''
+    names = [str(Path(path_in).resolve() / name) for name in sorted(os.listdir(path_in))
+             if name.lower().endswith(IMAGE_ENDINGS)]
+    (work_dir / 'negatives.txt').write_text('\n'.join(names) + '\n')
+    return len(names)
+
+
+def train(path_negatives, work_dir, stages=15, path_positives=PATH_POSITIVES,
+          path_cascade=PATH_CASCADE):
+    '''Train the LBP cascade and copy it to where the 'lbp' backend loads it.
+
+    Args:
+        path_negatives (path object): folder with images without license plates
+        work_dir (path object): folder for the intermediate training files
+        stages (int): number of cascade stages
+        path_positives (path object): folder with cropped license plates
+        path_cascade (path object): where the trained cascade is copied to
+
+    Raises:
+        FileNotFoundError: If the OpenCV training tools are not installed
+        subprocess.CalledProcessError: If a training step fails
+    '''
+    for tool in ('opencv_createsamples', 'opencv_traincascade'):
+        if shutil.which(tool) is None:
+            raise FileNotFoundError(f'{tool} is needed for training, install the OpenCV apps')
+    work_dir = Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    num_pos = write_positives(path_positives, work_dir)
+    num_neg = write_negatives(path_negatives, work_dir)
+    width, height = WINDOW
+
+    subprocess.run(['opencv_createsamples', '-info', 'positives.info', '-vec', 'positives.vec',
+                    '-num', str(num_pos), '-w', str(width), '-h', str(height)],
+                   cwd=work_dir, check=True)
+    cascade_dir = work_dir / 'cascade'
+    cascade_dir.mkdir(exist_ok=True)
+    # some positives are used up by every stage, so not all of them can be requested
+    subprocess.run(['opencv_traincascade', '-data', 'cascade', '-vec', 'positives.vec',
+                    '-bg', 'negatives.txt', '-numPos', str(int(num_pos * 0.85)),
+                    '-numNeg', str(max(num_neg, 2 * num_pos)), '-numStages', str(stages),
+                    '-featureType', 'LBP', '-w', str(width), '-h', str(height)],
+                   cwd=work_dir, check=True)
+    shutil.copy(cascade_dir / 'cascade.xml', path_cascade)
+
+
+def main():
+    '''Train the LBP cascade from the command line'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('negatives', help='folder with images without license plates')
+    parser.add_argument('--work-dir', default='lbp_training', help='folder for training files')
+    parser.add_argument('--stages', type=int, default=15, help='number of cascade stages')
+    args = parser.parse_args()
+    train(Path(args.negatives), Path(args.work_dir), args.stages)
+
+
+if __name__ == '__main__':
+    main()
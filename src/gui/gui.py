@@ -9,6 +9,7 @@ from PySide2 import QtCore
 from PySide2 import QtGui
 from PySide2 import QtWidgets
 from src.stabilisierung.stb import execute
+from src.ocr.plate_store import INDEX, PlateStore
 
 
 class MainWind:  # pylint: disable=R0902
@@ -338,12 +339,24 @@ class OCRDisplay(QtWidgets.QWidget):  # pylint: disable=R0902
         self.ocrcheck.clicked.connect(self.license_plate())
         self.ocrcheck.clicked.connect(self.show_plate)
 
+    def plate_store(self):
+        """Returns the index of the saved plates in path_ocr, None if there is none"""
+        if not isfile(join(self.path_ocr, INDEX)):
+            return None
+        return PlateStore(Path(self.path_ocr))
+
     def license_plate(self):
         """Iteriate the folder ocr/licenseplates as the name reference to the plate name
         Notes:
             some files are stored as .jpeg and some are stored as .jpg so it needs to be
-            removed while displayed
+            removed while displayed. If the folder has a plate index, its plate names
+            are queried instead of listing the folder
         """
+        store = self.plate_store()
+        if store is not None:
+            for text in store.texts():
+                self.textbrowser.append(text)
+            return
         plates = [i for i in os.listdir(self.path_ocr) if isfile(join(self.path_ocr, i))]
         number_of_plates = len(plates)
         for j in range(number_of_plates):
@@ -359,9 +372,14 @@ class OCRDisplay(QtWidgets.QWidget):  # pylint: disable=R0902
     def show_plate(self):
         """Shows a cropped image of the license plate
         in order to execute right the name and press enter
-        write the extension type because ocr make either jpg or jpeg"""
-        path_get = str(self.path_getlicence) + "\\" + self.lineocr.text() + ".jpg"
-        plate_snip = cv2.imread(path_get)
+        write the extension type because ocr make either jpg or jpeg.
+        With a plate index the latest cut out of the plate is shown"""
+        store = self.plate_store()
+        if store is not None:
+            plate_snip = store.latest_crop(self.lineocr.text())
+        else:
+            path_get = str(self.path_getlicence) + "\\" + self.lineocr.text() + ".jpg"
+            plate_snip = cv2.imread(path_get)
         cv2.imshow(self.lineocr.text(), plate_snip)
         cv2.waitKey(0)
         return 5
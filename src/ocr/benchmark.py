@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+
+"""Benchmark of the character recognition, one CNN call per plate against batched calls
+
+Run with: python -m src.ocr.benchmark [--plates-per-frame 4] [--random-weights]
+or time the NumPy export of the model, see numpy_cnn:
+python -m src.ocr.benchmark --backend numpy
+or the int8 model, see quantize:
+python -m src.ocr.benchmark --backend tflite
+
+Profile every stage on the Test_Bilder crops for several batch sizes and backends,
+save the results and compare them to an earlier run:
+python -m src.ocr.benchmark --sweep --batch-sizes 1 4 8 --backends keras numpy tflite
+    --json run.json [--compare baseline.json] [--tolerance 0.1]
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+import platform
+import sys
+import time
+from cv2 import cv2
+import numpy as np
+import src.ocr.ocr as ocr
+from src.ocr.model_manager import ModelManager
+from src.ocr.ocr_batcher import OCRBatcher
+
+PATH_PLATES = Path(__file__).parent / 'Dataset'
+PATH_TEST = Path(__file__).parent / 'Test_Bilder'
+
+# plate string of every positive test image, the *_neg_test images show no plate
+TEST_PLATES = {'1_pos_test.jpg': '5C65578', '2_pos_test.jpg': 'MAU1288',
+               '3_pos_test.jpg': 'MKE1104', '4_pos_test.jpg': 'MBB9006',
+               '5_pos_test.jpg': '9B38368', '6_pos_test.jpg': 'MAF6608',
+               '7_pos_test.jpg': 'MKT5268', '8_pos_test.jpg': 'DUP2900'}
+
+STAGES = ('preprocess_image', 'find_characters', 'recognize_characters')
+
+
+def load_plates(path=PATH_PLATES, limit=None):
+    """Function that finds the characters of the cut out plates in a directory
+
+    Args:
+        path (path object): directory with images of license plates
+        limit (int): maximum number of plates, None loads every plate
+
+    Returns:
+        list of tuples: char_found and chars of every plate, as returned by find_characters
+    """
+    names = sorted(os.listdir(path))[:limit]
+    plates = [ocr.find_characters(cv2.imread(str(path / name))) for name in names]
+    return [(found, chars) for found, chars, _ in plates]
+
+
+def random_manager():
+    """Function that returns a ModelManager with the CNN architecture and untrained weights
+
+    Notes:
+        The timing of the CNN does not depend on the weights, so the benchmark also runs
+        where the trained model is not available.
+    """
+    from src.ocr.generate_cnn import build_model  # pylint: disable=C0415
+    return ModelManager(model=build_model(len(ocr.MAP_LEGEND)))
+
+
+def measure(plates, plates_per_frame, manager, repeat=3):
+    """Function that measures the characters per second of both ways to recognize the plates
+
+    Args:
+        plates (list of tuples): char_found and chars of every plate
+        plates_per_frame (int): number of plates that are recognized together
+        manager (ModelManager): model to recognize the characters with
+        repeat (int): number of runs, the fastest one counts
+
+    Returns:
+        dict: characters, characters per second per plate and batched, CNN calls
+            of both and if both returned the same strings
+    """
+    frames = [plates[i:i + plates_per_frame] for i in range(0, len(plates), plates_per_frame)]
+    characters = sum(len(chars) for found, chars in plates if found)
+    previous, ocr.model_manager = ocr.model_manager, manager
+    try:
+        manager.get()
+        per_plate, batched = float('inf'), float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            single = [ocr.recognize_characters(found, chars) for found, chars in plates]
+            per_plate = min(per_plate, time.perf_counter() - start)
+
+            batcher = OCRBatcher(manager)
+            start = time.perf_counter()
+            together = [text for frame in frames for text in batcher.recognize(frame)]
+            batched = min(batched, time.perf_counter() - start)
+    finally:
+        ocr.model_manager = previous
+    return {'characters': characters, 'per_plate': characters / per_plate,
+            'batched': characters / batched, 'per_plate_calls': sum(found for found, _ in plates),
+            'batched_calls': batcher.calls, 'same': single == together}
+
+
+def load_test_images(path=PATH_TEST):
+    """Function that loads the positive and negative test crops
+
+    Args:
+        path (path object): directory with the *_pos_test and *_neg_test images
+
+    Returns:
+        list of tuples: file name, image and plate string of every crop, the plate
+            string is None for the negative crops
+    """
+    names = sorted(name for name in os.listdir(path)
+                   if name.split('.')[0].endswith(('_pos_test', '_neg_test')))
+    return [(name, cv2.imread(str(path / name)), TEST_PLATES.get(name)) for name in names]
+
+
+def profile(images, manager, batch_size=1, repeat=3):
+    """Function that times every OCR stage on the test crops and scores the reads
+
+    Args:
+        images (list of tuples): file name, image and plate string of every crop,
+            as returned by load_test_images
+        manager (ModelManager): model to recognize the characters with
+        batch_size (int): number of plates whose characters are recognized together
+        repeat (int): number of runs, the fastest time of every stage counts
+
+    Returns:
+        dict: batch size, mean milliseconds of every stage per crop, characters and
+            plates per second, string accuracy on the positive crops, false positive
+            rate on the negative ones, and the read string and times of every crop
+
+    Notes:
+        find_characters gets the preprocessed crop, so preprocess_image is not
+        counted twice. The time of a batch is split evenly over its plates.
+    """
+    times = np.full((len(images), len(STAGES)), np.inf)
+    batcher = OCRBatcher(manager)
+    previous, ocr.model_manager = ocr.model_manager, manager
+    try:
+        manager.get()
+        for _ in range(repeat):
+            found = []
+            for index, (_, img, _) in enumerate(images):
+                start = time.perf_counter()
+                processed = ocr.preprocess_image(img)
+                middle = time.perf_counter()
+                char_found, chars, _ = ocr.find_characters(img, processed)
+                end = time.perf_counter()
+                found.append((char_found, chars))
+                times[index, :2] = np.minimum(times[index, :2], [middle - start, end - middle])
+            read = []
+            for first in range(0, len(images), batch_size):
+                start = time.perf_counter()
+                read += batcher.recognize(found[first:first + batch_size])
+                seconds = (time.perf_counter() - start) / len(found[first:first + batch_size])
+                times[first:first + batch_size, 2] = np.minimum(
+                    times[first:first + batch_size, 2], seconds)
+    finally:
+        ocr.model_manager = previous
+    truths = [truth for _, _, truth in images]
+    positives = [text == truth for text, truth in zip(read, truths) if truth is not None]
+    negatives = [text != ocr.NOT_DETECTED for text, truth in zip(read, truths) if truth is None]
+    total = times.sum()
+    characters = sum(len(chars) for char_found, chars in found if char_found)
+    return {'batch_size': batch_size,
+            'stages': dict(zip(STAGES, (times.mean(axis=0) * 1000).tolist())),
+            'chars_per_second': characters / total, 'plates_per_second': len(images) / total,
+            'string_accuracy': float(np.mean(positives)) if positives else None,
+            'false_positive_rate': float(np.mean(negatives)) if negatives else None,
+            'crops': [{'name': name, 'truth': truth, 'read': text,
+                       **dict(zip(STAGES, (crop_times * 1000).tolist()))}
+                      for (name, _, truth), text, crop_times in zip(images, read, times)]}
+
+
+def sweep(images, managers, batch_sizes, repeat=3):
+    """Function that profiles every combination of backend and batch size
+
+    Args:
+        images (list of tuples): test crops, as returned by load_test_images
+        managers (dict): ModelManager of every backend name
+        batch_sizes (list of int): numbers of plates recognized together
+        repeat (int): number of runs of every combination
+
+    Returns:
+        dict: environment of the run and the results of profile, with the backend
+            and the load metrics of its model
+    """
+    results = []
+    for backend, manager in managers.items():
+        for batch_size in batch_sizes:
+            result = profile(images, manager, batch_size, repeat)
+            results.append({'backend': backend, 'metrics': dict(manager.metrics), **result})
+    return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'opencv': cv2.__version__, 'machine': platform.machine(),
+            'images': len(images), 'results': results}
+
+
+def compare(baseline, current, tolerance=0.1):
+    """Function that finds the regressions of a sweep against an earlier one
+
+    Args:
+        baseline (dict): earlier sweep, as returned by sweep
+        current (dict): new sweep
+        tolerance (float): relative slowdown that is still accepted, e.g. 0.1 for 10%
+
+    Returns:
+        list of strings: description of every regression, empty if there is none
+
+    Notes:
+        Results are matched by backend and batch size, combinations missing in
+        either sweep are skipped. Any drop of the string accuracy and any rise of
+        the false positive rate counts, since they do not depend on the machine load.
+    """
+    earlier = {(result['backend'], result['batch_size']): result
+               for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        key = (result['backend'], result['batch_size'])
+        if key not in earlier:
+            continue
+        before, name = earlier[key], f'{key[0]} batch {key[1]}'
+        for metric in ('chars_per_second', 'plates_per_second'):
+            if result[metric] < before[metric] * (1 - tolerance):
+                regressions.append(f'{name}: {metric} {before[metric]:.1f} -> '
+                                   f'{result[metric]:.1f}')
+        for stage in STAGES:
+            if result['stages'][stage] > before['stages'][stage] * (1 + tolerance):
+                regressions.append(f'{name}: {stage} {before["stages"][stage]:.3f} -> '
+                                   f'{result["stages"][stage]:.3f} ms per crop')
+        if None not in (before['string_accuracy'], result['string_accuracy']) and \
+                result['string_accuracy'] < before['string_accuracy']:
+            regressions.append(f'{name}: string accuracy {before["string_accuracy"]:.1%} -> '
+                               f'{result["string_accuracy"]:.1%}')
+        if None not in (before['false_positive_rate'], result['false_positive_rate']) and \
+                result['false_positive_rate'] > before['false_positive_rate']:
+            regressions.append(f'{name}: false positive rate '
+                               f'{before["false_positive_rate"]:.1%} -> '
+                               f'{result["false_positive_rate"]:.1%}')
+    return regressions
+
+
+def run_sweep(args):
+    """Profiles the test crops as given by the command line, see main
+
+    Returns:
+        int: exit code, 1 if the comparison found regressions
+    """
+    if args.random_weights:
+        managers = {'random': random_manager()}
+    else:
+        managers = {backend: ModelManager(Path(args.model), bundle=Path(args.bundle),
+                                          quantized=Path(args.quantized), backend=backend)
+                    for backend in args.backends}
+    report = sweep(load_test_images(), managers, args.batch_sizes, args.repeat)
+    print(f'{"backend":8s} {"batch":>5s} ' + ' '.join(f'{stage:>20s}' for stage in STAGES) +
+          f' {"chars/s":>8s} {"plates/s":>8s} {"accuracy":>8s} {"fp rate":>8s}')
+    for result in report['results']:
+        rates = ['-' if result[rate] is None else f'{result[rate]:.1%}'
+                 for rate in ('string_accuracy', 'false_positive_rate')]
+        print(f'{result["backend"]:8s} {result["batch_size"]:5d} ' +
+              ' '.join(f'{result["stages"][stage]:17.3f} ms' for stage in STAGES) +
+              f' {result["chars_per_second"]:8.1f} {result["plates_per_second"]:8.1f}'
+              f' {rates[0]:>8s} {rates[1]:>8s}')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            regressions = compare(json.load(file), report, args.tolerance)
+        for regression in regressions:
+            print(f'Regression {regression}')
+        print(f'{len(regressions)} regressions against {args.compare}')
+        return 1 if regressions else 0
+    return 0
+
+
+def main():
+    """Prints the characters per second of both ways to recognize the plates, or runs the sweep
+
+    Returns:
+        int: exit code, 1 if the sweep found regressions
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--plates-per-frame', type=int, default=4,
+                        help='number of plates recognized together')
+    parser.add_argument('--limit', type=int, help='maximum number of plates')
+    parser.add_argument('--repeat', type=int, default=3, help='runs, the fastest counts')
+    parser.add_argument('--random-weights', action='store_true',
+                        help='time the untrained architecture instead of cnn.model')
+    parser.add_argument('--backend', choices=['auto', 'keras', 'numpy', 'tflite'], default='auto',
+                        help='how cnn.model is loaded')
+    parser.add_argument('--sweep', action='store_true',
+                        help='profile the stages on the Test_Bilder crops instead')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8],
+                        help='plates recognized together in the sweep')
+    parser.add_argument('--backends', nargs='+', choices=['keras', 'numpy', 'tflite'],
+                        default=['keras'], help='backends of the sweep')
+    parser.add_argument('--model', default=str(Path(__file__).parent / 'cnn.model'),
+                        help='keras model of the sweep')
+    parser.add_argument('--bundle', default=str(Path(__file__).parent / 'cnn.npz'),
+                        help='NumPy export of the sweep, see numpy_cnn')
+    parser.add_argument('--quantized', default=str(Path(__file__).parent / 'cnn_int8.tflite'),
+                        help='int8 model of the sweep, see quantize')
+    parser.add_argument('--json', help='file the sweep is saved to')
+    parser.add_argument('--compare', help='earlier sweep to find regressions against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative slowdown that is not a regression')
+    args = parser.parse_args()
+    if args.sweep:
+        return run_sweep(args)
+    manager = random_manager() if args.random_weights else ModelManager(backend=args.backend)
+    result = measure(load_plates(limit=args.limit), args.plates_per_frame, manager, args.repeat)
+    print(f'{result["characters"]} characters, {args.plates_per_frame} plates per frame')
+    print(f'per plate: {result["per_plate"]:8.1f} chars/s {result["per_plate_calls"]:5d} calls')
+    print(f'batched:   {result["batched"]:8.1f} chars/s {result["batched_calls"]:5d} calls')
+    print('same strings' if result['same'] else 'strings differ')
+    metrics = manager.metrics
+    if metrics['load_seconds'] is not None:
+        print(f'{metrics["backend"]} model loaded in {metrics["load_seconds"]:.2f} s, '
+              f'{metrics["memory_bytes"] / 2 ** 20:.0f} MB')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
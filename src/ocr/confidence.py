@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+"""Counts how often every plate string was read, within a window of frames or seconds"""
+from collections import deque
+import threading
+import time
+
+# Number of times the same string has to be detected, till the plate gets saved as detected
+CONFIDENCE_LVL = 3
+# Number of frames a sighting is counted by the stages of a video stream, about five seconds
+CONFIDENCE_WINDOW = 150
+
+
+class PlateConfidence():
+    """Confirms a plate string on its Nth sighting within the window.
+
+    Every sighting is counted in a dictionary and queued with its frame and
+    time, so adding a sighting and evicting the ones that left the window take
+    constant time. Without a window nothing is queued, only one count per
+    string is kept, and a string is confirmed exactly once like with the global
+    list it replaces. Every video stream should use its own instance, it can
+    be shared by the threads reading the plates of the stream.
+    """
+
+    def __init__(self, level=CONFIDENCE_LVL, frames=None, seconds=None, clock=time.monotonic):
+        """Starts with no sightings.
+
+        Args:
+            level (int): number of sightings that confirm a plate string
+            frames (int): sightings older than this number of frames are forgotten,
+                None keeps them
+            seconds (float): sightings older than this are forgotten, None keeps them
+            clock (function): returns the current time in seconds
+        """
+        self.level = level
+        self.frames = frames
+        self.seconds = seconds
+        self.clock = clock
+        self.frame = 0  # latest frame, see next_frame
+        self.counts = {}
+        self.total = 0  # number of sightings in the window
+        # frame, time and plate string of every sighting, only kept with a window
+        self.sightings = deque()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Returns the number of sightings in the window"""
+        return self.total
+
+    def next_frame(self):
+        """Starts the next frame and forgets the sightings that left the window
+
+        Returns:
+            int: number of the new frame
+        """
+        with self._lock:
+            self.frame += 1
+            self._evict()
+            return self.frame
+
+    def add(self, plate_name, frame=None):
+        """Counts a sighting of a plate string
+
+        Args:
+            plate_name (str): string of detected Plate Text
+            frame (int): frame the plate was read from, e.g. when it was read
+                asynchronously, None is the latest frame
+
+        Returns:
+            bool: If this sighting confirms the plate string
+        """
+        with self._lock:
+            frame = self.frame if frame is None else frame
+            if self.frames is not None and frame <= self.frame - self.frames:
+                # read so late, that it already left the window
+                return False
+            if self.frames is not None or self.seconds is not None:
+                self._evict()
+                self.sightings.append((frame, self.clock(), plate_name))
+            self.counts[plate_name] = self.counts.get(plate_name, 0) + 1
+            self.total += 1
+            return self.counts[plate_name] == self.level
+
+    def count(self, plate_name):
+        """Returns the number of sightings of a plate string in the window"""
+        return self.counts.get(plate_name, 0)
+
+    def clear(self):
+        """Forgets every sighting"""
+        with self._lock:
+            self.counts.clear()
+            self.sightings.clear()
+            self.total = 0
+
+    def _evict(self):
+        """Forgets the sightings that are older than the window
+
+        Notes:
+            Plates read asynchronously can be added slightly out of order, a late
+            one then waits till the sightings in front of it are evicted.
+        """
+        now = self.clock()
+        while self.sightings:
+            frame, seen, plate_name = self.sightings[0]
+            if not (self.frames is not None and frame <= self.frame - self.frames or
+                    self.seconds is not None and seen <= now - self.seconds):
+                return
+            self.sightings.popleft()
+            self.total -= 1
+            self.counts[plate_name] -= 1
+            if not self.counts[plate_name]:
+                del self.counts[plate_name]
@@ -68,8 +68,10 @@ def read_dataset(path):
     """
 
     training_data, x_train, y_train = [], [], []
-    for folder, _, filenames in os.walk(path):
-        for file in filenames:
+    for folder, folders, filenames in os.walk(path):
+        # the walk order depends on the file system, the shuffle has to start from the same one
+        folders.sort()
+        for file in sorted(filenames):
             processed = preprocess_image(cv2.imread(str(Path(folder, file))))
             processed = cv2.resize(processed, (28, 28))
             training_data.append([processed, int(os.path.basename(folder))])
@@ -84,29 +86,15 @@ def read_dataset(path):
     return x_train, y_train
 
 
-def create_model(name_path, epoch=5):
-    """This function creates a Convolutional Neural Network based
+def build_model(classes):
+    """This function builds the untrained Convolutional Neural Network
 
     Args:
-        name_path (str): String path where model should be saved to
-        epoch (int): Amount of Epochs on which the model should be trained
+        classes (int): number of output classes
 
-    Note:
-    The CNN is highly based on the following:
-    https://www.kaggle.com/cdeotte/25-million-images-0-99757-mnist
-    This CNN has the best score for the MNIST dataset a set
-    that contains handwritten digits. I modified it slightly
-    to predict more than 10 classes and trained it on
-    the EMNIST dataset which includes handwritten digits and
-    letters (in total 47 Classes) . There it scored a performance of
-    above 95 %. Thats why i choose this model to try and predict
-    my 36 classes.
+    Returns:
+        keras Sequential model
     """
-    path = Path(__file__).parent
-    # creating Data for training
-    generate_data(path / 'Training_Data', path / 'Synthetic_Data', 3000)
-    x_train, y_train = read_dataset(path / 'Synthetic_Data')
-
     model = Sequential()
 
     model.add(Conv2D(64, kernel_size=3, activation='relu', input_shape=(28, 28, 1)))
@@ -129,7 +117,35 @@ def create_model(name_path, epoch=5):
     model.add(BatchNormalization())
     model.add(Flatten())
     model.add(Dropout(0.4))
-    model.add(Dense(len(y_train), activation='softmax'))
+    model.add(Dense(classes, activation='softmax'))
+
+    return model
+
+
+def create_model(name_path, epoch=5):
+    """This function creates a Convolutional Neural Network based
+
+    Args:
+        name_path (str): String path where model should be saved to
+        epoch (int): Amount of Epochs on which the model should be trained
+
+    Note:
+    The CNN is highly based on the following:
+    https://www.kaggle.com/cdeotte/25-million-images-0-99757-mnist
+    This CNN has the best score for the MNIST dataset a set
+    that contains handwritten digits. I modified it slightly
+    to predict more than 10 classes and trained it on
+    the EMNIST dataset which includes handwritten digits and
+    letters (in total 47 Classes) . There it scored a performance of
+    above 95 %. Thats why i choose this model to try and predict
+    my 36 classes.
+    """
+    path = Path(__file__).parent
+    # creating Data for training
+    generate_data(path / 'Training_Data', path / 'Synthetic_Data', 3000)
+    x_train, y_train = read_dataset(path / 'Synthetic_Data')
+
+    model = build_model(len(y_train))
 
     model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
 
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""Normalization of character images straight into preallocated CNN input buffers"""
+import threading
+from cv2 import cv2
+import numpy as np
+
+# side length of the CNN input and the border added around every character
+GLYPH_SIZE = 28
+BORDER = 7
+
+
+class GlyphWriter():
+    """Pads and resizes characters into a buffer, without allocating per character.
+
+    cv2.copyMakeBorder pads the character into the front of a reusable canvas
+    and cv2.resize writes into the buffer, so the pixels are the same as of
+    ocr.prepare_characters. The canvas only grows for characters larger than
+    any before.
+    """
+
+    def __init__(self, size=GLYPH_SIZE, border=BORDER, max_char=(64, 64)):
+        """Allocates the canvas
+
+        Args:
+            size (int): side length of the normalized characters
+            border (int): black pixels added on every side before resizing
+            max_char (tuple): height and width of the largest expected character
+        """
+        self.size = size
+        self.border = border
+        # flat, so every padded size is a contiguous view of its front
+        self.canvas = np.empty((max_char[0] + 2 * border) * (max_char[1] + 2 * border), np.uint8)
+
+    def write(self, char, out):
+        """Writes the normalized character into out
+
+        Args:
+            char (2d numpy array): detected character
+            out (2d numpy array): contiguous uint8 array of size x size, e.g. a glyph
+                of a batch buffer
+        """
+        border = self.border
+        height, width = char.shape[0] + 2 * border, char.shape[1] + 2 * border
+        if height * width > len(self.canvas):
+            self.canvas = np.empty(height * width, np.uint8)
+        padded = self.canvas[:height * width].reshape(height, width)
+        cv2.copyMakeBorder(char, border, border, border, border, cv2.BORDER_CONSTANT,
+                           dst=padded, value=0)
+        cv2.resize(padded, (self.size, self.size), dst=out)
+
+
+class GlyphPool():
+    """Batch buffer and GlyphWriter of every thread.
+
+    Every thread normalizes into its own buffer, which grows to the largest
+    batch it has seen, so reading plates does not allocate in steady state.
+    """
+
+    def __init__(self, size=GLYPH_SIZE):
+        """Starts without buffers
+
+        Args:
+            size (int): side length of the normalized characters
+        """
+        self.size = size
+        self._local = threading.local()
+
+    def tensor(self, chars):
+        """Normalizes characters into the buffer of the calling thread
+
+        Args:
+            chars (list of numpy arrays): detected characters
+
+        Returns:
+            4d numpy array: uint8 view with shape (len(chars), size, size, 1), only
+                valid till the thread calls tensor again
+        """
+        local = self._local
+        if not hasattr(local, 'writer'):
+            local.writer = GlyphWriter(self.size)
+            local.buffer = np.zeros((8, self.size, self.size, 1), np.uint8)
+        if len(chars) > len(local.buffer):
+            local.buffer = np.zeros((2 * len(chars), self.size, self.size, 1), np.uint8)
+        for index, char in enumerate(chars):
+            local.writer.write(char, local.buffer[index, :, :, 0])
+        return local.buffer[:len(chars)]
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+"""Lazy loading of the character CNN, shared by every user of a process"""
+import os
+from pathlib import Path
+import resource
+import threading
+import time
+import numpy as np
+from src.ocr.numpy_cnn import NumpyCNN
+from src.ocr.tflite_cnn import QUANTIZED, TFLiteCNN
+
+
+def resident_memory():
+    """Returns the resident memory of the process in bytes
+
+    Notes:
+        Reads /proc on Linux, elsewhere the peak resident memory is returned.
+    """
+    try:
+        with open('/proc/self/statm', encoding='ascii') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ModelManager():  # pylint: disable=R0902
+    """Loads the CNN on first use and shares it between all threads of a process.
+
+    Importing the OCR no longer pays for TensorFlow and the model, only the
+    first plate that is read does. A warm-up prediction builds the prediction
+    graph right after loading, so the first real plate is not slower than the
+    others. Without TensorFlow the NumPy export of the model is loaded instead,
+    the int8 model written by quantize is only loaded on request. Both can be
+    loaded before the process is forked, see preload.
+    """
+
+    def __init__(self, path=Path(__file__).parent / 'cnn.model',  # pylint: disable=R0913
+                 warm_up=True, model=None, bundle=Path(__file__).parent / 'cnn.npz',
+                 backend='auto', quantized=QUANTIZED):
+        """Stores where the model is loaded from, nothing is loaded yet.
+
+        Args:
+            path (path object): path to the saved keras model
+            warm_up (bool): If a warm-up prediction runs right after loading
+            model (keras model): model that is already loaded, e.g. an untrained
+                one for benchmarks. None loads the model from path.
+            bundle (path object): path to the NumPy export of the model, see numpy_cnn
+            backend (str): 'keras', 'numpy', 'tflite' for the quantized model or 'auto',
+                which uses keras if TensorFlow is installed
+            quantized (path object): path to the int8 TFLite model, see quantize
+        """
+        if backend not in ('auto', 'keras', 'numpy', 'tflite'):
+            raise ValueError(f'Unknown backend {backend}')
+        self.path = path
+        self.warm_up = warm_up
+        self.bundle = bundle
+        self.backend = backend
+        self.quantized = quantized
+        self._model = model
+        self._warmed = False
+        self._pid = os.getpid()  # process the model belongs to
+        self._lock = threading.Lock()
+        self.metrics = {'load_seconds': None, 'warm_up_seconds': None,
+                        'memory_bytes': None, 'parameters': None, 'backend': None}
+
+    @property
+    def loaded(self):
+        """bool: If the model is loaded in this process"""
+        return self._model is not None
+
+    def get(self):
+        """Returns the model, it is loaded by the first call
+
+        Returns:
+            keras model: the character CNN
+        """
+        if self._model is None or not self._warmed or self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._forked()
+                # another thread may have loaded it while this one waited
+                if self._model is None:
+                    self._load()
+                if not self._warmed:
+                    self._warm()
+        return self._model
+
+    def predict(self, tensor):
+        """Predicts the classes of a batch of characters
+
+        Args:
+            tensor (4d numpy array): characters with shape (n, 28, 28, 1)
+
+        Returns:
+            2d numpy array: probabilities of every class for every character
+        """
+        return self.get().predict(tensor)
+
+    def predict_batch(self, tensor):
+        """Predicts a batch of characters with a single call of the compiled model
+
+        Args:
+            tensor (4d numpy array): characters with shape (n, 28, 28, 1)
+
+        Returns:
+            2d numpy array: probabilities of every class for every character
+
+        Notes:
+            Unlike predict, no dataset is built around the tensor. The model is
+            traced once per batch size, so the batch sizes should come from a
+            small set.
+        """
+        return np.asarray(self.get().predict_on_batch(tensor))
+
+    def preload(self):
+        """Loads the model without predicting, e.g. before the first frame is read
+
+        Returns:
+            dict: the load metrics
+
+        Notes:
+            The NumPy and the int8 backend can be preloaded before worker
+            processes are forked, the children share the weights of the parent
+            copy-on-write instead of loading their own. The keras backend
+            imports TensorFlow, which starts threads, so a process should not be
+            forked after it was preloaded. Start its workers with the spawn
+            method instead, e.g. multiprocessing.get_context('spawn'), every
+            process then loads and warms up its own copy on its first use.
+        """
+        with self._lock:
+            if self._model is None:
+                self._load()
+        return self.metrics
+
+    def _load(self):
+        """Imports TensorFlow and loads the model, or loads the NumPy export or the int8 model"""
+        memory = resident_memory()
+        start = time.perf_counter()
+        backend = self.backend
+        if backend == 'tflite':
+            self._model = TFLiteCNN(self.quantized)
+        elif backend != 'numpy':
+            try:
+                # TensorFlow is only imported when the first plate is read
+                import tensorflow.keras.models as tf  # pylint: disable=C0415
+            except ImportError:
+                if backend == 'keras':
+                    raise
+                backend = 'numpy'
+            else:
+                self._model = tf.load_model(self.path)
+                backend = 'keras'
+        if backend == 'numpy':
+            self._model = NumpyCNN(self.bundle)
+        self.metrics['backend'] = backend
+        self.metrics['load_seconds'] = time.perf_counter() - start
+        self.metrics['memory_bytes'] = resident_memory() - memory
+        self.metrics['parameters'] = self._model.count_params()
+
+    def _forked(self):
+        """Takes over the model that was loaded before the process was forked"""
+        self._pid = os.getpid()
+        if self.metrics['backend'] == 'numpy':
+            # plain arrays, they stay shared with the parent until they are written to
+            return
+        if self.metrics['backend'] == 'tflite':
+            self._model = self._model.copy()
+        self._warmed = False
+
+    def _warm(self):
+        """Runs a prediction on an empty character, which builds the prediction graph"""
+        self._warmed = True
+        if not self.warm_up:
+            return
+        start = time.perf_counter()
+        self._model.predict(np.zeros((1, 28, 28, 1), dtype=np.uint8))
+        self.metrics['warm_up_seconds'] = time.perf_counter() - start
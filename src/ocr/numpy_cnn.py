@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+"""Inference of the character CNN with NumPy only, for machines without TensorFlow
+
+Export the trained model with: python -m src.ocr.numpy_cnn [cnn.model] [cnn.npz]
+"""
+import argparse
+import json
+from pathlib import Path
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+def export(model, path):
+    """Function that saves the weights of a keras model as NumPy bundle
+
+    Args:
+        model (keras Sequential): model made of Conv2D, BatchNormalization, Dropout,
+            Flatten and Dense layers, like generate_cnn.build_model
+        path (path object): path of the npz file
+
+    Notes:
+        The batch normalization is saved as scale and shift of its inference, Dropout
+        is left out, since it does nothing during inference.
+    """
+    layers, arrays = [], {}
+    for layer in model.layers:
+        kind, config = type(layer).__name__, layer.get_config()
+        prefix = str(len(layers))
+        if kind == 'Conv2D':
+            kernel, bias = layer.get_weights()
+            layers.append({'type': 'conv', 'strides': config['strides'][0],
+                           'padding': config['padding'], 'activation': config['activation']})
+            arrays.update({prefix + '_kernel': kernel, prefix + '_bias': bias})
+        elif kind == 'BatchNormalization':
+            gamma, beta, mean, variance = layer.get_weights()
+            scale = gamma / np.sqrt(variance + config['epsilon'])
+            layers.append({'type': 'batch_norm'})
+            arrays.update({prefix + '_scale': scale, prefix + '_shift': beta - mean * scale})
+        elif kind == 'Dense':
+            kernel, bias = layer.get_weights()
+            layers.append({'type': 'dense', 'activation': config['activation']})
+            arrays.update({prefix + '_kernel': kernel, prefix + '_bias': bias})
+        elif kind == 'Flatten':
+            layers.append({'type': 'flatten'})
+        elif kind != 'Dropout':
+            raise ValueError(f'Layer {kind} can not be exported')
+    arrays = {name: array.astype(np.float32) for name, array in arrays.items()}
+    np.savez(path, layers=np.array(json.dumps(layers)), **arrays)
+
+
+def pad_same(tensor, kernel_size, stride):
+    """Function that pads a tensor like the 'same' padding of keras
+
+    Args:
+        tensor (4d numpy array): input with shape (n, height, width, channels)
+        kernel_size (int): size of the square kernel
+        stride (int): stride of the convolution
+
+    Returns:
+        4d numpy array: zero padded input, for odd padding the extra row and column
+            are added at the bottom and right, as TensorFlow does
+    """
+    padding = []
+    for size in tensor.shape[1:3]:
+        total = max((-(-size // stride) - 1) * stride + kernel_size - size, 0)
+        padding.append((total // 2, total - total // 2))
+    return np.pad(tensor, [(0, 0)] + padding + [(0, 0)])
+
+
+def conv2d(tensor, kernel, bias, stride=1, padding='valid'):
+    """Function that computes a 2d convolution as one matrix multiplication
+
+    Args:
+        tensor (4d numpy array): input with shape (n, height, width, channels)
+        kernel (4d numpy array): keras kernel with shape (size, size, channels, filters)
+        bias (1d numpy array): bias of every filter
+        stride (int): stride of the convolution
+        padding (str): 'valid' or 'same', as in keras
+
+    Returns:
+        4d numpy array: output with shape (n, height, width, filters)
+    """
+    size = kernel.shape[0]
+    if padding == 'same':
+        tensor = pad_same(tensor, size, stride)
+    tensor = np.ascontiguousarray(tensor)
+    count, height, width, channels = tensor.shape
+    out_height, out_width = (height - size) // stride + 1, (width - size) // stride + 1
+    step = tensor.strides
+    # view of every kernel window, copied into a matrix by the reshape
+    windows = as_strided(tensor, (count, out_height, out_width, size, size, channels),
+                         (step[0], step[1] * stride, step[2] * stride, step[1], step[2], step[3]))
+    columns = windows.reshape(count * out_height * out_width, size * size * channels)
+    output = columns @ kernel.reshape(-1, kernel.shape[-1]) + bias
+    return output.reshape(count, out_height, out_width, kernel.shape[-1])
+
+
+def activate(tensor, activation):
+    """Function that applies a keras activation by name, 'relu', 'softmax' or 'linear'"""
+    if activation == 'relu':
+        return np.maximum(tensor, 0)
+    if activation == 'softmax':
+        exp = np.exp(tensor - tensor.max(axis=-1, keepdims=True))
+        return exp / exp.sum(axis=-1, keepdims=True)
+    if activation == 'linear':
+        return tensor
+    raise ValueError(f'Activation {activation} is not supported')
+
+
+class NumpyCNN():
+    """Character CNN loaded from a NumPy bundle written by export.
+
+    Has the predict methods of a keras model that the OCR uses, so the
+    ModelManager can hand it out instead. Loading it needs neither
+    TensorFlow nor its memory.
+    """
+
+    def __init__(self, path):
+        """Loads the bundle
+
+        Args:
+            path (path object): path of the npz file
+        """
+        with np.load(path) as bundle:
+            self.layers = json.loads(str(bundle['layers']))
+            self.arrays = {name: bundle[name] for name in bundle.files if name != 'layers'}
+
+    def predict(self, tensor):
+        """Predicts the classes of a batch of characters
+
+        Args:
+            tensor (4d numpy array): characters with shape (n, 28, 28, 1)
+
+        Returns:
+            2d numpy array: probabilities of every class for every character
+        """
+        tensor = np.asarray(tensor, dtype=np.float32)
+        for index, layer in enumerate(self.layers):
+            prefix = str(index)
+            if layer['type'] == 'conv':
+                tensor = conv2d(tensor, self.arrays[prefix + '_kernel'],
+                                self.arrays[prefix + '_bias'], layer['strides'], layer['padding'])
+                tensor = activate(tensor, layer['activation'])
+            elif layer['type'] == 'batch_norm':
+                tensor = tensor * self.arrays[prefix + '_scale'] + self.arrays[prefix + '_shift']
+            elif layer['type'] == 'flatten':
+                tensor = tensor.reshape(len(tensor), -1)
+            else:
+                tensor = tensor @ self.arrays[prefix + '_kernel'] + self.arrays[prefix + '_bias']
+                tensor = activate(tensor, layer['activation'])
+        return tensor
+
+    predict_on_batch = predict
+
+    def count_params(self):
+        """Returns the number of weights, the batch normalization counts two per channel"""
+        return sum(array.size for array in self.arrays.values())
+
+
+def main():
+    """Exports the trained keras model as NumPy bundle"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('model', nargs='?', default=str(Path(__file__).parent / 'cnn.model'),
+                        help='path of the keras model')
+    parser.add_argument('bundle', nargs='?', default=str(Path(__file__).parent / 'cnn.npz'),
+                        help='path of the npz file')
+    args = parser.parse_args()
+    import tensorflow.keras.models as tf  # pylint: disable=C0415
+    export(tf.load_model(args.model), args.bundle)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,19 +2,28 @@
 
 """OCR Module for detecting Characters on License plates"""
 import bisect
-from collections import Counter
 from pathlib import Path
 import re
 from cv2 import cv2
 import numpy as np
-import tensorflow.keras.models as tf
+from src.ocr.confidence import CONFIDENCE_LVL, PlateConfidence
+from src.ocr.glyphs import GlyphPool
+from src.ocr.model_manager import ModelManager
 
 # declaring variables
-detected_plates = []
+# sightings of the plate strings, for callers that do not pass their own PlateConfidence
+confidence = PlateConfidence(CONFIDENCE_LVL)
 german_np = re.compile(r'^[A-Z]{1,5}\d{1,4}[EH]?$')
-model = tf.load_model(Path(__file__).parent / 'cnn.model')
-# Number of times the same string has to be detected, till the plate gets saved as detected
-CONFIDENCE_LVL = 3
+# the CNN is loaded when the first plate is read, not on import
+model_manager = ModelManager(Path(__file__).parent / 'cnn.model')
+# input buffers of the CNN, one per thread
+glyph_pool = GlyphPool()
+# 0-9, A-Z and the 37 class for german TÜV and state sign
+MAP_LEGEND = np.array(['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B',
+                       'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N',
+                       'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z',
+                       ''])
+NOT_DETECTED = 'Could not be detected'
 
 
 def cutout(img, position):
@@ -50,11 +59,174 @@ def preprocess_image(img):
     return thresh
 
 
-def find_characters(img):
+def find_characters(img, processed_img=None):
     """Function that singles out characters in a given image of a license plate
         and returns a list of the character images
     Args:
         img (3d numpy array): Input Image
+        processed_img (2d numpy array): img after preprocess_image(img), e.g. a view
+            into the threshold of a FrameContext. None preprocesses img.
+
+    Returns:
+        Bool: If there is a sufficient amount of characters detected
+        characters (list): list of single characters images detected on the input image
+        img (3d numpy array): input image
+
+    Notes:
+        The function uses Multiple filters to find the characters, it assumes
+        that bounding boxes must have a similar height and y coordinate. If
+        less than 3 character boxes for fill this requirement, than the Image cant
+        be recognized correctly anymore, since european plates have at least 3 characters.
+        The filters also gets rid of most images, who do not show a license plate. Most
+        of the assumptions in this function where fine tuned during the labeling of
+        the dataset. The boxes of all contours are filtered at once with numpy, the
+        result is the same as of find_characters_per_contour.
+    """
+    if processed_img is None:
+        processed_img = preprocess_image(img)
+    height, width = processed_img.shape
+
+    contours, hierarchy = cv2.findContours(processed_img, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    # filter boxes inside of characters, e.g. the hole in the number 6
+    contours = [contours[i] for i in np.flatnonzero(hierarchy[0][:, 3] == -1)] \
+        if contours else []
+    boxes = contour_boxes(contours)
+    # assumption box can only be rectangular and some size asumptions
+    x_p, y_p, wid, hei = boxes.T
+    candidates = np.flatnonzero((hei > wid) & (wid > width / 32) & (hei > height / 5))
+    # filter really small boxes, the area is only needed for the few candidates
+    area = np.array([cv2.contourArea(contours[i]) for i in candidates])
+    boxes = boxes[candidates[area > 25]] if len(candidates) else boxes[:0]
+    boxes = boxes[~filter_blue_boxes(img, boxes)]
+    # stable, so boxes with the same x stay in the order of their contours like bisect
+    boxes = boxes[np.argsort(boxes[:, 0], kind='stable')]
+
+    boxes = filter_character_boxes(boxes, height)
+    if boxes is None:
+        return False, 'Not enough Characters detected', img
+    return True, [processed_img[y_p: y_p + hei, x_p: x_p + wid]
+                  for x_p, y_p, wid, hei in boxes.tolist()], img
+
+
+def contour_boxes(contours):
+    """Function that computes the bounding boxes of all contours at once
+
+    Args:
+        contours (list of numpy arrays): contours as returned by cv2.findContours
+
+    Returns:
+        2d numpy array: x, y, width, height of every contour, like cv2.boundingRect
+    """
+    if not contours:
+        return np.zeros((0, 4), dtype=int)
+    starts = np.zeros(len(contours), dtype=int)
+    np.cumsum([len(cnt) for cnt in contours[:-1]], out=starts[1:])
+    points = np.concatenate(contours).reshape(-1, 2)
+    x_c, y_c = points[:, 0], points[:, 1]
+    left, top = np.minimum.reduceat(x_c, starts), np.minimum.reduceat(y_c, starts)
+    return np.stack([left, top, np.maximum.reduceat(x_c, starts) - left + 1,
+                     np.maximum.reduceat(y_c, starts) - top + 1], axis=1)
+
+
+def filter_blue_boxes(img, boxes):
+    """Function that applies filter_blue to the cut outs of all boxes at once
+
+    Args:
+        img (3d numpy array): Input Image
+        boxes (2d numpy array): x, y, width, height of every box
+
+    Returns:
+        1d numpy array: If the box contains to much blue, for every box
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=bool)
+    # the integral image only has to cover the boxes
+    left, top = boxes[:, 0].min(), boxes[:, 1].min()
+    integral = cv2.integral(img[top: (boxes[:, 1] + boxes[:, 3]).max(),
+                                left: (boxes[:, 0] + boxes[:, 2]).max()])
+    x_p, y_p, wid, hei = (boxes - [left, top, 0, 0]).T
+    sums = integral[y_p + hei, x_p + wid].astype(np.int64) - integral[y_p, x_p + wid] - \
+        integral[y_p + hei, x_p] + integral[y_p, x_p]
+    blue, green, red = (sums / (wid * hei)[:, None]).T
+    return (blue > 30 + green) & (blue > red + 30)
+
+
+def filter_character_boxes(boxes, height):
+    """Function that applies the filters of find_characters_per_contour to sorted boxes
+
+    Args:
+        boxes (2d numpy array): x, y, width, height of every box, sorted by x
+        height (int): height of the image
+
+    Returns:
+        2d numpy array: boxes of the characters, None if less than 3 are left
+
+    Notes:
+        Does the same as filter_small_boxes, filter_outer_left_right,
+        filter_anomalies and resize_boxes in a row, including when they fail.
+    """
+    if len(boxes) == 0:
+        return None
+    # filter_small_boxes
+    boxes = boxes[boxes[:, 3] >= boxes[:, 3].mean() * 0.8]
+
+    # filter_outer_left_right, both ends are compared with the heights before deleting
+    hei = boxes[:, 3]
+    first = last = False
+    if len(hei) > 1:
+        first = not hei[1:3].mean() - 8 <= hei[0] <= hei[1:3].mean() + 8
+        last = not hei[-3:-1].mean() - 8 <= hei[-1] <= hei[-3:-1].mean() + 8
+    boxes = boxes[int(first):len(boxes) - int(last)]
+
+    # filter_anomalies, assumption that the y coordinate can only change a 5th of the height
+    if len(boxes) < 3:
+        return None
+    y_p = boxes[:, 1]
+    left, right = neighbor_indices(len(boxes))
+    loc_mean = (y_p[left] + y_p[right]) / 2
+    boxes = boxes[(y_p <= loc_mean + height / 5) & (y_p >= loc_mean - height / 5)]
+
+    # resize_boxes
+    if len(boxes) == 0:
+        return None
+    height_mean = int(boxes[:, 3].mean())
+    small = np.flatnonzero(boxes[:, 3] < height_mean * 0.9)
+    if len(small):
+        # with two boxes the first one has no second neighbor, as in closest_neighbors
+        if len(boxes) < 3 and small[0] == 0:
+            return None
+        left, right = neighbor_indices(len(boxes))
+        boxes = boxes.copy()
+        boxes[small, 1] = ((boxes[left[small], 1] + boxes[right[small], 1]) / 2).astype(int)
+        boxes[small, 3] = height_mean
+
+    return boxes if len(boxes) > 2 else None
+
+
+def neighbor_indices(length):
+    """Function that returns the indexes of the two closest neighbors of every element
+
+    Args:
+        length (int): length of array
+
+    Returns:
+        two 1d numpy arrays: the first and second neighbor of every index, like
+            closest_neighbors
+    """
+    index = np.arange(length)
+    left, right = index - 1, index + 1
+    left[-1], right[-1] = length - 2, length - 3
+    left[0], right[0] = 1, 2
+    return left, right
+
+
+def find_characters_per_contour(img, processed_img=None):
+    """Function that singles out characters in a given image of a license plate
+        contour by contour, the reference of find_characters
+    Args:
+        img (3d numpy array): Input Image
+        processed_img (2d numpy array): img after preprocess_image(img), e.g. a view
+            into the threshold of a FrameContext. None preprocesses img.
 
     Returns:
         Bool: If there is a sufficient amount of characters detected
@@ -72,7 +244,8 @@ def find_characters(img):
     """
     characters, location = [], []
     # org_img = np.copy(img)
-    processed_img = preprocess_image(img)
+    if processed_img is None:
+        processed_img = preprocess_image(img)
     height, width = processed_img.shape
 
     contours, hierarchy = cv2.findContours(processed_img, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
@@ -210,6 +383,35 @@ def resize_boxes(location, processed_img, characters):
                 processed_img[y_mean: y_mean + height_mean, x_p[i][0]: x_p[i][0] + width[i][0]]
 
 
+def prepare_characters(chars):
+    """Function that brings detected Characters into the input format of the CNN
+
+    Args:
+        chars (list of numpy arrays): detected characters
+
+    Returns:
+        list of 2d numpy arrays: 28x28 character images with a border
+
+    Notes:
+        Allocates every image, the OCR normalizes into reused buffers with
+        glyphs.GlyphWriter instead, which gives the same pixels.
+    """
+    return [cv2.resize(cv2.copyMakeBorder(char, 7, 7, 7, 7, 0), (28, 28)) for char in chars]
+
+
+def decode(predictions):
+    """Function that turns the CNN predictions of the characters of a plate into its string
+
+    Args:
+        predictions (2d numpy array): class probabilities of every character
+
+    Returns:
+        string: the characters with the highest probabilities
+    """
+    index = [np.argmax(pre) for pre in predictions]
+    return ''.join(MAP_LEGEND[index])
+
+
 def recognize_characters(char_found, chars):
     """Function that recognizes detected Characters
 
@@ -222,21 +424,12 @@ def recognize_characters(char_found, chars):
     """
 
     if char_found:
-        characters = \
-            [cv2.resize(cv2.copyMakeBorder(char, 7, 7, 7, 7, 0), (28, 28)) for char in chars]
+        # the characters are normalized into the tensor, see prepare_characters
+        tensor = glyph_pool.tensor(chars)
+        predictions = model_manager.predict(tensor)
+        return decode(predictions)
 
-        # 0-9, A-Z and the 37 class for german TÜV and state sign
-        map_legend = np.array(['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B',
-                               'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N',
-                               'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z',
-                               ''])
-        # reshaping character images into tensor
-        tensor = np.asarray(characters).reshape((len(characters), 28, 28, 1))
-        predictions = model.predict(tensor)
-        index = [np.argmax(pre) for pre in predictions]
-        return ''.join(map_legend[index])
-
-    return 'Could not be detected'
+    return NOT_DETECTED
 
 
 def filter_small_boxes(location, characters):
@@ -257,7 +450,9 @@ def filter_small_boxes(location, characters):
         del characters[i], location[i]
 
 
-def read_numberplate(img, boxes, path=Path(__file__).parent / 'Licenseplates'):
+def read_numberplate(img, boxes,  # pylint: disable=R0913
+                     path=Path(__file__).parent / 'Licenseplates', context=None, store=None,
+                     cache=None, results=None):
     """Bringing everything together, from input frame to a saved plate image with detected
         string name
 
@@ -265,22 +460,51 @@ def read_numberplate(img, boxes, path=Path(__file__).parent / 'Licenseplates'):
         img (numpy 3d array): whole Frame as input Image
         boxes (list of list): list containing bounding boxes for license plates on given frame
         path (path object): path to where the license plate should be saved to
+        context (FrameContext): preprocessing cache of the frame, the plates are cut out
+            of its threshold instead of preprocessing every plate again
+        store (PlateConfidence): sightings of the video stream, None uses the
+            module wide confidence
+        cache (PlateCache): strings of confirmed plates, a plate similar to a cached
+            one is neither read nor counted again until it expires. None reads every plate.
+        results (PlateStore): index the confident plates are saved to with their frame,
+            box and cut out. None writes the cut out to path as <TEXT>.jpg.
+
+     Notes:
+        With a context the threshold is computed on the whole frame, so pixels close to the
+        border of a plate can differ slightly from preprocessing the cut out alone, and with
+        them the boxes of single characters, see test_plate_threshold_parity.
     """
-    path.mkdir(parents=True, exist_ok=True)
+    if results is None:
+        path.mkdir(parents=True, exist_ok=True)
+    store = confidence if store is None else store
+    frame = store.next_frame()
     plates = cutout(img, boxes)
-    for plate in plates:
-        found, characters, schild = find_characters(plate)
+    for i, plate in enumerate(plates):
+        key = cache.key(plate) if cache is not None else None
+        if cache is not None and cache.get(plate, key, frame) is not None:
+            # confirmed before, only plates that were read count as sightings
+            continue
+        processed = context.cutout(boxes[i], 'thresh') if context is not None else None
+        found, characters, schild = find_characters(plate, processed)
         plate_text = recognize_characters(found, characters)
-        if filter_confidence(plate_text) is False:
+        if filter_confidence(plate_text, store) is False:
             continue
-        cv2.imwrite(str(path / plate_text) + '.jpg', schild)
+        if cache is not None:
+            cache.put(plate, plate_text, key, frame)
+        if results is not None:
+            results.add(plate_text, schild, frame, boxes[i])
+        else:
+            cv2.imwrite(str(path / plate_text) + '.jpg', schild)
 
 
-def filter_confidence(plate_name):
+def filter_confidence(plate_name, store=None, frame=None):
     """Filter out strings that are unlikely to be a numberplate
 
        Args:
            plate_name (str): string of detected Plate Text
+           store (PlateConfidence): sightings of the video stream, None uses the
+               module wide confidence
+           frame (int): frame the plate was read from, None is the latest frame of store
 
         Returns:
             bool: if detected plate string is likely to be a real license plate
@@ -291,21 +515,36 @@ def filter_confidence(plate_name):
            is an addition to include a high number of european plates, according
            to https://en.wikipedia.org/wiki/Vehicle_registration_plates_of_Europe.
            Unfortunately this does increase wrong predictions, as a trade off.
-           The CONFIDENCE_LVL determent's how often the same plate string
+           The level of the store determent's how often the same plate string
            has to be detected before it is confident that its correct
        """
+    store = confidence if store is None else store
+    if plausible(plate_name):
+        return store.add(plate_name, frame)
+    return False
 
-    if german_np.match(plate_name) or 6 < len(plate_name) < 9:
-        detected_plates.append(plate_name)
-    plate_count = Counter(detected_plates)
-    return plate_count[plate_name] == CONFIDENCE_LVL
 
+def plausible(plate_name):
+    """Checks if a string is likely to be a numberplate, see filter_confidence
 
-def reset_plates():
-    """Resets detected_plates list
+       Args:
+           plate_name (str): string of detected Plate Text
+
+        Returns:
+            bool: if the string has the syntax of a german plate or the length of
+                most european plates
+       """
+    return bool(german_np.match(plate_name)) or 6 < len(plate_name) < 9
+
+
+def reset_plates(store=None):
+    """Resets the detected plates
+
+    Args:
+        store (PlateConfidence): sightings to forget, None resets the module wide confidence
 
     Notes: This reset is necessary, so the program doesn't have
         to be closed after running once
         """
     print('Process finished')
-    detected_plates.clear()
+    (confidence if store is None else store).clear()
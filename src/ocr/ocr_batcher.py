@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""Batched recognition of the characters of several license plates"""
+import numpy as np
+import src.ocr.ocr as ocr
+from src.ocr.glyphs import GLYPH_SIZE, GlyphWriter
+
+# batch sizes the CNN is called with, so it is only traced for a few shapes
+BUCKETS = (8, 16, 32, 64)
+
+
+class OCRBatcher():
+    """Collects the characters of several plates and recognizes them in one CNN call.
+
+    The characters are normalized straight into a preallocated buffer, which is
+    padded to the next bucket size before the inference. Every call of the CNN costs a
+    fixed overhead and every new batch size a retracing, both are far more
+    expensive than the computation for a few characters.
+    """
+
+    def __init__(self, manager=None, buckets=BUCKETS):
+        """Allocates the buffer for the largest bucket.
+
+        Args:
+            manager (ModelManager): model to recognize the characters with, None uses
+                the model of the ocr module
+            buckets (tuple): batch sizes the CNN is called with, ascending
+        """
+        self.manager = ocr.model_manager if manager is None else manager
+        self.buckets = buckets
+        self.buffer = np.zeros((buckets[-1], GLYPH_SIZE, GLYPH_SIZE, 1), dtype=np.uint8)
+        self.writer = GlyphWriter()
+        self.count = 0  # characters in the buffer
+        self.lengths = []  # number of characters of every added plate, None if not found
+        self.predictions = []  # predictions of the buffers that were already full
+        self.calls = 0  # number of CNN calls
+        # mean probability of the recognized characters of every plate of the last flush
+        self.scores = []
+
+    def add(self, char_found, chars):
+        """Adds the characters of a plate.
+
+        Args:
+            char_found (Bool): True or False if characters where been found
+            chars (list of numpy arrays): detected characters
+
+        Returns:
+            int: index of the plate in the result of flush
+        """
+        if not char_found:
+            self.lengths.append(None)
+            return len(self.lengths) - 1
+        for char in chars:
+            if self.count == len(self.buffer):
+                self._predict()
+            self.writer.write(char, self.buffer[self.count, :, :, 0])
+            self.count += 1
+        self.lengths.append(len(chars))
+        return len(self.lengths) - 1
+
+    def flush(self):
+        """Recognizes the characters of every added plate.
+
+        Returns:
+            list of strings: plate string of every added plate in the order they
+                were added, 'Could not be detected' for plates without characters
+        """
+        if self.count:
+            self._predict()
+        predictions = np.concatenate(self.predictions) if self.predictions else []
+        plates, self.scores, start = [], [], 0
+        for length in self.lengths:
+            if length is None:
+                plates.append(ocr.NOT_DETECTED)
+                self.scores.append(0.0)
+                continue
+            plates.append(ocr.decode(predictions[start:start + length]))
+            self.scores.append(float(predictions[start:start + length].max(axis=1).mean()))
+            start += length
+        self.lengths, self.predictions = [], []
+        return plates
+
+    def recognize(self, plates):
+        """Recognizes several plates in as few CNN calls as possible.
+
+        Args:
+            plates (list of tuples): char_found and chars of every plate, as returned
+                by find_characters
+
+        Returns:
+            list of strings: plate string of every plate
+
+        Notes:
+            The added plates are dropped also if the CNN fails, so the next call
+            does not return their strings.
+        """
+        try:
+            for char_found, chars in plates:
+                self.add(char_found, chars)
+            return self.flush()
+        finally:
+            self.reset()
+
+    def reset(self):
+        """Drops the added plates that were not flushed, the scores of the last flush are kept"""
+        self.count = 0
+        self.lengths, self.predictions = [], []
+
+    def _predict(self):
+        """Runs the CNN on the characters in the buffer, padded to the next bucket"""
+        bucket = next(size for size in self.buckets if size >= self.count)
+        # the padding rows are left over from earlier batches, their predictions are dropped
+        self.predictions.append(self.manager.predict_batch(self.buffer[:bucket])[:self.count])
+        self.count = 0
+        self.calls += 1
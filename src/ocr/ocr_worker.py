@@ -0,0 +1,203 @@
+"""Asynchronous OCR stage, that reads license plates apart from the detection"""
+from pathlib import Path
+import queue
+import threading
+import time
+from cv2 import cv2
+import src.ocr.ocr as ocr
+from src.ocr.confidence import CONFIDENCE_WINDOW, PlateConfidence
+from src.ocr.ocr_batcher import OCRBatcher
+from src.ocr.track_votes import TrackVotes
+
+
+class OCRWorker():
+    """Pool of worker threads that read license plates from a bounded queue.
+
+    The detection only submits the plate cut outs and continues with the next
+    frame, the segmentation and the CNN run in the worker threads.
+    """
+
+    def __init__(self, workers=2, max_pending=32,  # pylint: disable=R0913
+                 path=Path(__file__).parent / 'Licenseplates', batch_window=0.02, batch_plates=16,
+                 confidence=None, cache=None, results=None, frame_threshold=False,
+                 window=CONFIDENCE_WINDOW):
+        """Start the worker threads.
+
+        Args:
+            workers (int): number of worker threads
+            max_pending (int): maximum number of plates waiting in the queue,
+                submit blocks while the queue is full (backpressure)
+            path (path object): path to where the license plates should be saved to
+            batch_window (float): seconds a worker waits for more plates after the
+                first one, the characters of all of them are recognized in one batch
+            batch_plates (int): maximum number of plates of one batch
+            confidence (PlateConfidence): sightings of the plate strings, None counts
+                them apart from every other worker, within the last window frames
+            cache (PlateCache): strings of confirmed plates, plates similar to a
+                cached one are neither read nor counted again until it expires.
+                None reads every plate.
+            results (PlateStore): index the confident plates are saved to with their
+                frame, track, box and score. None writes the cut outs to path as <TEXT>.jpg.
+            frame_threshold (bool): If the plates are cut out of the threshold of the
+                frame context given to submit, instead of preprocessing every plate.
+                Pixels close to the plate borders differ, which can change the
+                character boxes, so every plate is preprocessed on its own by default.
+            window (int): number of frames a sighting is counted, if confidence is
+                None. A plate seen again after it left the window is saved again,
+                None counts every sighting of the stream and saves a plate only once.
+                The votes of a track are forgotten once it was not seen for window
+                frames.
+        """
+        self.path = path
+        self.frame_threshold = frame_threshold
+        self.results = results
+        self.confidence = PlateConfidence(frames=window) if confidence is None else confidence
+        self.votes = TrackVotes(self.confidence.level, window)
+        self.cache = cache
+        self.skipped = 0  # plates of confirmed tracks, that were not read again
+        self.batch_window = batch_window
+        self.batch_plates = batch_plates
+        self.tasks = queue.Queue(maxsize=max_pending)
+        # keras predict is not thread safe, and the confidence filter
+        # has to see the plates one after another
+        self.model_lock = threading.Lock()
+        self.result_lock = threading.Lock()
+        self.errors = []
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, img, boxes, context=None, track_ids=None):
+        """Queue the license plates of a frame for reading
+
+        Args:
+            img (numpy 3d array): whole Frame as input Image
+            boxes (list of list): list containing x, y, width, height of the plates
+            context (FrameContext): preprocessing cache of the frame, whose threshold
+                is used instead of preprocessing every plate again, if the worker
+                was created with frame_threshold
+            track_ids (list): track id of every plate, e.g. from Tracker.matches.
+                The reads of a track are voted on, and its plates are no longer
+                read once its text is confirmed. None counts every read alone.
+
+        Notes:
+            The cut outs are copied, since the frame gets blurred and drawn on
+            after the detection. The threshold of the context is not drawn on,
+            so views into it are queued. Blocks while the queue is full.
+        """
+        frame = self.confidence.next_frame()
+        track_ids = [None] * len(boxes) if track_ids is None else track_ids
+        with self.result_lock:
+            self.votes.evict(frame)
+        for box, plate, track_id in zip(boxes, ocr.cutout(img, boxes), track_ids):
+            if track_id is not None and self.votes.confirmed(track_id):
+                with self.result_lock:
+                    self.votes.seen(track_id, frame)
+                self.skipped += 1
+                continue
+            processed = context.cutout(box, 'thresh') \
+                if context is not None and self.frame_threshold else None
+            self.tasks.put((plate.copy(), processed, frame, track_id, box))
+
+    def drain(self):
+        """Waits till every submitted plate has been read
+
+        Raises:
+            RuntimeError: If reading a plate failed in one of the workers
+        """
+        self.tasks.join()
+        if self.errors:
+            errors, self.errors = self.errors, []
+            raise RuntimeError(f'OCR failed for {len(errors)} plates') from errors[0]
+
+    def close(self):
+        """Drains the queue and stops the worker threads"""
+        try:
+            self.drain()
+        finally:
+            for _ in self.threads:
+                self.tasks.put(None)
+            for thread in self.threads:
+                thread.join()
+
+    def _run(self):
+        """Reads batches of plates from the queue till the stop signal None is received"""
+        # every thread fills its own buffer
+        batcher = OCRBatcher()
+        while True:
+            tasks = self._collect()
+            try:
+                plates = [task for task in tasks if task is not None]
+                if plates:
+                    self._read(batcher, plates)
+            except Exception as error:  # pylint: disable=W0703
+                # the error is raised again by drain in the submitting thread
+                self.errors.append(error)
+            finally:
+                for _ in tasks:
+                    self.tasks.task_done()
+            if tasks[-1] is None:
+                return
+
+    def _collect(self):
+        """Waits for a plate and collects the plates submitted within the batch window
+
+        Returns:
+            list: tasks taken from the queue, the stop signal None is always the last
+        """
+        tasks = [self.tasks.get()]
+        deadline = time.monotonic() + self.batch_window
+        while tasks[-1] is not None and len(tasks) < self.batch_plates:
+            try:
+                tasks.append(self.tasks.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return tasks
+
+    def _read(self, batcher, plates):
+        """Reads a batch of plates and saves the ones that are confident
+
+        Args:
+            batcher (OCRBatcher): batcher of the worker thread
+            plates (list of tuples): cut out of a license plate, the preprocessed
+                plate or None, the frame it was cut out of, its track id or None and
+                its box in the frame
+
+        Notes:
+            A confirmed track is saved with the best cut out of its reads. Plates
+            of tracks are not looked up in the cache, every vote has to come from
+            a read of its own. Other plates that hit the cache were confirmed
+            before and are skipped, only the plates that were read are counted.
+        """
+        keys, hits = [None] * len(plates), set()
+        if self.cache is not None:
+            for index, (plate, _, frame, track_id, _) in enumerate(plates):
+                if track_id is None:
+                    keys[index] = self.cache.key(plate)
+                    if self.cache.get(plate, keys[index], frame) is not None:
+                        hits.add(index)
+        misses = [index for index in range(len(plates)) if index not in hits]
+        found = [ocr.find_characters(*plates[index][:2]) for index in misses]
+        with self.model_lock:
+            read = batcher.recognize([(char_found, characters)
+                                      for char_found, characters, _ in found])
+            scores = dict(zip(misses, batcher.scores))
+        with self.result_lock:
+            for index, plate_text in zip(misses, read):
+                schild, _, frame, track_id, box = plates[index]
+                if track_id is not None:
+                    plate_text = self.votes.vote(track_id, plate_text, schild, scores[index],
+                                                 frame)
+                    if plate_text is None:
+                        continue
+                    schild = self.votes.best_crop(track_id)
+                elif ocr.filter_confidence(plate_text, self.confidence, frame) is False:
+                    continue
+                elif keys[index] is not None:
+                    self.cache.put(schild, plate_text, keys[index], frame)
+                if self.results is not None:
+                    self.results.add(plate_text, schild, frame, box, track_id,
+                                     scores.get(index))
+                else:
+                    self.path.mkdir(parents=True, exist_ok=True)
+                    cv2.imwrite(str(self.path / plate_text) + '.jpg', schild)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+"""Cache of read plate strings, keyed by a perceptual hash of the plate cut out"""
+from collections import OrderedDict
+import threading
+from cv2 import cv2
+import numpy as np
+from src.ocr.confidence import CONFIDENCE_WINDOW
+
+
+def dhash(img, size=8):
+    """Function that computes the difference hash of an image
+
+    Args:
+        img (numpy 3d array): cut out of a license plate
+        size (int): number of rows and of compared columns, the hash has size * size bits
+
+    Returns:
+        int: bit i is set if pixel i of the shrunk grayscale image is brighter than its
+            right neighbor
+
+    Notes:
+        The image is shrunk to size + 1 by size pixels first, so the hash does not
+        depend on the size of the cut out, and only compares neighbors, so it does
+        not depend on the brightness. Crops of the same plate a few pixels apart
+        differ in a few bits.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] < small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class PlateCache():
+    """Least recently used cache of plate strings, that also hits on similar cut outs.
+
+    A lookup first tries the exact hash and then every cached hash within the
+    Hamming distance tolerance, the closest one wins. Once the cache holds
+    max_size plates, the least recently used one is evicted. A plate expires
+    max_age frames after it was read, so a plate that stays in view is read
+    again from time to time. Only confirmed strings should be cached: a hit
+    is not read, so it can not count as another sighting of the plate.
+    """
+
+    def __init__(self, max_size=256, tolerance=4, hash_size=8,  # pylint: disable=R0913
+                 max_age=CONFIDENCE_WINDOW):
+        """Starts empty.
+
+        Args:
+            max_size (int): maximum number of cached plates
+            tolerance (int): maximum number of different hash bits of a hit,
+                0 only hits identical hashes
+            hash_size (int): see dhash, at most 8, so the hash fits into 64 bits
+            max_age (int): number of frames a plate is cached after it was read,
+                None keeps it till it is evicted
+
+        Raises:
+            ValueError: If the hash_size is larger than 8
+        """
+        if hash_size > 8:
+            raise ValueError('The hash has to fit into 64 bits')
+        self.max_size = max_size
+        self.tolerance = tolerance
+        self.hash_size = hash_size
+        self.max_age = max_age
+        # hash -> plate string and the frame it was read from, the least recently used first
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Returns the number of cached plates"""
+        return len(self.entries)
+
+    def key(self, img):
+        """Returns the hash a cut out is cached with"""
+        return dhash(img, self.hash_size)
+
+    def get(self, img, key=None, frame=None):
+        """Looks up the plate string of a cut out
+
+        Args:
+            img (numpy 3d array): cut out of a license plate
+            key (int): hash of img, if it is already known
+            frame (int): frame the cut out is from, a plate read max_age frames
+                before it has expired. None does not expire any plate.
+
+        Returns:
+            str: cached plate string, None on a miss
+        """
+        key = self.key(img) if key is None else key
+        with self._lock:
+            match = key if key in self.entries else self._closest(key)
+            if match is not None and self._expired(self.entries[match][1], frame):
+                del self.entries[match]
+                self.expirations += 1
+                match = None
+            if match is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(match)
+            return self.entries[match][0]
+
+    def put(self, img, plate_text, key=None, frame=None):
+        """Caches the plate string of a cut out, evicts the least recently used plate if full
+
+        Args:
+            img (numpy 3d array): cut out of a license plate
+            plate_text (str): confirmed string read from the cut out
+            key (int): hash of img, if it is already known
+            frame (int): frame the cut out is from, None never expires
+        """
+        key = self.key(img) if key is None else key
+        with self._lock:
+            self.entries[key] = (plate_text, frame)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Returns the counters and the hit rate as dict"""
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def clear(self):
+        """Empties the cache and resets the counters"""
+        with self._lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def _expired(self, read, frame):
+        """Returns if a plate read in frame read has expired in frame"""
+        return self.max_age is not None and read is not None and frame is not None and \
+            frame - read >= self.max_age
+
+    def _closest(self, key):
+        """Returns the cached hash closest to key within the tolerance, or None"""
+        if not self.tolerance or not self.entries:
+            return None
+        keys = list(self.entries)
+        # the bits of the uint64 differences are counted bytewise
+        different = np.array(keys, dtype=np.uint64) ^ np.uint64(key)
+        distances = np.unpackbits(different.view(np.uint8)).reshape(len(keys), -1).sum(axis=1)
+        closest = int(distances.argmin())
+        return keys[closest] if distances[closest] <= self.tolerance else None
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+"""Indexed store of the read license plates, written behind the pipeline by a thread"""
+from contextlib import closing
+from pathlib import Path
+import queue
+import sqlite3
+import threading
+import time
+from cv2 import cv2
+import numpy as np
+
+# name of the SQLite index in the directory of the store
+INDEX = 'plates.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS plates (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL,
+    frame INTEGER,
+    timestamp REAL NOT NULL,
+    track_id INTEGER,
+    x INTEGER, y INTEGER, width INTEGER, height INTEGER,
+    confidence REAL,
+    crop BLOB
+);
+CREATE INDEX IF NOT EXISTS plates_text ON plates (text, timestamp);
+CREATE INDEX IF NOT EXISTS plates_timestamp ON plates (timestamp);
+'''
+
+FIELDS = 'text, frame, timestamp, track_id, x, y, width, height, confidence'
+
+
+class PlateStore():
+    """SQLite index of every saved plate with its frame, time, track, box and cut out.
+
+    add only queues the result, a writer thread encodes the cut outs as JPEG
+    and inserts everything queued meanwhile in one transaction. Unlike the
+    <TEXT>.jpg files it replaces, a plate read again does not overwrite the
+    earlier cut out. The index can be queried by plate text or time range
+    from any thread, also while it is written, and by other processes. The
+    writer thread is only started by the first add, so reading the index of
+    an earlier run, e.g. in the GUI, starts no thread.
+    """
+
+    def __init__(self, path=Path(__file__).parent / 'Licenseplates', max_pending=256,
+                 quality=95):
+        """Creates the index if needed.
+
+        Args:
+            path (path object): directory of the index
+            max_pending (int): maximum number of queued results, add blocks while
+                the queue is full
+            quality (int): JPEG quality of the cut outs
+        """
+        path.mkdir(parents=True, exist_ok=True)
+        self.path = path / INDEX
+        self.quality = quality
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.errors = []
+        connection = self._connect()
+        try:
+            # readers do not block the writer and the other way round
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def add(self, plate_text, crop, frame=None, box=None,  # pylint: disable=R0913
+            track_id=None, score=None, timestamp=None):
+        """Queues a read plate for saving
+
+        Args:
+            plate_text (str): string of detected Plate Text
+            crop (numpy 3d array): cut out of the plate, it is not copied
+            frame (int): frame the plate was read from
+            box (list): x, y, width and height of the plate in the frame
+            track_id (int): track of the plate
+            score (float): mean probability of the characters of the read
+            timestamp (float): seconds since the epoch, None is now
+        """
+        with self._lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        box = [None] * 4 if box is None else [int(value) for value in box]
+        self.pending.put((plate_text, frame, time.time() if timestamp is None else timestamp,
+                          track_id, *box, None if score is None else float(score), crop))
+
+    def flush(self):
+        """Waits till every queued plate is saved
+
+        Raises:
+            RuntimeError: If saving a plate failed in the writer thread
+        """
+        self.pending.join()
+        if self.errors:
+            errors, self.errors = self.errors, []
+            raise RuntimeError(f'Saving {len(errors)} plates failed') from errors[0]
+
+    def close(self):
+        """Saves the queued plates and stops the writer thread"""
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                thread, self.thread = self.thread, None
+            if thread is not None:
+                self.pending.put(None)
+                thread.join()
+
+    def query(self, text=None, start=None, end=None, limit=None):
+        """Looks up the saved plates, the oldest first
+
+        Args:
+            text (str): only plates read as this string, None returns every string
+            start (float): only plates saved at or after this time, seconds since the epoch
+            end (float): only plates saved before this time
+            limit (int): maximum number of plates, None returns all
+
+        Returns:
+            list of dicts: id, text, frame, timestamp, track_id, box and confidence
+                of every plate, the cut out is loaded with crop
+        """
+        conditions, parameters = [], []
+        for condition, value in (('text = ?', text), ('timestamp >= ?', start),
+                                 ('timestamp < ?', end)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        sql = f'SELECT id, {FIELDS} FROM plates'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY timestamp, id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            parameters.append(limit)
+        with self._reader() as connection:
+            rows = connection.execute(sql, parameters).fetchall()
+        return [{'id': row[0], 'text': row[1], 'frame': row[2], 'timestamp': row[3],
+                 'track_id': row[4], 'box': None if row[5] is None else list(row[5:9]),
+                 'confidence': row[9]} for row in rows]
+
+    def texts(self):
+        """Returns every saved plate string once, in the order they were first saved"""
+        with self._reader() as connection:
+            rows = connection.execute('SELECT text FROM plates GROUP BY text '
+                                      'ORDER BY MIN(timestamp), MIN(id)').fetchall()
+        return [text for text, in rows]
+
+    def crop(self, result_id):
+        """Returns the cut out of a saved plate, None if there is none
+
+        Args:
+            result_id (int): id of the plate, as returned by query
+        """
+        with self._reader() as connection:
+            row = connection.execute('SELECT crop FROM plates WHERE id = ?',
+                                     (result_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return cv2.imdecode(np.frombuffer(row[0], np.uint8), cv2.IMREAD_COLOR)
+
+    def latest_crop(self, plate_text):
+        """Returns the most recent cut out of a plate string, None if it was not saved"""
+        with self._reader() as connection:
+            row = connection.execute('SELECT id FROM plates WHERE text = ? '
+                                     'ORDER BY timestamp DESC, id DESC LIMIT 1',
+                                     (plate_text,)).fetchone()
+        return None if row is None else self.crop(row[0])
+
+    def _connect(self):
+        """Opens a connection to the index, that waits for locks of other connections"""
+        return sqlite3.connect(str(self.path), timeout=30)
+
+    def _reader(self):
+        """Returns a new connection to the index, that is closed when the with block is left"""
+        return closing(self._connect())
+
+    def _run(self):
+        """Saves queued plates till the stop signal None is received
+
+        Notes:
+            Everything queued while a transaction is written goes into the next
+            one, so the writer keeps up with any number of plates per frame.
+        """
+        # a sqlite connection is only used by the thread that opened it
+        connection = self._connect()
+        try:
+            while True:
+                results = [self.pending.get()]
+                while results[-1] is not None:
+                    try:
+                        results.append(self.pending.get_nowait())
+                    except queue.Empty:
+                        break
+                rows = [result for result in results if result is not None]
+                try:
+                    if rows:
+                        self._write(connection, rows)
+                except Exception as error:  # pylint: disable=W0703
+                    # the error is raised again by flush in the adding thread
+                    self.errors.append(error)
+                finally:
+                    for _ in results:
+                        self.pending.task_done()
+                if results[-1] is None:
+                    return
+        finally:
+            connection.close()
+
+    def _write(self, connection, rows):
+        """Encodes the cut outs and inserts the rows in one transaction"""
+        encoded = []
+        for *values, crop in rows:
+            blob = None
+            if crop is not None:
+                success, jpeg = cv2.imencode('.jpg', crop, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                blob = jpeg.tobytes() if success else None
+            encoded.append((*values, blob))
+        with connection:
+            connection.executemany(f'INSERT INTO plates ({FIELDS}, crop) '
+                                   'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', encoded)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""Post-training int8 quantization of the character CNN, guarded by its accuracy
+
+Run with: python -m src.ocr.quantize [--margin 1] [cnn.model] [cnn_int8.tflite]
+The activations are calibrated on Training_Data. The quantized model is only
+written, if it misreads at most margin more of the characters of the labeled
+test crops in Test_Bilder, which the CNN was not trained on, than the float
+model. The throughput of every model variant is printed.
+Load it with ModelManager(backend='tflite').
+"""
+import argparse
+from pathlib import Path
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+import src.ocr.ocr as ocr
+from src.ocr.benchmark import PATH_TEST, TEST_PLATES, load_test_images
+from src.ocr.numpy_cnn import NumpyCNN, export
+from src.ocr.tflite_cnn import QUANTIZED, TFLiteCNN
+
+PATH_DATA = Path(__file__).parent / 'Training_Data'
+
+
+def calibration_dataset(path=PATH_DATA, seed=0):
+    """Function that reads the labeled characters the activations are calibrated on
+
+    Args:
+        path (path object): directory with a folder of characters per class
+        seed (int): seed of the shuffle, the same seed gives the same order
+
+    Returns:
+        tuple: characters and labels
+    """
+    from src.ocr.generate_cnn import read_dataset  # pylint: disable=C0415
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        return read_dataset(path)
+    finally:
+        random.setstate(state)
+
+
+def read_test_characters(path=PATH_TEST, plates=None):
+    """Function that cuts the characters out of the labeled test crops
+
+    Args:
+        path (path object): directory with the *_pos_test crops, see load_test_images
+        plates (dict): plate string of every crop by file name, None uses TEST_PLATES
+
+    Returns:
+        tuple: characters in the input format of the CNN and their labels
+
+    Notes:
+        The crops are segmented like in the OCR, a crop whose number of characters
+        differs from its plate string is left out, since its characters can not
+        be labeled.
+    """
+    plates = TEST_PLATES if plates is None else plates
+    legend = list(ocr.MAP_LEGEND)
+    images, labels = [], []
+    for name, img, _ in load_test_images(path):
+        text = plates.get(name)
+        if text is None:
+            continue
+        found, characters, _ = ocr.find_characters(img)
+        if not found or len(characters) != len(text):
+            continue
+        images.extend(ocr.prepare_characters(characters))
+        labels.extend(legend.index(character) for character in text)
+    return np.array(images).reshape((-1, 28, 28, 1)), np.array(labels)
+
+
+def quantize(model, calibration, samples=500):
+    """Function that converts a keras model into an int8 TFLite model
+
+    Args:
+        model (keras model): trained character CNN
+        calibration (4d numpy array): characters the ranges of the activations are
+            calibrated on
+        samples (int): maximum number of calibration characters
+
+    Returns:
+        bytes: the TFLite flatbuffer
+
+    Notes:
+        Weights and activations are int8, only the input and the output stay float,
+        so the quantized model is called with the same tensors as the float one.
+    """
+    import tensorflow as tf  # pylint: disable=C0415
+
+    def representative_dataset():
+        for image in calibration[:samples]:
+            yield [image[np.newaxis].astype(np.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+def evaluate(model, images, labels, batch_size=16, repeat=3):
+    """Function that measures the accuracy and the throughput of a model
+
+    Args:
+        model (object): model with a predict_on_batch method
+        images (4d numpy array): characters with shape (n, 28, 28, 1)
+        labels (1d numpy array): class of every character
+        batch_size (int): number of characters per call, like a bucket of the OCRBatcher
+        repeat (int): number of runs, the fastest one counts
+
+    Returns:
+        dict: accuracy, number of correct and of all characters and characters per second
+
+    Notes:
+        The last batch is padded with empty characters like the buckets of the
+        OCRBatcher, so every model only sees a single batch size.
+    """
+    padding = np.zeros((-len(images) % batch_size,) + images.shape[1:], images.dtype)
+    padded = np.concatenate([images, padding])
+    batches = [padded[i:i + batch_size] for i in range(0, len(padded), batch_size)]
+    model.predict_on_batch(batches[0])
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        predictions = [np.asarray(model.predict_on_batch(batch)) for batch in batches]
+        seconds = min(seconds, time.perf_counter() - start)
+    correct = int(np.sum(np.concatenate(predictions)[:len(images)].argmax(axis=1) == labels))
+    return {'accuracy': correct / len(images), 'correct': correct, 'characters': len(images),
+            'chars_per_second': len(images) / seconds}
+
+
+def quantize_cnn(model, path=QUANTIZED, margin=1,  # pylint: disable=R0913
+                 data=PATH_DATA, test=PATH_TEST, samples=500, batch_size=16):
+    """Function that quantizes the CNN and writes it, if it is accurate enough
+
+    Args:
+        model (keras model): trained character CNN
+        path (path object): path the quantized model is written to
+        margin (int): number of test characters the int8 model may misread more
+            than the float model. With the 56 characters of the test crops, a
+            single character is almost two points of accuracy.
+        data (path object): directory of the labeled characters the quantization is
+            calibrated on, see calibration_dataset
+        test (path object): directory of the labeled test crops the accuracy is
+            measured on, see read_test_characters. Their characters are not part of
+            the training data.
+        samples (int): maximum number of calibration characters
+        batch_size (int): characters per call when measuring the throughput
+
+    Returns:
+        dict: accuracy and characters per second of the keras, NumPy and int8 model,
+            the drop in correctly read characters and if the int8 model was written
+    """
+    calibration, _ = calibration_dataset(data)
+    images, labels = read_test_characters(test)
+    content = quantize(model, calibration, samples)
+    quantized = TFLiteCNN(content=content)
+    with tempfile.TemporaryDirectory() as directory:
+        export(model, Path(directory) / 'cnn.npz')
+        numpy_cnn = NumpyCNN(Path(directory) / 'cnn.npz')
+    report = {name: evaluate(variant, images, labels, batch_size)
+              for name, variant in (('keras', model), ('numpy', numpy_cnn),
+                                    ('int8', quantized))}
+    report['drop'] = report['keras']['correct'] - report['int8']['correct']
+    report['written'] = report['drop'] <= margin
+    if report['written']:
+        with open(path, 'wb') as file:
+            file.write(content)
+    return report
+
+
+def main():
+    """Quantizes the trained keras model and prints the accuracy and throughput of every variant
+
+    Returns:
+        int: exit code, 1 if the quantized model was refused
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('model', nargs='?', default=str(Path(__file__).parent / 'cnn.model'),
+                        help='path of the keras model')
+    parser.add_argument('output', nargs='?', default=str(QUANTIZED),
+                        help='path of the quantized model')
+    parser.add_argument('--margin', type=int, default=1,
+                        help='number of test characters the int8 model may misread more')
+    parser.add_argument('--samples', type=int, default=500,
+                        help='maximum number of calibration characters')
+    args = parser.parse_args()
+    import tensorflow.keras.models as tf  # pylint: disable=C0415
+    report = quantize_cnn(tf.load_model(args.model), Path(args.output), args.margin,
+                          samples=args.samples)
+    for name in ('keras', 'numpy', 'int8'):
+        print(f'{name:6s} accuracy {report[name]["accuracy"]:.2%} '
+              f'({report[name]["correct"]}/{report[name]["characters"]}) '
+              f'{report[name]["chars_per_second"]:8.1f} chars/s')
+    if not report['written']:
+        print(f'{report["drop"]} more characters misread, more than {args.margin}, '
+              f'{args.output} was not written')
+        return 1
+    print(f'{report["drop"]} more characters misread, written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
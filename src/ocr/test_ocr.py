@@ -8,8 +8,10 @@ https://archive.org/details/HDRDataset
 
 import os
 import shutil
+import threading
+import tracemalloc
 from pathlib import Path
-from mock import patch
+from mock import MagicMock, patch
 import pytest
 from cv2 import cv2
 import numpy as np
@@ -17,6 +19,19 @@ import tensorflow.keras.models as model
 import src.ocr.ocr as ocr
 import src.ocr.generate_cnn as gc
 from src.ocr.label_data import label_data
+from src.ocr.ocr_worker import OCRWorker
+from src.ocr.model_manager import ModelManager
+from src.ocr.ocr_batcher import OCRBatcher
+from src.ocr.numpy_cnn import NumpyCNN, export
+from src.ocr.confidence import CONFIDENCE_WINDOW, PlateConfidence
+from src.ocr.track_votes import TrackVotes
+from src.ocr.plate_cache import PlateCache, dhash
+from src.ocr.glyphs import GlyphPool, GlyphWriter
+from src.ocr.plate_store import INDEX, PlateStore
+from src.ocr.quantize import calibration_dataset, quantize_cnn, read_test_characters
+from src.ocr.tflite_cnn import TFLiteCNN
+from src.ocr.benchmark import STAGES, compare, load_test_images, sweep
+from src.preprocessing.frame_context import FrameContext
 
 
 pfad = Path(__file__).parent / 'Test_Bilder'
@@ -239,6 +254,57 @@ def test_read_numberplates(img):
     os.remove(plate_path / 'Test.jpg')
 
 
+def test_ocr_worker():
+    """Test if plates submitted to the OCRWorker get read and saved
+
+    Notes:
+        The queue only holds a single plate, so submitting three plates
+        waits for the workers, draining returns once every plate is read.
+    """
+    plate_path = pfad / 'Worker_Plates'
+    img = pos_img[0]
+    dummy_box = [[0, 0, img.shape[1] - 1, img.shape[0] - 1]]
+
+    with patch('src.ocr.ocr.find_characters', return_value=['dummy1', 'dummy', img]):
+        with patch('src.ocr.ocr_batcher.OCRBatcher.recognize',
+                   side_effect=lambda plates: ['Test'] * len(plates)) as recognize:
+            with patch('src.ocr.ocr.filter_confidence', side_effect=[False, False, True]):
+                worker = OCRWorker(workers=2, max_pending=1, path=plate_path)
+                for _ in range(3):
+                    worker.submit(img, dummy_box)
+                worker.close()
+            # the plates may be read in batches
+            assert sum(len(call[0][0]) for call in recognize.call_args_list) == 3
+
+    assert os.path.isfile(plate_path / 'Test.jpg')
+    shutil.rmtree(plate_path)
+
+
+def test_ocr_worker_frame_threshold():
+    """Test if the plates are only cut out of the frame threshold with frame_threshold"""
+    img = pos_img[0]
+    dummy_box = [[0, 0, img.shape[1] - 1, img.shape[0] - 1]]
+    context = FrameContext(img)
+    for frame_threshold in (False, True):
+        with patch('src.ocr.ocr.find_characters',
+                   return_value=[False, 'dummy', img]) as find:
+            worker = OCRWorker(workers=1, frame_threshold=frame_threshold)
+            worker.submit(img, dummy_box, context)
+            worker.close()
+        processed = find.call_args[0][1]
+        assert (processed is not None) == frame_threshold
+
+
+def test_ocr_worker_error():
+    """Test if errors in the worker threads are raised by drain"""
+    worker = OCRWorker(workers=1)
+    with patch('src.ocr.ocr.find_characters', side_effect=ValueError('broken plate')):
+        worker.submit(pos_img[0], [[0, 0, 10, 10]])
+        with pytest.raises(RuntimeError):
+            worker.drain()
+    worker.close()
+
+
 def test_label_data():
     """Tests the labeling Function, by simulating key presses
 
@@ -294,7 +360,18 @@ def test_create_model():
     shutil.rmtree(pfad / 'Synthetic_Data')
 
 
-@patch('src.ocr.ocr.detected_plates', plate_names)
+def seen_once(names):
+    """Returns a PlateConfidence of level 2, in which every name was seen once"""
+    seen = PlateConfidence(level=2)
+    for plate in names:
+        seen.add(plate)
+    return seen
+
+
+# every plate name was seen once, the sightings are shared by the test_filter_confidence cases
+seen_plates = seen_once(plate_names)
+
+
 @pytest.mark.parametrize('plate_text, truth', [[plate_names[0], True], [plate_names[0], False],
                                                ['dummy', False], ['dummy', False], ['M12', False]])
 def test_filter_confidence(plate_text, truth):
@@ -311,13 +388,500 @@ def test_filter_confidence(plate_text, truth):
         the test with dummy
 
     """
-    with patch('src.ocr.ocr.CONFIDENCE_LVL', 2):
+    with patch('src.ocr.ocr.confidence', seen_plates):
         assert ocr.filter_confidence(plate_text) == truth
 
 
 def test_reset_plates():
     """Tests the reset plates Function"""
-    with patch('src.ocr.ocr.detected_plates', plate_names):
-        assert len(plate_names) != 0
+    store = PlateConfidence()
+    for name in plate_names:
+        store.add(name)
+    with patch('src.ocr.ocr.confidence', store):
+        assert len(store) != 0
         ocr.reset_plates()
-        assert len(plate_names) == 0
+        assert len(store) == 0
+
+
+def test_plate_confidence():
+    """Test if sightings are forgotten once they left the frame or time window"""
+    store = PlateConfidence(level=2, frames=3)
+    assert store.add('MKE1104') is False
+    for _ in range(2):
+        store.next_frame()
+    assert store.add('MKE1104') is True
+    # the first sighting leaves the window, the third one confirms the plate again
+    store.next_frame()
+    assert store.count('MKE1104') == 1
+    assert store.add('MKE1104') is True
+    # sightings read late count for the frame they were read from
+    assert store.add('MAF6608', frame=store.frame - 3) is False
+    assert store.add('MAF6608', frame=store.frame - 2) is False
+    assert store.count('MAF6608') == 1 and len(store) == 3
+
+    now = [0.0]
+    store = PlateConfidence(level=3, seconds=10, clock=lambda: now[0])
+    for second in (0, 4, 11):
+        now[0] = second
+        assert store.add('DUP2900') is False
+    now[0] = 13
+    assert store.add('DUP2900') is True
+    assert len(store) == 3
+
+    # without a window only the counts are kept
+    store = PlateConfidence()
+    for _ in range(5):
+        store.add('MBB9006')
+    assert len(store.sightings) == 0 and store.count('MBB9006') == 5
+
+
+def test_model_manager():
+    """Test if the model is loaded once on first use and warmed up once per process"""
+    manager = ModelManager(Path('dummy.model'))
+    assert manager.loaded is False
+    with patch('tensorflow.keras.models.load_model') as load:
+        load.return_value.count_params.return_value = 42
+        assert manager.preload()['parameters'] == 42
+        assert load.return_value.predict.call_count == 0
+        threads = [threading.Thread(target=manager.predict, args=(np.zeros((2, 28, 28, 1)),))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # another process warms up its own model
+        with patch('src.ocr.model_manager.os.getpid', return_value=-1):
+            manager.get()
+    load.assert_called_once_with(Path('dummy.model'))
+    warm_ups = [call for call in load.return_value.predict.call_args_list
+                if call[0][0].shape == (1, 28, 28, 1)]
+    assert len(warm_ups) == 2
+    assert load.return_value.predict.call_count == 6
+    assert manager.loaded
+    assert manager.metrics['load_seconds'] >= 0 and manager.metrics['warm_up_seconds'] >= 0
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_model_manager_fork(tmp_path):
+    """Test if a process forked after preload reuses the NumPy weights of its parent"""
+    export(gc.build_model(len(ocr.MAP_LEGEND)), tmp_path / 'cnn.npz')
+    manager = ModelManager(bundle=tmp_path / 'cnn.npz', backend='numpy')
+    manager.preload()
+    weights = manager.get().arrays
+    addresses = {name: array.ctypes.data for name, array in weights.items()}
+    tensor = np.zeros((2, 28, 28, 1))
+    expected = manager.predict(tensor)
+    pid = os.fork()
+    if pid == 0:
+        shared = False
+        try:
+            # the child must neither load the bundle again nor warm it up
+            with patch('src.ocr.model_manager.NumpyCNN', side_effect=AssertionError), \
+                    patch.object(ModelManager, '_warm', side_effect=AssertionError):
+                model_child = manager.get()
+                shared = model_child.arrays is weights and addresses == {
+                    name: array.ctypes.data for name, array in model_child.arrays.items()}
+                shared = shared and np.array_equal(manager.predict(tensor), expected)
+        finally:
+            os._exit(0 if shared else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    assert manager.metrics['backend'] == 'numpy'
+
+
+class FakeModel():
+    """Stands in for the CNN, the class of a character is given by its pixel sum"""
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.metrics = {}
+
+    def get(self):
+        """Same interface as ModelManager.get, there is no model to load"""
+
+    def predict(self, tensor):
+        """Same interface as ModelManager.predict"""
+        return np.eye(37)[tensor.reshape(len(tensor), -1).sum(axis=1).astype(int) % 36]
+
+    def predict_batch(self, tensor):
+        """Same interface as ModelManager.predict_batch"""
+        self.batch_sizes.append(len(tensor))
+        return self.predict(tensor)
+
+
+def test_ocr_batcher():
+    """Test if batched plates give the same strings as reading every plate alone
+
+    Notes:
+        The buffer holds 16 characters, so the characters of all plates need
+        a full batch and one padded to the bucket of 8.
+    """
+    fake = FakeModel()
+    plates = [ocr.find_characters(img)[:2] for img in pos_img + neg_img]
+    with patch('src.ocr.ocr.model_manager', fake):
+        expected = [ocr.recognize_characters(*plate) for plate in plates]
+    batcher = OCRBatcher(fake, buckets=(8, 16))
+    assert batcher.recognize(plates) == expected
+    characters = sum(len(chars) for found, chars in plates if found)
+    assert fake.batch_sizes == [16] * (characters // 16) + [8] * (characters % 16 > 0)
+    assert batcher.recognize([(False, 'No characters')]) == [ocr.NOT_DETECTED]
+
+    # the plates of a failed call are not returned by the next one
+    chars = plates[0][1][:3]
+    with patch.object(fake, 'predict_batch', side_effect=RuntimeError('CNN failed')):
+        with pytest.raises(RuntimeError):
+            batcher.recognize([(True, chars), (False, []), (True, chars)])
+    assert batcher.count == 0 and batcher.recognize([(True, chars)]) == [expected[0][:3]] and \
+        len(batcher.scores) == 1
+
+
+def test_numpy_cnn(tmp_path):
+    """Test if the NumPy export predicts like the keras model, and is used without TensorFlow
+
+    Notes:
+        The architecture of the trained CNN gets random weights, the batch normalization
+        gets random statistics, so every layer has an effect on the predictions.
+    """
+    np.random.seed(0)
+    keras_model = gc.build_model(len(ocr.MAP_LEGEND))
+    keras_model.set_weights([np.random.uniform(0.5, 1.5, weights.shape) if weights.ndim == 1
+                             else weights for weights in keras_model.get_weights()])
+    export(keras_model, tmp_path / 'cnn.npz')
+    characters = [char for img in pos_img for char in
+                  ocr.prepare_characters(ocr.find_characters(img)[1])]
+    tensor = np.asarray(characters).reshape((len(characters), 28, 28, 1))
+    expected = keras_model.predict(tensor)
+    predictions = NumpyCNN(tmp_path / 'cnn.npz').predict(tensor)
+    assert np.allclose(predictions, expected, atol=1e-4)
+    assert (predictions.argmax(axis=1) == expected.argmax(axis=1)).all()
+
+    manager = ModelManager(Path('dummy.model'), bundle=tmp_path / 'cnn.npz')
+    # None in sys.modules makes the import of TensorFlow fail
+    with patch.dict('sys.modules', {'tensorflow.keras.models': None}):
+        assert np.allclose(manager.predict(tensor), predictions)
+    assert manager.metrics['backend'] == 'numpy'
+    with pytest.raises(ValueError):
+        ModelManager(backend='onnx')
+
+
+def test_track_votes():
+    """Test if the reads of a track are voted on per character and confirmed once certain"""
+    votes = TrackVotes(level=2)
+    crops = [np.full((2, 2, 3), value, dtype=np.uint8) for value in range(4)]
+    assert votes.vote(1, 'MKE1104', crops[0], 0.5) is None
+    # a misread character and a missed character are outvoted by the other reads
+    assert votes.vote(1, 'MKE1I04', crops[1], 0.9) is None
+    assert votes.vote(1, 'MKE104', crops[2], 0.99) is None
+    assert votes.vote(1, ocr.NOT_DETECTED, crops[3], 0.0) is None
+    assert votes.text(1) == 'MKE1104' and not votes.confirmed(1)
+    assert votes.vote(1, 'MKE1104', crops[3], 0.7) == 'MKE1104'
+    assert votes.confirmed(1) and not votes.confirmed(2)
+    # the best read of the voted length
+    assert votes.best_crop(1) is crops[1]
+    assert votes.vote(1, 'MKE1104', crops[0], 1.0) is None
+    # implausible texts are not confirmed
+    for _ in range(3):
+        assert votes.vote(2, '12M', crops[0], 1.0) is None
+    assert votes.text(3) is None
+
+
+def test_track_votes_evict():
+    """Test if the tracks that were not seen for max_age frames are forgotten"""
+    votes = TrackVotes(level=2, max_age=3)
+    crop = np.zeros((2, 2, 3), dtype=np.uint8)
+    votes.vote(1, 'MKE1104', crop, 0.5, frame=1)
+    votes.vote(1, 'MKE1104', crop, 0.5, frame=2)
+    votes.vote(2, 'MAF6608', crop, 0.5, frame=2)
+    assert votes.confirmed(1)
+    # the confirmed track is still in view, though it is no longer read
+    votes.seen(1, 4)
+    assert votes.evict(4) == 0
+    assert votes.evict(5) == 1 and set(votes.tracks) == {1}
+    assert votes.evict(7) == 1 and not votes.tracks and not votes.last_seen
+    votes.vote(3, 'DUP2900', crop, 0.5, frame=8)
+    votes.forget(3)
+    assert not votes.tracks and not votes.last_seen
+    assert TrackVotes().evict(1000) == 0
+
+
+def test_ocr_worker_tracks():
+    """Test if the plates of a confirmed track are not read again"""
+    plate_path = pfad / 'Track_Plates'
+    img = pos_img[0]
+    dummy_box = [[0, 0, img.shape[1] - 1, img.shape[0] - 1]]
+    with patch('src.ocr.ocr.model_manager', FakeModel()), \
+            patch('src.ocr.ocr.plausible', return_value=True):
+        worker = OCRWorker(workers=1, path=plate_path, confidence=PlateConfidence(level=2))
+        for _ in range(4):
+            worker.submit(img, dummy_box, track_ids=[7])
+            worker.drain()
+        worker.close()
+    assert worker.votes.confirmed(7) and worker.skipped == 2
+    assert os.listdir(plate_path) == [worker.votes.text(7) + '.jpg']
+    assert worker.votes.max_age == CONFIDENCE_WINDOW and worker.votes.last_seen == {7: 4}
+    shutil.rmtree(plate_path)
+
+
+def test_ocr_worker_cache():
+    """Test if the worker does not count the hits of a cached misread as sightings"""
+    img = pos_img[0]
+    dummy_box = [[0, 0, img.shape[1] - 1, img.shape[0] - 1]]
+    cache = PlateCache()
+    cache.put(img, 'MKE1I04')
+    results = MagicMock()
+    with patch('src.ocr.ocr.model_manager', FakeModel()):
+        worker = OCRWorker(workers=1, confidence=PlateConfidence(level=2), cache=cache,
+                           results=results)
+        for _ in range(4):
+            worker.submit(img, dummy_box)
+            worker.drain()
+        worker.close()
+    assert cache.hits == 4 and len(worker.confidence) == 0
+    assert results.add.call_count == 0
+
+
+def test_ocr_worker_window():
+    """Test if the sightings of a worker are counted within a window of frames"""
+    worker = OCRWorker(workers=1)
+    assert worker.confidence.frames == CONFIDENCE_WINDOW
+    worker.close()
+    worker = OCRWorker(workers=1, window=2)
+    for _ in range(3):
+        worker.submit(pos_img[0], [])
+    assert worker.confidence.frames == 2 and worker.confidence.frame == 3
+    worker.close()
+    worker = OCRWorker(workers=1, window=None)
+    assert worker.confidence.frames is None
+    worker.close()
+
+
+def test_plate_cache():
+    """Test if similar cut outs hit the cache, and the least recently used plate is evicted"""
+    plate = pos_img[0]
+    shifted = plate[1:, 2:]
+    brighter = cv2.add(plate, 20)
+    assert dhash(brighter) == dhash(plate)
+    assert bin(dhash(shifted) ^ dhash(plate)).count('1') <= 4
+    assert bin(dhash(pos_img[1]) ^ dhash(plate)).count('1') > 8
+
+    cache = PlateCache(max_size=2, tolerance=4)
+    assert cache.get(plate) is None
+    cache.put(plate, 'MKE1104')
+    assert cache.get(shifted) == 'MKE1104'
+    assert PlateCache(tolerance=0).get(shifted) is None
+    cache.put(pos_img[1], 'MAF6608')
+    # the first plate was used last, so the second one is evicted
+    cache.get(plate)
+    cache.put(pos_img[2], 'DUP2900')
+    assert cache.get(pos_img[1]) is None and cache.get(plate) == 'MKE1104'
+    assert cache.stats() == {'size': 2, 'hits': 3, 'misses': 2, 'evictions': 1,
+                             'expirations': 0, 'hit_rate': 0.6}
+    with pytest.raises(ValueError):
+        PlateCache(hash_size=9)
+
+
+def test_read_numberplate_cache():
+    """Test if a confirmed plate is neither read nor counted again till it expires,
+    and a cached misread is never confirmed by hits"""
+    plate_path = pfad / 'Cached_Plates'
+    img = pos_img[0]
+    dummy_box = [[0, 0, img.shape[1] - 1, img.shape[0] - 1]]
+    cache = PlateCache(max_age=4)
+    store = PlateConfidence(level=2)
+    with patch('src.ocr.ocr.find_characters', return_value=[True, 'dummy', img]) as find:
+        with patch('src.ocr.ocr.recognize_characters', return_value='MKE1104') as recognize:
+            for _ in range(5):
+                ocr.read_numberplate(img, dummy_box, path=plate_path, store=store, cache=cache)
+    # read till confirmed in frame 2, the hits of frame 3 to 5 are not counted
+    assert find.call_count == 2 and recognize.call_count == 2
+    assert cache.hits == 3 and store.count('MKE1104') == 2
+    # read again once the plate expired
+    with patch('src.ocr.ocr.find_characters', return_value=[True, 'dummy', img]) as find:
+        with patch('src.ocr.ocr.recognize_characters', return_value='MKE1104'):
+            ocr.read_numberplate(img, dummy_box, path=plate_path, store=store, cache=cache)
+    assert find.call_count == 1 and cache.expirations == 1
+    shutil.rmtree(plate_path)
+
+    cache = PlateCache()
+    cache.put(img, 'MKE1I04')
+    store = PlateConfidence()
+    with patch('src.ocr.ocr.find_characters') as find:
+        for _ in range(2 * store.level):
+            ocr.read_numberplate(img, dummy_box, path=plate_path, store=store, cache=cache)
+    assert find.call_count == 0 and store.count('MKE1I04') == 0
+    assert os.listdir(plate_path) == []
+
+    # plates that could not be read are not cached
+    cache = PlateCache()
+    with patch('src.ocr.ocr.find_characters', return_value=[False, [], img]):
+        with patch('src.ocr.ocr.recognize_characters', return_value=ocr.NOT_DETECTED):
+            ocr.read_numberplate(img, dummy_box, path=plate_path, store=PlateConfidence(),
+                                 cache=cache)
+    assert len(cache) == 0
+    shutil.rmtree(plate_path)
+
+
+def test_find_characters_per_contour():
+    """Test if the vectorized find_characters cuts out the same characters as the reference
+
+    Notes:
+        Runs over the test images and the plates of the Dataset, which were labeled
+        with the reference.
+    """
+    dataset = Path(__file__).parent / 'Dataset'
+    images = [cv2.imread(str(dataset / name)) for name in sorted(os.listdir(dataset))]
+    for img in pos_img + neg_img + [resize_img] + images:
+        found, characters, _ = ocr.find_characters(img)
+        expected_found, expected, _ = ocr.find_characters_per_contour(img)
+        assert found == expected_found
+        if found:
+            assert len(characters) == len(expected)
+            for char, expected_char in zip(characters, expected):
+                assert np.array_equal(char, expected_char)
+
+
+def test_glyph_writer():
+    """Test if the characters are normalized into the buffers with the pixels of
+    prepare_characters, without allocating once the buffers are large enough"""
+    chars = [char for img in pos_img + [resize_img] for char in ocr.find_characters(img)[1]]
+    # larger than the canvas of the writer
+    chars.append(cv2.resize(chars[0], (90, 140)))
+    expected = np.asarray(ocr.prepare_characters(chars)).reshape((len(chars), 28, 28, 1))
+    buffer = np.zeros((len(chars), 28, 28, 1), dtype=np.uint8)
+    writer = GlyphWriter(max_char=(32, 32))
+    for index, char in enumerate(chars):
+        writer.write(char, buffer[index, :, :, 0])
+    assert np.array_equal(buffer, expected)
+
+    pool = GlyphPool()
+    tensors = []
+    thread = threading.Thread(target=lambda: tensors.append(pool.tensor(chars[:3])))
+    thread.start()
+    thread.join()
+    assert np.array_equal(pool.tensor(chars), expected)
+    # every thread has its own buffer
+    assert not np.shares_memory(tensors[0], pool.tensor(chars))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(10):
+        pool.tensor(chars)
+    allocated = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    assert allocated < 28 * 28
+
+
+def test_plate_store(tmp_path):
+    """Test if the saved plates are found by text and time, without overwriting earlier cut outs"""
+    store = PlateStore(tmp_path)
+    assert store.thread is None and store.query() == []
+    img = pos_img[0]
+    store.add('Test', img, frame=1, box=np.array([1, 2, 30, 10]), timestamp=100.0)
+    store.add('Other', img[:10], frame=2, track_id=3, score=0.9, timestamp=101.0)
+    store.add('Test', img[::-1], frame=5, timestamp=102.0)
+    store.flush()
+    assert store.texts() == ['Test', 'Other']
+    tests = store.query(text='Test')
+    assert [result['frame'] for result in tests] == [1, 5]
+    assert tests[0]['box'] == [1, 2, 30, 10] and tests[1]['box'] is None
+    assert [result['text'] for result in store.query(start=100.5, end=102.0)] == ['Other']
+    assert store.query(start=101.0)[0]['track_id'] == 3
+    assert store.query(limit=1)[0]['confidence'] is None
+    assert store.crop(tests[0]['id']).shape == img.shape
+    assert store.latest_crop('Other').shape == img[:10].shape
+    assert store.latest_crop('Missing') is None
+    store.close()
+    # the index of an earlier run is read without a writer
+    assert (tmp_path / INDEX).is_file() and len(PlateStore(tmp_path).query()) == 3
+
+
+def test_plate_store_results(tmp_path):
+    """Test if read_numberplate and the OCRWorker save to the plate index instead of files"""
+    img = pos_img[0]
+    dummy_box = [[0, 0, img.shape[1] - 1, img.shape[0] - 1]]
+    store = PlateStore(tmp_path)
+    with patch('src.ocr.ocr.find_characters', return_value=[True, 'dummy', img]), \
+            patch('src.ocr.ocr.recognize_characters', return_value='Test'), \
+            patch('src.ocr.ocr.filter_confidence', return_value=True):
+        ocr.read_numberplate(img, dummy_box, path=tmp_path, store=PlateConfidence(),
+                             results=store)
+    with patch('src.ocr.ocr.model_manager', FakeModel()), \
+            patch('src.ocr.ocr.plausible', return_value=True):
+        worker = OCRWorker(workers=1, path=tmp_path, confidence=PlateConfidence(level=1),
+                           results=store)
+        worker.submit(img, dummy_box, track_ids=[7])
+        worker.close()
+    store.close()
+    assert not any(name.endswith('.jpg') for name in os.listdir(tmp_path))
+    read, tracked = store.query()
+    assert read['text'] == 'Test' and read['frame'] == 1 and read['box'] == dummy_box[0]
+    assert tracked['text'] == worker.votes.text(7) and tracked['track_id'] == 7
+    assert 0 < tracked['confidence'] <= 1
+
+
+def test_quantize(tmp_path):
+    """Test if the int8 model is only written within the accuracy margin, and loads as backend
+
+    Notes:
+        The untrained architecture is calibrated on the characters of test_data, so only the
+        agreement with the float model is checked, not its accuracy.
+    """
+    calibration, _ = calibration_dataset(path_ori)
+    assert len(calibration) == 5
+    assert np.array_equal(calibration_dataset(path_ori)[0], calibration)
+    # the characters of the labeled test crops, which are not in Training_Data
+    held_out, labels = read_test_characters(pfad)
+    assert held_out.shape == (56, 28, 28, 1)
+    assert ''.join(ocr.MAP_LEGEND[labels[:7]]) == '5C65578'
+    keras_model = gc.build_model(len(ocr.MAP_LEGEND))
+    # the int8 model can not read 56 characters more than the float model
+    report = quantize_cnn(keras_model, tmp_path / 'refused.tflite', margin=-len(labels),
+                          data=path_ori, test=pfad)
+    assert not report['written'] and not os.path.isfile(tmp_path / 'refused.tflite')
+    report = quantize_cnn(keras_model, tmp_path / 'cnn_int8.tflite', margin=len(labels),
+                          data=path_ori, test=pfad)
+    assert report['written'] and set(report) >= {'keras', 'numpy', 'int8', 'drop'}
+    assert report['int8']['characters'] == 56 and isinstance(report['drop'], int)
+    assert all(report[name]['chars_per_second'] > 0 for name in ('keras', 'numpy', 'int8'))
+
+    tensor = np.concatenate([calibration, held_out])
+    expected = keras_model.predict(tensor)
+    quantized = TFLiteCNN(tmp_path / 'cnn_int8.tflite')
+    predictions = quantized.predict(tensor)
+    assert predictions.shape == expected.shape
+    # the output is quantized too, in steps of 1/256
+    assert np.abs(predictions - expected).mean() < 0.01
+    # the tensors are allocated again for a new batch size
+    assert np.array_equal(quantized.predict(tensor[:2]), predictions[:2])
+    # a forked process builds its own interpreter of the same flatbuffer
+    assert np.array_equal(quantized.copy().predict(tensor), predictions)
+
+    manager = ModelManager(backend='tflite', quantized=tmp_path / 'cnn_int8.tflite')
+    assert np.allclose(manager.predict_batch(tensor), predictions)
+    assert manager.metrics['backend'] == 'tflite'
+
+
+def test_benchmark_sweep():
+    """Test if the sweep scores the test crops and the comparison finds regressions"""
+    images = load_test_images()
+    assert len(images) == 12 and sum(truth is not None for _, _, truth in images) == 8
+    report = sweep(images, {'fake': FakeModel()}, [1, 5], repeat=1)
+    assert [result['batch_size'] for result in report['results']] == [1, 5]
+    for result in report['results']:
+        assert set(result['stages']) == set(STAGES) and len(result['crops']) == 12
+        assert result['chars_per_second'] > 0 and result['false_positive_rate'] == 0
+        assert 0 <= result['string_accuracy'] <= 1
+    # the batch size does not change the strings
+    assert [crop['read'] for crop in report['results'][0]['crops']] == \
+        [crop['read'] for crop in report['results'][1]['crops']]
+    assert not compare(report, report)
+
+    slower = {'results': [dict(result, stages=dict(result['stages'])) for result in
+                          report['results']]}
+    slower['results'][0]['stages']['find_characters'] *= 2
+    slower['results'][0]['false_positive_rate'] = 0.25
+    # batch sizes missing in the baseline are not compared
+    slower['results'][1]['batch_size'] = 8
+    slower['results'][1]['chars_per_second'] /= 2
+    regressions = compare(report, slower)
+    assert len(regressions) == 2
+    assert 'find_characters' in regressions[0] and 'false positive' in regressions[1]
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""Runtime of the int8 character CNN written by quantize, without its conversion"""
+from pathlib import Path
+import threading
+import numpy as np
+
+QUANTIZED = Path(__file__).parent / 'cnn_int8.tflite'
+
+
+class TFLiteCNN():
+    """Character CNN loaded from a TFLite flatbuffer, e.g. the int8 one of quantize.
+
+    Has the predict methods of a keras model that the OCR uses, so the
+    ModelManager can hand it out instead. Uses tflite_runtime if it is
+    installed, which does not need TensorFlow.
+    """
+
+    def __init__(self, path=None, content=None, threads=None):
+        """Loads the model
+
+        Args:
+            path (path object): path of the tflite file
+            content (bytes): the flatbuffer itself, instead of a path
+            threads (int): number of threads of the interpreter, None lets it decide
+        """
+        try:
+            from tflite_runtime.interpreter import Interpreter  # pylint: disable=C0415
+        except ImportError:
+            import tensorflow as tf  # pylint: disable=C0415
+            Interpreter = tf.lite.Interpreter  # pylint: disable=C0103
+        # the flatbuffer is kept, so a forked process can build its own interpreter
+        self.content = Path(path).read_bytes() if content is None else content
+        self.threads = threads
+        self.interpreter = Interpreter(model_content=self.content, num_threads=threads)
+        self.input = self.interpreter.get_input_details()[0]['index']
+        self.output = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = None  # batch size the tensors are allocated for
+        # an interpreter can only run one inference at a time
+        self._lock = threading.Lock()
+
+    def predict(self, tensor):
+        """Predicts the classes of a batch of characters
+
+        Args:
+            tensor (4d numpy array): characters with shape (n, 28, 28, 1)
+
+        Returns:
+            2d numpy array: probabilities of every class for every character
+
+        Notes:
+            The tensors are allocated again for every new batch size, so the
+            batch sizes should come from a small set.
+        """
+        tensor = np.asarray(tensor, dtype=np.float32)
+        with self._lock:
+            if len(tensor) != self.batch_size:
+                self.interpreter.resize_tensor_input(self.input, tensor.shape)
+                self.interpreter.allocate_tensors()
+                self.batch_size = len(tensor)
+            self.interpreter.set_tensor(self.input, tensor)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output)
+
+    predict_on_batch = predict
+
+    def copy(self):
+        """Returns a new interpreter of the same flatbuffer, e.g. for a forked process
+
+        Notes:
+            The thread pool of an interpreter does not survive a fork, the
+            flatbuffer is shared with the parent process and not read again.
+        """
+        return TFLiteCNN(content=self.content, threads=self.threads)
+
+    def count_params(self):
+        """Returns None, the flatbuffer does not tell weights and activations apart"""
+        return None
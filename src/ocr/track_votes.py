@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+"""Voting over the reads of a tracked license plate, character by character"""
+from collections import Counter
+import src.ocr.ocr as ocr
+from src.ocr.confidence import CONFIDENCE_LVL
+
+
+class PlateVotes():
+    """Reads of one tracked plate, voted on per character position.
+
+    The reads are grouped by their length, since a missed or an extra
+    character shifts every position behind it. The plate text is the most
+    voted character of every position of the most frequent length, so a
+    character misread in a single frame is outvoted by the other frames.
+    """
+
+    def __init__(self):
+        """Starts without reads"""
+        self.lengths = Counter()
+        self.positions = {}  # one Counter per character position, by length of the read
+        self.crops = {}  # score and cut out of the best read, by length of the read
+        self.text = None  # plate text, once it is confirmed
+
+    def vote(self, text, crop, score):
+        """Adds a read of the plate
+
+        Args:
+            text (str): string of detected Plate Text
+            crop (numpy 3d array): cut out of the plate the text was read from
+            score (float): mean probability of the characters of the read
+        """
+        length = len(text)
+        self.lengths[length] += 1
+        if length not in self.positions:
+            self.positions[length] = [Counter() for _ in range(length)]
+        for position, character in zip(self.positions[length], text):
+            position[character] += 1
+        if length not in self.crops or score > self.crops[length][0]:
+            self.crops[length] = (score, crop)
+
+    def consensus(self):
+        """Returns the voted text and the votes of its least certain character
+
+        Returns:
+            tuple: plate text, or None without reads, and the number of votes
+        """
+        if not self.lengths:
+            return None, 0
+        length = self.lengths.most_common(1)[0][0]
+        winners = [position.most_common(1)[0] for position in self.positions[length]]
+        return ''.join(character for character, _ in winners), \
+            min((votes for _, votes in winners), default=0)
+
+    def best_crop(self):
+        """Returns the cut out with the highest score among the reads of the voted length"""
+        if not self.lengths:
+            return None
+        return self.crops[self.lengths.most_common(1)[0][0]][1]
+
+
+class TrackVotes():
+    """Votes of every plate track, confirms a track once its text is certain.
+
+    A track is confirmed when every character of its voted text was read the
+    same at least level times and the text is a plausible plate. Confirmed
+    tracks do not have to be read again. Tracks that were not seen for
+    max_age frames are forgotten, so the votes do not grow with the video.
+    """
+
+    def __init__(self, level=CONFIDENCE_LVL, max_age=None):
+        """Starts without tracks
+
+        Args:
+            level (int): number of votes every character of the text needs
+            max_age (int): number of frames without a sighting after which evict
+                forgets a track, None keeps every track
+        """
+        self.level = level
+        self.max_age = max_age
+        self.tracks = {}
+        self.last_seen = {}  # latest frame of every track, by track id
+
+    def confirmed(self, track_id):
+        """Returns if the text of a track is confirmed"""
+        return track_id in self.tracks and self.tracks[track_id].text is not None
+
+    def vote(self, track_id, text, crop, score, frame=None):  # pylint: disable=R0913
+        """Adds a read of a track, see PlateVotes.vote
+
+        Args:
+            frame (int): frame the plate was read from, None does not count as sighting
+
+        Returns:
+            str: The plate text, if this read confirmed the track, else None
+        """
+        if frame is not None:
+            self.seen(track_id, frame)
+        if text == ocr.NOT_DETECTED or self.confirmed(track_id):
+            return None
+        votes = self.tracks.setdefault(track_id, PlateVotes())
+        votes.vote(text, crop, score)
+        text, certainty = votes.consensus()
+        if certainty >= self.level and ocr.plausible(text):
+            votes.text = text
+            return text
+        return None
+
+    def text(self, track_id):
+        """Returns the voted text of a track, confirmed or not, None for unknown tracks"""
+        return self.tracks[track_id].consensus()[0] if track_id in self.tracks else None
+
+    def best_crop(self, track_id):
+        """Returns the best cut out of a track, see PlateVotes.best_crop"""
+        return self.tracks[track_id].best_crop() if track_id in self.tracks else None
+
+    def seen(self, track_id, frame):
+        """Records a sighting of a track, e.g. of a confirmed one that is not read again"""
+        self.last_seen[track_id] = max(frame, self.last_seen.get(track_id, frame))
+
+    def forget(self, track_id):
+        """Drops the votes of a track, e.g. once the tracker lost it"""
+        self.tracks.pop(track_id, None)
+        self.last_seen.pop(track_id, None)
+
+    def evict(self, frame):
+        """Forgets the tracks that were not seen within max_age frames before frame
+
+        Returns:
+            int: number of forgotten tracks
+        """
+        if self.max_age is None:
+            return 0
+        stale = [track_id for track_id, seen in self.last_seen.items()
+                 if seen <= frame - self.max_age]
+        for track_id in stale:
+            self.forget(track_id)
+        return len(stale)
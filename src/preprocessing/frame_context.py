@@ -0,0 +1,78 @@
+"""Module for the preprocessing that is shared between the detectors of a frame"""
+
+from functools import cached_property
+import cv2
+import numpy as np
+
+
+class FrameContext():
+    """Per frame cache of the preprocessing steps.
+
+    A FrameContext is created once per frame and handed to every detector and
+    to the OCR. Each transform is computed the first time it is requested and
+    reused afterwards, so it runs at most once per frame.
+
+    Notes:
+        The values are computed from the frame at the time they are first
+        requested, later changes of the frame (e.g. drawn bounding boxes)
+        are not reflected in values that were already computed.
+    """
+
+    def __init__(self, image):
+        """Initialize the cache.
+
+        Args:
+            image: BGR frame as an array
+        """
+
+        self.image = image
+        self.resized_cache = {}
+
+    @cached_property
+    def mean(self):
+        """Mean value of the frame as int"""
+        return int(np.mean(self.image))
+
+    @cached_property
+    def gray(self):
+        """Gray scale version of the frame"""
+        return cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+
+    @cached_property
+    def blurred(self):
+        """Gray frame smoothed with a 5x5 gaussian kernel"""
+        return cv2.GaussianBlur(self.gray, (5, 5), 0)
+
+    @cached_property
+    def thresh(self):
+        """Adaptive threshold of the blurred frame, as used by detection and OCR"""
+        return cv2.adaptiveThreshold(self.blurred, 255, 1, 1, 11, 2)
+
+    def resized(self, width, height, gray=False):
+        """Downscaled level of the frame.
+
+        Args:
+            width, height: size of the level in pixels
+            gray: if True the gray frame is resized, else the color frame
+        Return:
+            The frame resized with cv2.INTER_AREA
+        """
+
+        key = (width, height, gray)
+        if key not in self.resized_cache:
+            source = self.gray if gray else self.image
+            self.resized_cache[key] = cv2.resize(source, (width, height),
+                                                 interpolation=cv2.INTER_AREA)
+        return self.resized_cache[key]
+
+    def cutout(self, box, name='image'):
+        """View of a box of the frame or of one of its transforms.
+
+        Args:
+            box: [x, y, width, height] of the cut out
+            name: 'image', 'gray', 'blurred' or 'thresh'
+        Return:
+            View into the cached array, nothing is copied
+        """
+
+        return getattr(self, name)[box[1]: box[1] + box[3], box[0]: box[0] + box[2]]
@@ -0,0 +1,91 @@
+"""Tests for the FrameContext preprocessing cache"""
+
+import os
+from pathlib import Path
+from mock import patch
+import numpy as np
+import cv2
+from src.preprocessing.frame_context import FrameContext
+from src.detect_platings.detect_platings import read_image, PlateDetector
+from src.ocr.ocr import cutout, find_characters, preprocess_image, recognize_characters
+
+
+path_frames = Path(__file__).parent.parent / 'detect_platings' / 'Test Bilder'
+img = cv2.imread(str(path_frames / '1.jpg'))
+
+
+def detected_plates():
+    """Returns every plate the detector finds on the test frames, cut out once from the
+    threshold of the whole frame and once preprocessed on its own"""
+    detector = PlateDetector()
+    plates = []
+    for name in sorted(os.listdir(path_frames)):
+        frame = cv2.imread(str(path_frames / name))
+        context = FrameContext(frame)
+        for box in detector.detect(frame, context=context):
+            plate = cutout(frame, [box])[0]
+            plates.append((plate, context.cutout(box, 'thresh')))
+    return plates
+
+
+def test_same_results():
+    """Tests that the cached transforms equal the ones of the detectors and the OCR"""
+
+    context = FrameContext(img)
+    blurred, mean = read_image(img)
+    assert context.mean == mean
+    assert np.all(context.blurred == blurred)
+    assert np.all(context.thresh == preprocess_image(img))
+    resized = cv2.resize(img, (400, 300), interpolation=cv2.INTER_AREA)
+    assert np.all(context.resized(400, 300) == resized)
+
+
+def test_computed_once():
+    """Tests that every transform runs at most once per frame, even if it is
+    requested several times and by the transforms depending on it."""
+
+    context = FrameContext(img)
+    with patch('src.preprocessing.frame_context.cv2.cvtColor', wraps=cv2.cvtColor) as gray, \
+            patch('src.preprocessing.frame_context.cv2.GaussianBlur',
+                  wraps=cv2.GaussianBlur) as blur, \
+            patch('src.preprocessing.frame_context.cv2.resize', wraps=cv2.resize) as resize:
+        for _ in range(3):
+            _ = context.thresh, context.blurred, context.gray
+            context.resized(200, 150)
+            context.resized(200, 150, gray=True)
+    assert gray.call_count == 1
+    assert blur.call_count == 1
+    assert resize.call_count == 2
+
+
+def test_cutout_view():
+    """Tests that cut outs are views into the cached arrays"""
+
+    context = FrameContext(img)
+    box = [10, 20, 30, 40]
+    cut = context.cutout(box, 'thresh')
+    assert cut.shape == (40, 30)
+    assert np.shares_memory(cut, context.thresh)
+    assert np.shares_memory(context.cutout(box), img)
+
+
+def test_plate_threshold_parity():
+    """Tests that cutting the plates out of the frame threshold finds as many characters
+    as preprocessing every plate, and reads the same strings
+
+    Notes:
+        Pixels close to the border of a plate can differ, since the adaptive threshold
+        sees the neighborhood outside of the plate. On the test frames this changes
+        the box of one character of a single plate, which is why the OCRWorker only
+        uses the frame threshold with frame_threshold=True.
+    """
+    plates = detected_plates()
+    assert len(plates) > 10
+    for plate, processed in plates:
+        found, characters, _ = find_characters(plate)
+        found_frame, characters_frame, _ = find_characters(plate, processed)
+        assert found == found_frame
+        if found:
+            assert len(characters) == len(characters_frame)
+        assert recognize_characters(found, characters) == \
+            recognize_characters(found_frame, characters_frame)